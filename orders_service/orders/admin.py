@@ -1,22 +1,197 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import Q
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
 from .models import Order, OrderItem
 
+
+def estimate_table_rows(model):
+    """Row count from the database's table statistics, or None if unavailable."""
+    connection = connections[model.objects.db]
+    table = model._meta.db_table
+    if connection.vendor == 'mysql':
+        sql = (
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+        )
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the table statistics instead of an exact COUNT(*) for unfiltered
+    changelists on large tables. Filtered changelists still count exactly,
+    since their filters run against indexes.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimate_table_rows(queryset.model)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super().count
+
+
+def exact_search(queryset, search_term, numeric_fields, text_fields):
+    """
+    Exact-match lookups that can use an index, instead of the admin's
+    default LIKE '%term%' scan on every search field.
+    """
+    search_term = search_term.strip()
+    if not search_term:
+        return queryset
+    query = Q()
+    if search_term.isdigit():
+        for field in numeric_fields:
+            query |= Q(**{field: int(search_term)})
+    for field in text_fields:
+        query |= Q(**{field: search_term})
+    return queryset.filter(query) if query else queryset.none()
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """Shows one page of related rows instead of every one of them."""
+    per_page = 20
+    page_param = 'items_page'
+    page_number = 1
+
+    def get_queryset(self):
+        if not hasattr(self, '_page_queryset'):
+            queryset = super().get_queryset()
+            self.total_count = queryset.count()
+            self.num_pages = max(1, -(-self.total_count // self.per_page))
+            self.page_number = min(max(1, self.page_number), self.num_pages)
+            offset = (self.page_number - 1) * self.per_page
+            page_ids = list(queryset.values_list('pk', flat=True)[offset:offset + self.per_page])
+            self._page_queryset = queryset.filter(pk__in=page_ids)
+        return self._page_queryset
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+
+def previous_item_totals(item_ids):
+    """{item_id: (order_id, total_price)} as stored, locking the rows for the item write."""
+    return {
+        pk: (order_id, total_price)
+        for pk, order_id, total_price in OrderItem.objects.select_for_update().filter(
+            pk__in=item_ids
+        ).values_list('pk', 'order_id', 'total_price')
+    }
+
+
+def apply_total_deltas(deltas):
+    """Shift each order's total by its summed item delta, with its rollups and outbox event."""
+    for order_id in sorted(deltas):
+        Order.apply_total_delta(order_id, deltas[order_id])
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
     readonly_fields = ['total_price']
+    formset = PaginatedInlineFormSet
+    template = 'admin/orders/paginated_tabular.html'
+    ordering = ['id']
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        try:
+            page_number = int(request.GET.get(PaginatedInlineFormSet.page_param, 1))
+        except ValueError:
+            page_number = 1
+        formset.page_number = page_number
+        return formset
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'user_id', 'status', 'total_amount', 'payment_status', 'created_at']
-    list_filter = ['status', 'payment_status', 'created_at']
-    search_fields = ['id', 'user_id', 'tracking_number']
-    readonly_fields = ['created_at', 'updated_at']
+    list_filter = ['status', 'payment_status']
+    date_hierarchy = 'created_at'
+    search_fields = ['=id', '=user_id', '=tracking_number']
+    search_help_text = 'Exact order ID, user ID or tracking number'
+    # total_amount follows the items, which adjust it as they are saved
+    readonly_fields = ['total_amount', 'created_at', 'updated_at']
     inlines = [OrderItemInline]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        return exact_search(queryset, search_term, ['pk', 'user_id'], ['tracking_number']), False
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.total_amount = 0
+        super().save_model(request, obj, form, change)
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not OrderItem:
+            return super().save_formset(request, form, formset, change)
+        with transaction.atomic():
+            items = formset.save(commit=False)
+            previous = previous_item_totals(
+                [item.pk for item in items if item.pk is not None] + [item.pk for item in formset.deleted_objects]
+            )
+            delta = 0
+            for item in formset.deleted_objects:
+                item.delete()
+                delta -= previous[item.pk][1]
+            for item in items:
+                before = previous[item.pk][1] if item.pk in previous else 0
+                item.save()
+                delta += item.total_price - before
+            formset.save_m2m()
+            apply_total_deltas({form.instance.pk: delta})
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['id', 'order', 'product_name', 'quantity', 'unit_price', 'total_price']
-    list_filter = ['created_at']
-    search_fields = ['product_name', 'order__id']
+    list_select_related = ['order']
+    search_fields = ['=order__id', '=product_id']
+    search_help_text = 'Exact order ID or product ID'
     readonly_fields = ['total_price', 'created_at']
+    raw_id_fields = ['order']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        return exact_search(queryset, search_term, ['order_id', 'product_id'], []), False
+
+    # Item writes adjust the order totals, as OrderItemViewSet does
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            previous = previous_item_totals([obj.pk]) if change else {}
+            obj.save()
+            deltas = {obj.order_id: obj.total_price}
+            if obj.pk in previous:
+                order_id, total_price = previous[obj.pk]
+                deltas[order_id] = deltas.get(order_id, 0) - total_price
+            apply_total_deltas(deltas)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            order_id, total_price = previous_item_totals([obj.pk])[obj.pk]
+            obj.delete()
+            apply_total_deltas({order_id: -total_price})
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            deltas = {}
+            for order_id, total_price in queryset.select_for_update().values_list('order_id', 'total_price'):
+                deltas[order_id] = deltas.get(order_id, 0) - total_price
+            queryset.delete()
+            apply_total_deltas(deltas)
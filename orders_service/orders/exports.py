@@ -0,0 +1,79 @@
+import csv
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import ArchivedOrder
+from .serializers import ArchivedOrderSerializer, OrderSerializer
+
+EXPORT_CHUNK_SIZE = 2000
+
+ORDER_COLUMNS = [
+    'id', 'user_id', 'status', 'total_amount', 'shipping_address',
+    'billing_address', 'created_at', 'updated_at', 'payment_status',
+    'tracking_number',
+]
+ITEM_COLUMNS = ['id', 'product_id', 'product_name', 'quantity', 'unit_price', 'total_price', 'created_at']
+
+
+class Echo:
+    """File-like object whose write() hands the row back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def iter_orders(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield orders (with their items prefetched) in primary key order, one
+    keyset-paginated chunk at a time, so only a single chunk is ever held in
+    memory regardless of how many rows the queryset matches.
+    """
+    queryset = queryset.prefetch_related('items').order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_pk = chunk[-1].pk
+
+
+def iter_order_data(querysets):
+    """
+    Serialized orders from each queryset in turn, archived ones included;
+    pass the archive first to keep the output roughly in id order.
+    """
+    for queryset in querysets:
+        for order in iter_orders(queryset):
+            if isinstance(order, ArchivedOrder):
+                yield ArchivedOrderSerializer(order).data
+            else:
+                yield OrderSerializer(order).data
+
+
+def iter_csv(querysets):
+    """One row per order item, with the order columns repeated on each row."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(
+        [f'order_{column}' for column in ORDER_COLUMNS] + [f'item_{column}' for column in ITEM_COLUMNS]
+    )
+    empty_item = [''] * len(ITEM_COLUMNS)
+    for data in iter_order_data(querysets):
+        order_row = [data[column] for column in ORDER_COLUMNS]
+        if not data['items']:
+            yield writer.writerow(order_row + empty_item)
+        for item in data['items']:
+            yield writer.writerow(order_row + [item[column] for column in ITEM_COLUMNS])
+
+
+def iter_ndjson(querysets):
+    """One JSON document per order, with its items nested."""
+    for data in iter_order_data(querysets):
+        yield json.dumps(data, cls=JSONEncoder) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv'),
+    'ndjson': (iter_ndjson, 'application/x-ndjson'),
+}
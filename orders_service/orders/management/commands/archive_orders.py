@@ -0,0 +1,68 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Move DELIVERED and CANCELLED orders past the archive age, with their items, '
+        'from the hot tables into the archive tables in committed batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.ORDERS_ARCHIVE_AFTER_DAYS,
+            help='Archive orders created more than this many days ago'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders moved per transaction')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Pause between batches, in seconds')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after moving this many orders')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        candidates = Order.objects.filter(
+            status__in=Order.final_statuses(),
+            created_at__lt=cutoff
+        )
+        moved_orders = moved_items = 0
+
+        # Every batch commits on its own, so an interrupted run simply
+        # resumes with whatever is still left in the hot tables.
+        while options['limit'] is None or moved_orders < options['limit']:
+            batch_size = options['batch_size']
+            if options['limit'] is not None:
+                batch_size = min(batch_size, options['limit'] - moved_orders)
+
+            with transaction.atomic():
+                orders = list(candidates.select_for_update().order_by('pk')[:batch_size])
+                if not orders:
+                    break
+                order_ids = [order.pk for order in orders]
+                items = list(OrderItem.objects.filter(order_id__in=order_ids))
+
+                ArchivedOrder.objects.bulk_create(
+                    [ArchivedOrder.from_order(order) for order in orders], ignore_conflicts=True
+                )
+                ArchivedOrderItem.objects.bulk_create(
+                    [ArchivedOrderItem.from_item(item) for item in items], ignore_conflicts=True
+                )
+                # Queryset deletes skip Order.delete(), so the revenue
+                # rollups keep counting archived orders.
+                OrderItem.objects.filter(order_id__in=order_ids).delete()
+                Order.objects.filter(pk__in=order_ids).delete()
+
+            moved_orders += len(orders)
+            moved_items += len(items)
+            self.stdout.write(f'Archived {moved_orders} orders and {moved_items} items (up to id {order_ids[-1]})')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved_orders} orders and {moved_items} items created before {cutoff:%Y-%m-%d}'
+        ))
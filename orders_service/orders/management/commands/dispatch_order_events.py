@@ -0,0 +1,112 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from orders.models import OutboxCursor, OutboxEvent
+from orders.outbox import load_sinks
+
+
+class Command(BaseCommand):
+    help = 'Deliver order lifecycle events from the outbox to the sinks in ORDER_EVENT_SINKS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sink', action='append', dest='sinks', help='Only drain this sink (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Events per delivery')
+        parser.add_argument('--max-retries', type=int, default=5, help='Retries per batch before giving up on a sink')
+        parser.add_argument('--backoff', type=float, default=0.5, help='Initial retry delay in seconds, doubled per retry')
+        parser.add_argument(
+            '--settle-seconds', type=float, default=2.0,
+            help='Skip events younger than this, so transactions that committed out of id order are not passed over'
+        )
+        parser.add_argument('--follow', action='store_true', help='Keep polling for new events')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Idle sleep between polls with --follow')
+        parser.add_argument('--purge', action='store_true', help='Delete events every configured sink has received')
+
+    def handle(self, *args, **options):
+        try:
+            sinks = load_sinks(options['sinks'])
+        except ImproperlyConfigured as exc:
+            raise CommandError(exc)
+        if not sinks:
+            raise CommandError('No order event sinks are configured')
+
+        try:
+            while True:
+                delivered = sum(self.drain(sink, options) for sink in sinks)
+                if options['purge']:
+                    self.purge(options['batch_size'])
+                if not options['follow']:
+                    break
+                if not delivered:
+                    time.sleep(options['poll_interval'])
+        finally:
+            for sink in sinks:
+                sink.close()
+
+    def drain(self, sink, options):
+        cursor, _ = OutboxCursor.objects.get_or_create(sink=sink.name)
+        started = time.monotonic()
+        delivered = batches = 0
+
+        while True:
+            settled = timezone.now() - timedelta(seconds=options['settle_seconds'])
+            events = list(
+                OutboxEvent.objects.filter(id__gt=cursor.last_event_id, created_at__lte=settled)
+                .order_by('id')[:options['batch_size']]
+            )
+            if not events or not self.deliver(sink, events, options):
+                break
+            cursor.last_event_id = events[-1].id
+            cursor.save(update_fields=['last_event_id', 'updated_at'])
+            delivered += len(events)
+            batches += 1
+
+        if delivered:
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'{sink.name}: delivered {delivered} events in {batches} batches, '
+                f'{elapsed:.2f}s ({delivered / elapsed if elapsed else delivered:.0f} events/s), '
+                f'cursor at {cursor.last_event_id}'
+            )
+        return delivered
+
+    def deliver(self, sink, events, options):
+        messages = [event.as_message() for event in events]
+        for attempt in range(options['max_retries'] + 1):
+            try:
+                sink.send(messages)
+                return True
+            except Exception as exc:  # Sinks are pluggable, any failure means retry
+                if attempt == options['max_retries']:
+                    self.stderr.write(
+                        f'{sink.name}: giving up on events {events[0].id}-{events[-1].id} after '
+                        f'{attempt + 1} attempts: {exc}'
+                    )
+                    return False
+                delay = options['backoff'] * 2 ** attempt
+                self.stderr.write(f'{sink.name}: delivery failed ({exc}), retrying in {delay:.1f}s')
+                time.sleep(delay)
+
+    def purge(self, batch_size):
+        configured = list(getattr(settings, 'ORDER_EVENT_SINKS', {}))
+        cursors = OutboxCursor.objects.filter(sink__in=configured)
+        if not configured or cursors.count() < len(configured):
+            return
+        acknowledged = cursors.aggregate(last=Min('last_event_id'))['last']
+        purged = 0
+        while True:
+            ids = list(
+                OutboxEvent.objects.filter(id__lte=acknowledged)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            purged += OutboxEvent.objects.filter(id__in=ids).delete()[0]
+        if purged:
+            self.stdout.write(f'Purged {purged} delivered events')
@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+from orders.models import ArchivedOrder, DailyOrderRollup, Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the daily order revenue rollups from order history, hot and archived, '
+        'scanning orders in primary key chunks. Do not run it alongside archive_orders.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Orders aggregated per query')
+
+    def aggregate_range(self, model, totals, lower_pk, upper_pk=None):
+        orders = model.objects.filter(pk__gt=lower_pk)
+        if upper_pk is not None:
+            orders = orders.filter(pk__lte=upper_pk)
+        rows = (
+            orders.order_by()
+            .values('status', 'payment_status', day=TruncDate('created_at'))
+            .annotate(order_count=Count('id'), amount=Sum('total_amount'))
+        )
+        scanned = 0
+        for row in rows:
+            key = (row['day'], row['status'], row['payment_status'])
+            count, amount = totals.get(key, (0, Decimal('0')))
+            totals[key] = (count + row['order_count'], amount + row['amount'])
+            scanned += row['order_count']
+        return scanned
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        totals = {}
+        scanned = 0
+        # Archived orders still count in the rollups (archive_orders leaves
+        # them there), so both tables are aggregated.
+        last_pks = {Order: 0, ArchivedOrder: 0}
+
+        for model in last_pks:
+            while True:
+                boundary = (
+                    model.objects.filter(pk__gt=last_pks[model])
+                    .order_by('pk')
+                    .values_list('pk', flat=True)[chunk_size - 1:chunk_size]
+                )
+                upper_pk = next(iter(boundary), None)
+                if upper_pk is None:
+                    break
+                scanned += self.aggregate_range(model, totals, last_pks[model], upper_pk)
+                last_pks[model] = upper_pk
+                self.stdout.write(
+                    f'Aggregated {scanned} orders (up to {model._meta.verbose_name} id {upper_pk})'
+                )
+
+        with transaction.atomic():
+            # Pick up the final partial chunk and anything inserted while
+            # scanning, then swap the rollups in one go.
+            for model, last_pk in last_pks.items():
+                scanned += self.aggregate_range(model, totals, last_pk)
+            DailyOrderRollup.objects.all().delete()
+            DailyOrderRollup.objects.bulk_create(
+                [
+                    DailyOrderRollup(
+                        day=day,
+                        status=order_status,
+                        payment_status=payment_status,
+                        order_count=count,
+                        total_amount=amount
+                    )
+                    for (day, order_status, payment_status), (count, amount) in totals.items()
+                ],
+                batch_size=1000
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(totals)} rollup buckets from {scanned} orders'
+        ))
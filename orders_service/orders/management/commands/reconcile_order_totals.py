@@ -0,0 +1,106 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from orders.models import DailyOrderRollup, Order, OrderItem, OutboxEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Find orders whose total_amount differs from the sum of their items, "
+        "one aggregate query per primary key chunk, and optionally fix them in bulk"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rewrite drifted totals from their items')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Orders checked per aggregate query')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        items_total = Coalesce(
+            Sum('items__total_price'),
+            Value(Decimal('0')),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2)
+        )
+        summed_items = Coalesce(
+            Subquery(
+                OrderItem.objects.filter(order_id=OuterRef('pk'))
+                .order_by()
+                .values('order_id')
+                .annotate(total=Sum('total_price'))
+                .values('total')
+            ),
+            Value(Decimal('0')),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2)
+        )
+
+        last_pk = 0
+        checked = drifted = fixed = 0
+        while True:
+            chunk = list(
+                Order.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:chunk_size]
+            )
+            if not chunk:
+                break
+            upper_pk = chunk[-1]
+            checked += len(chunk)
+
+            rows = list(
+                Order.objects.filter(pk__gt=last_pk, pk__lte=upper_pk)
+                .annotate(items_total=items_total)
+                .exclude(total_amount=F('items_total'))
+                .order_by('pk')
+                .values('pk', 'total_amount', 'items_total')
+            )
+            drifted += len(rows)
+            for row in rows:
+                self.stdout.write(
+                    f"Order #{row['pk']}: total_amount {row['total_amount']} != items {row['items_total']}"
+                )
+
+            if rows and options['fix']:
+                fixed += self.fix([row['pk'] for row in rows], summed_items)
+            last_pk = upper_pk
+
+        summary = f'Checked {checked} orders, {drifted} drifted'
+        if options['fix']:
+            summary += f', {fixed} fixed'
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def fix(self, order_ids, summed_items):
+        with transaction.atomic():
+            # Re-read the drifted orders under lock so the rollup deltas match
+            # exactly what the UPDATE below writes.
+            orders = list(
+                Order.objects.select_for_update()
+                .filter(pk__in=order_ids)
+                .only(*DailyOrderRollup.SOURCE_FIELDS)
+            )
+            sums = dict(
+                OrderItem.objects.filter(order_id__in=order_ids)
+                .order_by()
+                .values('order_id')
+                .annotate(total=Sum('total_price'))
+                .values_list('order_id', 'total')
+            )
+            deltas = {}
+            for order in orders:
+                day, order_status, payment_status, amount = order.rollup_state()
+                delta = sums.get(order.pk, Decimal('0')) - amount
+                count, total = deltas.get((day, order_status, payment_status), (0, Decimal('0')))
+                deltas[(day, order_status, payment_status)] = (count, total + delta)
+
+            # A new updated_at changes the ETag, and the outbox tells consumers
+            now = timezone.now()
+            updated = Order.objects.filter(pk__in=order_ids).update(total_amount=summed_items, updated_at=now)
+            DailyOrderRollup.objects.apply_deltas(deltas)
+            OutboxEvent.objects.order_updated([
+                (order.pk, {'total_amount': sums.get(order.pk, Decimal('0'))}, now) for order in orders
+            ])
+        return updated
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-17 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['tracking_number'], name='orders_orde_trackin_04edf9_idx'),
+        ),
+    ]
@@ -1,5 +1,11 @@
-from django.db import models
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -9,6 +15,14 @@ class Order(models.Model):
         ('DELIVERED', 'Delivered'),
         ('CANCELLED', 'Cancelled'),
     ]
+    # Allowed moves between statuses; DELIVERED and CANCELLED are final
+    STATUS_TRANSITIONS = {
+        'PENDING': ['PROCESSING', 'CANCELLED'],
+        'PROCESSING': ['SHIPPED', 'CANCELLED'],
+        'SHIPPED': ['DELIVERED'],
+        'DELIVERED': [],
+        'CANCELLED': [],
+    }
 
     user_id = models.IntegerField()  # Reference to user in the users microservice
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
@@ -19,13 +33,123 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     payment_status = models.CharField(max_length=20, default='PENDING')
     tracking_number = models.CharField(max_length=100, blank=True, null=True)
+    # Client-supplied Idempotency-Key of the create request, so a retried
+    # create returns the original order instead of a duplicate
+    idempotency_key = models.CharField(max_length=100, blank=True, null=True, unique=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination order, plus the hot filter + ordering paths
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['user_id', 'created_at']),
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['payment_status', 'created_at']),
+            models.Index(fields=['tracking_number']),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.status}"
 
+    @property
+    def version(self):
+        """Opaque token that changes on every write, served as the ETag."""
+        return self.updated_at.astimezone(dt_timezone.utc).strftime('%Y%m%d%H%M%S%f')
+
+    def event_payload(self, items=None):
+        """Snapshot of the order, and optionally its items, for outbox events."""
+        payload = {
+            'id': self.id,
+            'user_id': self.user_id,
+            'status': self.status,
+            'payment_status': self.payment_status,
+            'total_amount': self.total_amount,
+            'tracking_number': self.tracking_number,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+        if items is not None:
+            payload['items'] = [
+                {
+                    'product_id': item.product_id,
+                    'product_name': item.product_name,
+                    'quantity': item.quantity,
+                    'unit_price': item.unit_price,
+                    'total_price': item.total_price,
+                }
+                for item in items
+            ]
+        return payload
+
+    @classmethod
+    def apply_total_delta(cls, order_id, delta):
+        """
+        Shift an order's total_amount by delta with an atomic F() update,
+        keeping the revenue rollups in step. Call inside the transaction that
+        writes the item change.
+        """
+        order = cls.objects.select_for_update().only(*DailyOrderRollup.SOURCE_FIELDS).get(pk=order_id)
+        if not delta:
+            return order
+        now = timezone.now()
+        cls.objects.filter(pk=order_id).update(total_amount=F('total_amount') + delta, updated_at=now)
+        day, order_status, payment_status, amount = order.rollup_state()
+        DailyOrderRollup.objects.apply_deltas({(day, order_status, payment_status): (0, delta)})
+        OutboxEvent.objects.order_updated([(order_id, {'total_amount': amount + delta}, now)])
+        return order
+
+    @classmethod
+    def final_statuses(cls):
+        return [status for status, targets in cls.STATUS_TRANSITIONS.items() if not targets]
+
+    @classmethod
+    def statuses_leading_to(cls, target_status):
+        return [
+            status for status, targets in cls.STATUS_TRANSITIONS.items()
+            if target_status in targets
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in DailyOrderRollup.SOURCE_FIELDS):
+            instance._rollup_state = instance.rollup_state()
+        return instance
+
+    def rollup_state(self):
+        """The (day, status, payment_status, amount) this order counts towards."""
+        return (
+            timezone.localdate(self.created_at),
+            self.status,
+            self.payment_status,
+            Decimal(self.total_amount),
+        )
+
+    def _stored_rollup_state(self):
+        if self._state.adding:
+            return None
+        state = getattr(self, '_rollup_state', None)
+        if state is None:
+            stored = Order.objects.filter(pk=self.pk).only(*DailyOrderRollup.SOURCE_FIELDS).first()
+            state = stored.rollup_state() if stored is not None else None
+        return state
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = self._stored_rollup_state()
+            super().save(*args, **kwargs)
+            current = self.rollup_state()
+            DailyOrderRollup.objects.move(previous, current)
+        self._rollup_state = current
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = self._stored_rollup_state()
+            result = super().delete(*args, **kwargs)
+            DailyOrderRollup.objects.move(previous, None)
+        self._rollup_state = None
+        return result
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product_id = models.IntegerField()  # Reference to product in the products microservice
@@ -36,8 +160,200 @@ class OrderItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.quantity}x {self.product_name} in Order #{self.order.id}"
+        return f"{self.quantity}x {self.product_name} in Order #{self.order_id}"
+
+    @staticmethod
+    def compute_total_price(quantity, unit_price):
+        return quantity * unit_price
 
     def save(self, *args, **kwargs):
-        self.total_price = self.quantity * self.unit_price
+        self.total_price = self.compute_total_price(self.quantity, self.unit_price)
         super().save(*args, **kwargs)
+
+
+class ArchivedOrder(models.Model):
+    """
+    Completed order moved out of the hot Order table by the archive_orders
+    command. Keeps the original id and timestamps.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user_id = models.IntegerField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    shipping_address = models.TextField()
+    billing_address = models.TextField()
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    payment_status = models.CharField(max_length=20)
+    tracking_number = models.CharField(max_length=100, blank=True, null=True)
+    idempotency_key = models.CharField(max_length=100, blank=True, null=True, editable=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['user_id', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Archived Order #{self.id} - {self.status}"
+
+    @classmethod
+    def from_order(cls, order):
+        return cls(**{field.attname: getattr(order, field.attname) for field in Order._meta.concrete_fields})
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, related_name='items', on_delete=models.CASCADE)
+    product_id = models.IntegerField()
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    product_name = models.CharField(max_length=255)
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.quantity}x {self.product_name} in Archived Order #{self.order_id}"
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(**{field.attname: getattr(item, field.attname) for field in OrderItem._meta.concrete_fields})
+
+
+def _add_rollup_delta(deltas, state, sign):
+    day, order_status, payment_status, amount = state
+    key = (day, order_status, payment_status)
+    count, total = deltas.get(key, (0, Decimal('0')))
+    deltas[key] = (count + sign, total + sign * amount)
+
+class DailyOrderRollupManager(models.Manager):
+    def apply_deltas(self, deltas):
+        """
+        Apply {(day, status, payment_status): (order_count, amount)} deltas
+        with atomic F() increments, creating missing buckets on the fly.
+        """
+        for (day, status, payment_status), (count, amount) in deltas.items():
+            if not count and not amount:
+                continue
+            bucket = self.filter(day=day, status=status, payment_status=payment_status)
+            increment = {
+                'order_count': F('order_count') + count,
+                'total_amount': F('total_amount') + amount,
+            }
+            if bucket.update(**increment):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(
+                        day=day,
+                        status=status,
+                        payment_status=payment_status,
+                        order_count=count,
+                        total_amount=amount
+                    )
+            except IntegrityError:
+                # Another writer created the bucket first
+                bucket.update(**increment)
+
+    def move(self, previous, current):
+        """Move one order from its previous rollup state to its current one."""
+        self.move_many([(previous, current)])
+
+    def move_many(self, moves):
+        """Apply many (previous, current) rollup state moves at once."""
+        deltas = {}
+        for previous, current in moves:
+            if previous == current:
+                continue
+            if previous is not None:
+                _add_rollup_delta(deltas, previous, -1)
+            if current is not None:
+                _add_rollup_delta(deltas, current, 1)
+        self.apply_deltas(deltas)
+
+    def record_created(self, orders):
+        """Count freshly inserted orders, e.g. after a bulk_create."""
+        deltas = {}
+        for order in orders:
+            order._rollup_state = order.rollup_state()
+            _add_rollup_delta(deltas, order._rollup_state, 1)
+        self.apply_deltas(deltas)
+
+class DailyOrderRollup(models.Model):
+    """
+    Order count and revenue per day, status and payment status, kept up to
+    date incrementally as orders are written.
+    """
+    SOURCE_FIELDS = ('created_at', 'status', 'payment_status', 'total_amount')
+
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_status = models.CharField(max_length=20)
+    order_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    objects = DailyOrderRollupManager()
+
+    class Meta:
+        ordering = ['day', 'status', 'payment_status']
+        unique_together = ('day', 'status', 'payment_status')
+
+    def __str__(self):
+        return f"{self.day} {self.status}/{self.payment_status}: {self.order_count} orders"
+
+
+class OutboxEventManager(models.Manager):
+    def order_created(self, orders_with_items):
+        """Record order.created events for (order, items) pairs."""
+        return self.bulk_create([
+            OutboxEvent(event_type='order.created', order_id=order.id, payload=order.event_payload(items))
+            for order, items in orders_with_items
+        ], batch_size=500)
+
+    def order_updated(self, updates):
+        """Record order.updated events for (order_id, changes, updated_at) triples."""
+        return self.bulk_create([
+            OutboxEvent(
+                event_type='order.updated',
+                order_id=order_id,
+                payload={'id': order_id, 'changes': changes, 'updated_at': updated_at}
+            )
+            for order_id, changes, updated_at in updates
+        ], batch_size=500)
+
+class OutboxEvent(models.Model):
+    """
+    Order lifecycle event, written in the same transaction as the change it
+    describes and delivered to sinks by the dispatch_order_events command.
+    """
+    event_type = models.CharField(max_length=50)
+    order_id = models.BigIntegerField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = OutboxEventManager()
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.event_type} for Order #{self.order_id}"
+
+    def as_message(self):
+        return {
+            'id': self.id,
+            'type': self.event_type,
+            'order_id': self.order_id,
+            'payload': self.payload,
+            'created_at': self.created_at.isoformat(),
+        }
+
+class OutboxCursor(models.Model):
+    """Last outbox event each sink has acknowledged."""
+    sink = models.CharField(max_length=100, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.sink} at event {self.last_event_id}"
@@ -0,0 +1,97 @@
+import json
+import sqlite3
+import urllib.request
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+class BaseSink:
+    """
+    Destination for batches of outbox events. send() receives a list of
+    event messages (see OutboxEvent.as_message) and must raise if the batch
+    was not delivered; the dispatcher then retries the whole batch, so sinks
+    should tolerate receiving an event more than once.
+    """
+
+    def __init__(self, name, **options):
+        self.name = name
+
+    def send(self, events):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class HttpSink(BaseSink):
+    """POSTs each batch as {"events": [...]} to a webhook URL."""
+
+    def __init__(self, name, url, timeout=10, headers=None, **options):
+        super().__init__(name, **options)
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def send(self, events):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({'events': events}).encode(),
+            headers=self.headers,
+            method='POST'
+        )
+        # urlopen raises HTTPError for non-2xx responses
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class FileSink(BaseSink):
+    """Appends events to a local NDJSON file, for testing and debugging."""
+
+    def __init__(self, name, path, **options):
+        super().__init__(name, **options)
+        self.path = path
+
+    def send(self, events):
+        with open(self.path, 'a') as events_file:
+            for event in events:
+                events_file.write(json.dumps(event) + '\n')
+
+
+class SqliteSink(BaseSink):
+    """Stores events in a local SQLite table keyed on the event id."""
+
+    def __init__(self, name, path, **options):
+        super().__init__(name, **options)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS events ('
+            'id INTEGER PRIMARY KEY, type TEXT, order_id INTEGER, payload TEXT, created_at TEXT)'
+        )
+
+    def send(self, events):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO events (id, type, order_id, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (event['id'], event['type'], event['order_id'], json.dumps(event['payload']), event['created_at'])
+                    for event in events
+                ]
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+def load_sinks(names=None):
+    """Instantiate the sinks configured in settings.ORDER_EVENT_SINKS."""
+    configured = getattr(settings, 'ORDER_EVENT_SINKS', {})
+    names = names or list(configured)
+    sinks = []
+    for name in names:
+        if name not in configured:
+            raise ImproperlyConfigured(f"Order event sink '{name}' is not configured in ORDER_EVENT_SINKS")
+        config = configured[name]
+        sinks.append(import_string(config['BACKEND'])(name, **config.get('OPTIONS', {})))
+    return sinks
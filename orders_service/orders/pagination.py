@@ -0,0 +1,105 @@
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Keyset pagination over ``ordering``: a datetime field then the primary
+    key, each ascending or descending.
+
+    Unlike DRF's CursorPagination, which seeks on the first ordering field
+    and skips ties with an OFFSET, the cursor here holds the full key of the
+    boundary row. Each page is a single indexed range scan per queryset with
+    no COUNT(*), and pages stay stable while new rows are being inserted.
+
+    orders.pagination and products.pagination carry the same class, as the
+    services share no code; keep the two copies identical.
+    """
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Paginate the merged contents of several querysets over the same
+        fields (such as hot and archived rows), running one bounded range
+        scan on each.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+
+        # Walking backwards flips both directions, and the page is flipped back
+        (field, field_descending), (pk_field, pk_descending) = [
+            (name.lstrip('-'), name.startswith('-') != reverse) for name in self.ordering
+        ]
+        order_by = [
+            f"{'-' if field_descending else ''}{field}",
+            f"{'-' if pk_descending else ''}{pk_field}",
+        ]
+
+        results = []
+        for queryset in querysets:
+            queryset = queryset.order_by(*order_by)
+            if self.cursor is not None and self.cursor.position is not None:
+                value, pk = self.decode_position(self.cursor.position)
+                queryset = queryset.filter(
+                    Q(**{f"{field}__{'lt' if field_descending else 'gt'}": value}) |
+                    Q(**{field: value, f"{pk_field}__{'lt' if pk_descending else 'gt'}": pk})
+                )
+            results.extend(queryset[:self.page_size + 1])
+
+        if len(querysets) > 1:
+            results.sort(key=lambda row: getattr(row, pk_field), reverse=pk_descending)
+            results.sort(key=lambda row: getattr(row, field), reverse=field_descending)
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        has_cursor = self.cursor is not None and self.cursor.position is not None
+        if reverse:
+            self.has_previous = has_more
+            self.has_next = has_cursor
+        else:
+            self.has_next = has_more
+            self.has_previous = has_cursor
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        cursor = Cursor(offset=0, reverse=False, position=self.encode_position(self.page[-1]))
+        return self.encode_cursor(cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        cursor = Cursor(offset=0, reverse=True, position=self.encode_position(self.page[0]))
+        return self.encode_cursor(cursor)
+
+    def encode_position(self, row):
+        return f'{getattr(row, self.ordering[0].lstrip("-")).isoformat()}|{row.pk}'
+
+    def decode_position(self, position):
+        try:
+            value, pk = position.rsplit('|', 1)
+            return datetime.fromisoformat(value), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    """Orders newest first."""
+    ordering = ('-created_at', '-id')
+    max_page_size = 100
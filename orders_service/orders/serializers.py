@@ -1,5 +1,45 @@
+from django.db import connection, transaction
 from rest_framework import serializers
-from .models import Order, OrderItem
+from .models import ArchivedOrder, ArchivedOrderItem, DailyOrderRollup, Order, OrderItem, OutboxEvent
+
+# Rows per multi-row INSERT statement for bulk writes
+BULK_INSERT_BATCH_SIZE = 500
+
+
+def build_order_items(order, items_data):
+    """
+    Build unsaved OrderItem rows for bulk_create, which bypasses
+    OrderItem.save() and so needs total_price set up front.
+    """
+    return [
+        OrderItem(
+            order=order,
+            total_price=OrderItem.compute_total_price(item_data['quantity'], item_data['unit_price']),
+            **item_data
+        )
+        for item_data in items_data
+    ]
+
+
+def build_order(validated_data):
+    """
+    Build an unsaved PENDING Order from validated create data, returning it
+    together with its (not yet attached) items data.
+    """
+    validated_data = dict(validated_data)
+    items_data = validated_data.pop('items')
+    total_amount = sum(
+        OrderItem.compute_total_price(item['quantity'], item['unit_price'])
+        for item in items_data
+    )
+    order = Order(
+        **validated_data,
+        total_amount=total_amount,
+        status='PENDING',
+        payment_status='PENDING'
+    )
+    return order, items_data
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
@@ -17,7 +57,58 @@ class OrderSerializer(serializers.ModelSerializer):
             'billing_address', 'created_at', 'updated_at', 'payment_status',
             'tracking_number', 'items'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        # total_amount follows the items; Order.apply_total_delta keeps it in step
+        read_only_fields = ['total_amount', 'created_at', 'updated_at']
+
+class ArchivedOrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ['id', 'product_id', 'product_name', 'quantity', 'unit_price', 'total_price', 'created_at']
+        read_only_fields = fields
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = ArchivedOrder
+        fields = [
+            'id', 'user_id', 'status', 'total_amount', 'shipping_address',
+            'billing_address', 'created_at', 'updated_at', 'payment_status',
+            'tracking_number', 'items', 'archived_at'
+        ]
+        read_only_fields = fields
+
+class OrderCreateListSerializer(serializers.ListSerializer):
+    """
+    Creates many orders in one transaction, inserting all of their items
+    with batched multi-row INSERTs.
+    """
+
+    def create(self, validated_data):
+        built = [build_order(order_data) for order_data in validated_data]
+        orders = [order for order, _ in built]
+
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                Order.objects.bulk_create(orders, batch_size=BULK_INSERT_BATCH_SIZE)
+                DailyOrderRollup.objects.record_created(orders)
+            else:
+                # MySQL does not hand back primary keys from a multi-row
+                # INSERT, so orders are inserted one by one there.
+                for order in orders:
+                    order.save()
+
+            orders_with_items = [
+                (order, build_order_items(order, items_data))
+                for order, items_data in built
+            ]
+            OrderItem.objects.bulk_create(
+                [item for _, items in orders_with_items for item in items],
+                batch_size=BULK_INSERT_BATCH_SIZE
+            )
+            OutboxEvent.objects.order_created(orders_with_items)
+
+        return orders
 
 class OrderCreateSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
@@ -25,24 +116,38 @@ class OrderCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = [
-            'user_id', 'shipping_address', 'billing_address', 'items'
+            'id', 'user_id', 'shipping_address', 'billing_address', 'items'
         ]
+        list_serializer_class = OrderCreateListSerializer
 
     def create(self, validated_data):
-        items_data = validated_data.pop('items')
-        total_amount = sum(
-            item['quantity'] * item['unit_price']
-            for item in items_data
-        )
-        
-        order = Order.objects.create(
-            **validated_data,
-            total_amount=total_amount,
-            status='PENDING',
-            payment_status='PENDING'
-        )
+        order, items_data = build_order(validated_data)
+
+        with transaction.atomic():
+            order.save()
+            items = OrderItem.objects.bulk_create(
+                build_order_items(order, items_data),
+                batch_size=BULK_INSERT_BATCH_SIZE
+            )
+            OutboxEvent.objects.order_created([(order, items)])
+
+        return order
+
+
+class OrderTrackingSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    tracking_number = serializers.CharField(max_length=100)
 
-        for item_data in items_data:
-            OrderItem.objects.create(order=order, **item_data)
+class BulkStatusSerializer(serializers.Serializer):
+    """
+    Target status plus either plain order ids or (id, tracking_number)
+    pairs for orders being shipped.
+    """
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    orders = OrderTrackingSerializer(many=True, required=False, allow_empty=False)
 
-        return order 
\ No newline at end of file
+    def validate(self, data):
+        if ('ids' in data) == ('orders' in data):
+            raise serializers.ValidationError('Provide exactly one of ids or orders')
+        return data
@@ -1,3 +1,652 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import sqlite3
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from tempfile import TemporaryDirectory
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .exports import iter_orders
+from .models import ArchivedOrder, ArchivedOrderItem, DailyOrderRollup, Order, OrderItem, OutboxCursor, OutboxEvent
+
+
+def make_order(user_id=1, n_items=2, **kwargs):
+    kwargs.setdefault('total_amount', Decimal('0'))
+    order = Order.objects.create(
+        user_id=user_id,
+        shipping_address='1 Ship St',
+        billing_address='1 Bill St',
+        **kwargs
+    )
+    for i in range(n_items):
+        OrderItem.objects.create(
+            order=order,
+            product_id=i + 1,
+            product_name=f'Product {i + 1}',
+            quantity=1,
+            unit_price=Decimal('10.00')
+        )
+    return order
+
+
+def order_payload(n_items=2):
+    return {
+        'user_id': 1,
+        'shipping_address': '1 Ship St',
+        'billing_address': '1 Bill St',
+        'items': [
+            {
+                'product_id': i + 1,
+                'product_name': f'Product {i + 1}',
+                'quantity': 2,
+                'unit_price': '5.00'
+            }
+            for i in range(n_items)
+        ]
+    }
+
+
+class OrderQueryCountTests(TestCase):
+    """
+    Guards the number of queries each order endpoint runs, so that nested
+    item rendering cannot silently turn back into one query per order.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model()(username='tester'))
+
+    def assertConstantQueries(self, num, func, sizes=(1, 10)):
+        # Run func against growing data sets and require the same query
+        # count for every size.
+        for size in sizes:
+            Order.objects.all().delete()
+            for _ in range(size):
+                make_order(n_items=3)
+            with self.assertNumQueries(num):
+                response = func()
+            self.assertLess(response.status_code, 400, response.content)
+
+    def test_list(self):
+        # COUNT, orders page, items for the page
+        self.assertConstantQueries(3, lambda: self.client.get('/api/orders/'))
+
+    def test_list_filtered(self):
+        self.assertConstantQueries(
+            3, lambda: self.client.get('/api/orders/', {'user_id': 1, 'status': 'PENDING'})
+        )
+
+    def test_list_cursor(self):
+        # Keyset pagination skips the COUNT: orders page, items for the page
+        self.assertConstantQueries(
+            2, lambda: self.client.get('/api/orders/', {'pagination': 'cursor', 'page_size': 50})
+        )
+
+    def test_cursor_rejects_ordering(self):
+        make_order()
+        response = self.client.get('/api/orders/', {'pagination': 'cursor', 'ordering': 'total_amount'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/orders/', {'include_archived': 'true', 'ordering': '-total_amount'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/orders/', {'ordering': 'total_amount'})
+        self.assertEqual(response.data['count'], 1)
+
+    def test_retrieve(self):
+        order = make_order(n_items=25)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/orders/{order.id}/')
+        self.assertEqual(len(response.data['items']), 25)
+
+    def test_update_status(self):
+        order = make_order(n_items=25)
+        make_order(status='PROCESSING')
+        # order, items, savepoint, UPDATE order, two rollup UPDATEs, outbox
+        # INSERT, release
+        with self.assertNumQueries(8):
+            response = self.client.post(
+                f'/api/orders/{order.id}/update_status/', {'status': 'PROCESSING'}, format='json'
+            )
+        self.assertEqual(response.data['status'], 'PROCESSING')
+
+    def test_update_payment_status(self):
+        order = make_order(n_items=25)
+        make_order(payment_status='PAID')
+        with self.assertNumQueries(8):
+            response = self.client.post(
+                f'/api/orders/{order.id}/update_payment_status/', {'payment_status': 'PAID'}, format='json'
+            )
+        self.assertEqual(response.data['payment_status'], 'PAID')
+
+    def test_add_tracking(self):
+        order = make_order(n_items=25, status='PROCESSING')
+        make_order(status='SHIPPED')
+        with self.assertNumQueries(8):
+            response = self.client.post(
+                f'/api/orders/{order.id}/add_tracking/', {'tracking_number': 'TRK1'}, format='json'
+            )
+        self.assertEqual(response.data['status'], 'SHIPPED')
+
+    def test_create(self):
+        # Order INSERT, rollup UPDATE, one batched items INSERT, outbox INSERT
+        # and the items read for the response, plus savepoints.
+        make_order()
+        for n_items in (1, 20):
+            with self.assertNumQueries(9):
+                response = self.client.post('/api/orders/', order_payload(n_items), format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['items']), n_items)
+
+    @skipUnlessDBFeature('can_return_rows_from_bulk_insert')
+    def test_bulk_create(self):
+        make_order()
+        for n_orders in (1, 20):
+            with self.assertNumQueries(6):
+                response = self.client.post(
+                    '/api/orders/bulk/', [order_payload(5) for _ in range(n_orders)], format='json'
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.data['created'], n_orders)
+
+    def test_item_list(self):
+        order = make_order(n_items=25)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/orders/{order.id}/items/')
+        self.assertEqual(response.data['count'], 25)
+
+    def test_bulk_status(self):
+        make_order(status='PROCESSING')
+        for n_orders in (1, 20):
+            ids = [make_order().id for _ in range(n_orders)]
+            # savepoint, locking SELECT, UPDATE orders, two rollup UPDATEs,
+            # outbox INSERT, release
+            with self.assertNumQueries(7):
+                response = self.client.post(
+                    '/api/orders/bulk_status/', {'status': 'PROCESSING', 'ids': ids}, format='json'
+                )
+            self.assertEqual(response.data['updated'], ids)
+
+    def test_revenue(self):
+        for _ in range(10):
+            make_order()
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders/revenue/', {'group_by': 'day,status'})
+        self.assertEqual(response.data['order_count'], 10)
+
+
+class OrderIdempotencyTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model()(username='tester'))
+
+    def test_repeated_create_returns_the_first_order(self):
+        payload = order_payload(2)
+        first = self.client.post('/api/orders/', payload, format='json', HTTP_IDEMPOTENCY_KEY='cart-1-v1')
+        self.assertEqual(first.status_code, 201)
+        again = self.client.post('/api/orders/', payload, format='json', HTTP_IDEMPOTENCY_KEY='cart-1-v1')
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(len(again.data['items']), 2)
+        self.assertEqual(Order.objects.count(), 1)
+
+        other = self.client.post('/api/orders/', payload, format='json', HTTP_IDEMPOTENCY_KEY='cart-1-v2')
+        self.assertEqual(other.status_code, 201)
+        self.assertEqual(self.client.post('/api/orders/', payload, format='json').status_code, 201)
+        self.assertEqual(Order.objects.count(), 3)
+
+
+class OrderConcurrencyTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model()(username='tester'))
+
+    def test_if_match(self):
+        order = make_order(status='PROCESSING')
+        etag = self.client.get(f'/api/orders/{order.id}/')['ETag']
+
+        response = self.client.post(
+            f'/api/orders/{order.id}/update_payment_status/', {'payment_status': 'PAID'},
+            format='json', HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # The warehouse still holds the version it read before the payment
+        response = self.client.post(
+            f'/api/orders/{order.id}/add_tracking/', {'tracking_number': 'TRK1'},
+            format='json', HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 409)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), ('PROCESSING', 'PAID'))
+
+    def test_disallowed_transitions(self):
+        for final_status in ['CANCELLED', 'DELIVERED']:
+            order = make_order(status=final_status)
+            response = self.client.post(
+                f'/api/orders/{order.id}/add_tracking/', {'tracking_number': 'TRK1'}, format='json'
+            )
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.data['status'], final_status)
+            order.refresh_from_db()
+            self.assertEqual((order.status, order.tracking_number), (final_status, None))
+
+        order = make_order(status='SHIPPED')
+        response = self.client.post(f'/api/orders/{order.id}/update_status/', {'status': 'PENDING'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(OutboxEvent.objects.count(), 0)
+
+    def test_put_and_patch_are_conditional(self):
+        order = make_order(status='DELIVERED', total_amount=Decimal('20.00'))
+        url = f'/api/orders/{order.id}/'
+        response = self.client.patch(url, {'status': 'PENDING', 'total_amount': '99.00'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        response = self.client.patch(url, {'total_amount': '99.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.total_amount), ('DELIVERED', Decimal('20.00')))
+        self.assertEqual(OutboxEvent.objects.count(), 0)
+
+        etag = self.client.get(url)['ETag']
+        response = self.client.patch(url, {'shipping_address': '2 Ship St'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.patch(url, {'billing_address': '2 Bill St'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 409)
+        response = self.client.put(url, {
+            'user_id': 1, 'status': 'DELIVERED', 'shipping_address': '2 Ship St', 'billing_address': '1 Bill St',
+        }, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 409)
+        order.refresh_from_db()
+        self.assertEqual((order.shipping_address, order.billing_address), ('2 Ship St', '1 Bill St'))
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+    def test_tracking_correction_on_shipped_order(self):
+        order = make_order(status='SHIPPED', tracking_number='TRK1')
+        response = self.client.post(f'/api/orders/{order.id}/add_tracking/', {'tracking_number': 'TRK2'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.tracking_number), ('SHIPPED', 'TRK2'))
+
+class DailyOrderRollupTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model()(username='tester'))
+
+    def rollups(self):
+        return {
+            (rollup.status, rollup.payment_status): (rollup.order_count, rollup.total_amount)
+            for rollup in DailyOrderRollup.objects.exclude(order_count=0)
+        }
+
+    def test_rollups_follow_order_writes(self):
+        self.client.post('/api/orders/', order_payload(2), format='json')
+        self.client.post('/api/orders/bulk/', [order_payload(1), order_payload(3)], format='json')
+        self.assertEqual(self.rollups(), {('PENDING', 'PENDING'): (3, Decimal('60.00'))})
+
+        order = Order.objects.order_by('id').first()
+        self.client.post(f'/api/orders/{order.id}/update_payment_status/', {'payment_status': 'PAID'}, format='json')
+        self.client.post(f'/api/orders/{order.id}/update_status/', {'status': 'PROCESSING'}, format='json')
+        self.client.post(f'/api/orders/{order.id}/add_tracking/', {'tracking_number': 'TRK1'}, format='json')
+        self.assertEqual(self.rollups(), {
+            ('PENDING', 'PENDING'): (2, Decimal('40.00')),
+            ('SHIPPED', 'PAID'): (1, Decimal('20.00')),
+        })
+
+        response = self.client.get('/api/orders/revenue/', {'group_by': 'status'})
+        self.assertEqual(response.data['revenue'], '60.00')
+        self.assertEqual(
+            [(row['status'], row['order_count']) for row in response.data['results'] if row['order_count']],
+            [('PENDING', 2), ('SHIPPED', 1)]
+        )
+
+    def test_bulk_status_rollups_and_rejections(self):
+        pending = make_order(total_amount=Decimal('5.00'))
+        delivered = make_order(status='DELIVERED', total_amount=Decimal('3.00'))
+        response = self.client.post('/api/orders/bulk_status/', {
+            'status': 'CANCELLED',
+            'ids': [pending.id, delivered.id, 999999],
+        }, format='json')
+        self.assertEqual(response.data['updated'], [pending.id])
+        self.assertEqual(
+            [(row['id'], row.get('status')) for row in response.data['rejected']],
+            [(delivered.id, 'DELIVERED'), (999999, None)]
+        )
+        self.assertEqual(self.rollups(), {
+            ('CANCELLED', 'PENDING'): (1, Decimal('5.00')),
+            ('DELIVERED', 'PENDING'): (1, Decimal('3.00')),
+        })
+
+    def test_bulk_status_with_tracking(self):
+        first, second = make_order(status='PROCESSING'), make_order(status='PROCESSING')
+        response = self.client.post('/api/orders/bulk_status/', {
+            'status': 'SHIPPED',
+            'orders': [
+                {'id': first.id, 'tracking_number': 'TRK1'},
+                {'id': second.id, 'tracking_number': 'TRK2'},
+            ],
+        }, format='json')
+        self.assertEqual(response.data['updated'], [first.id, second.id])
+        self.assertEqual(
+            dict(Order.objects.values_list('id', 'tracking_number')),
+            {first.id: 'TRK1', second.id: 'TRK2'}
+        )
+
+    def test_rebuild_command(self):
+        for _ in range(5):
+            make_order(n_items=0, total_amount=Decimal('7.50'))
+        expected = self.rollups()
+        DailyOrderRollup.objects.all().delete()
+        call_command('rebuild_order_rollups', chunk_size=2, stdout=StringIO())
+        self.assertEqual(self.rollups(), expected)
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model()(username='tester'))
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_events_written_with_order_changes(self):
+        response = self.client.post('/api/orders/', order_payload(2), format='json')
+        order = Order.objects.get()
+        self.client.post(f'/api/orders/{order.id}/update_status/', {'status': 'PROCESSING'}, format='json')
+        self.client.post(
+            '/api/orders/bulk_status/',
+            {'status': 'SHIPPED', 'orders': [{'id': order.id, 'tracking_number': 'TRK1'}]},
+            format='json'
+        )
+        events = list(OutboxEvent.objects.all())
+        self.assertEqual([event.event_type for event in events], ['order.created', 'order.updated', 'order.updated'])
+        self.assertEqual(len(events[0].payload['items']), 2)
+        self.assertEqual(events[1].payload['changes'], {'status': 'PROCESSING'})
+        self.assertEqual(events[2].payload['changes'], {'status': 'SHIPPED', 'tracking_number': 'TRK1'})
+
+    def test_dispatch_to_local_sinks(self):
+        ndjson_path = os.path.join(self.tmp_dir.name, 'events.ndjson')
+        sqlite_path = os.path.join(self.tmp_dir.name, 'events.sqlite3')
+        sinks = {
+            'file': {'BACKEND': 'orders.outbox.FileSink', 'OPTIONS': {'path': ndjson_path}},
+            'sqlite': {'BACKEND': 'orders.outbox.SqliteSink', 'OPTIONS': {'path': sqlite_path}},
+        }
+        self.client.post('/api/orders/bulk/', [order_payload(1) for _ in range(5)], format='json')
+
+        with self.settings(ORDER_EVENT_SINKS=sinks):
+            call_command('dispatch_order_events', batch_size=2, settle_seconds=0, purge=True, stdout=StringIO())
+            call_command('dispatch_order_events', settle_seconds=0, stdout=StringIO())
+
+        with open(ndjson_path) as events_file:
+            self.assertEqual(len(events_file.readlines()), 5)
+        with sqlite3.connect(sqlite_path) as connection:
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM events').fetchone()[0], 5)
+        self.assertEqual(OutboxCursor.objects.get(sink='file').last_event_id, OutboxCursor.objects.get(sink='sqlite').last_event_id)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+
+class OrderExportTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model()(username='tester'))
+
+    def export(self, **params):
+        response = self.client.get('/api/orders/export/', params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        order = make_order(n_items=2, total_amount=Decimal('20.00'))
+        empty = make_order(n_items=0)
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual(
+            [(row['order_id'], row['item_product_id'], row['item_total_price']) for row in rows],
+            [(str(order.pk), '1', '10.00'), (str(order.pk), '2', '10.00'), (str(empty.pk), '', '')]
+        )
+        self.assertEqual(rows[0]['order_total_amount'], '20.00')
+        self.assertEqual(rows[0]['order_shipping_address'], '1 Ship St')
+
+    def test_ndjson(self):
+        order = make_order(n_items=3, payment_status='PAID')
+        response, body = self.export(export_format='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        exported = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(exported), 1)
+        self.assertEqual((exported[0]['id'], exported[0]['payment_status']), (order.pk, 'PAID'))
+        self.assertEqual([item['product_id'] for item in exported[0]['items']], [1, 2, 3])
+
+    def test_filters(self):
+        matching = make_order(user_id=5, status='PROCESSING', total_amount=Decimal('50.00'))
+        make_order(user_id=5, status='PENDING', total_amount=Decimal('50.00'))
+        make_order(user_id=6, status='PROCESSING', total_amount=Decimal('50.00'))
+        make_order(user_id=5, status='PROCESSING', total_amount=Decimal('5.00'))
+        _, body = self.export(export_format='ndjson', status='PROCESSING', user_id=5, min_total=10)
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [matching.pk])
+
+    def test_chunks(self):
+        orders = [make_order(n_items=1) for _ in range(7)]
+        Order.objects.filter(pk=orders[3].pk).delete()
+        expected = [order.pk for order in orders if order.pk != orders[3].pk]
+        for chunk_size in (1, 2, 3, 6, 100):
+            exported = list(iter_orders(Order.objects.all(), chunk_size))
+            self.assertEqual([order.pk for order in exported], expected)
+            self.assertTrue(all(len(order.items.all()) == 1 for order in exported))
+
+    def test_unknown_format(self):
+        response = self.client.get('/api/orders/export/', {'export_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('csv, ndjson', response.data['error'])
+
+
+class OrderAdminTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+
+    def test_changelist_counts(self):
+        for user_id in (1, 1, 2):
+            make_order(user_id=user_id, n_items=1)
+        response = self.client.get('/admin/orders/order/')
+        self.assertEqual(response.context['cl'].result_count, 3)
+        response = self.client.get('/admin/orders/order/', {'user_id': 1})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        response = self.client.get('/admin/orders/orderitem/')
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_exact_search(self):
+        order = make_order(user_id=5, tracking_number='TRK5')
+        make_order(user_id=order.pk * 10 + 1, n_items=0)
+        for term, expected in [(str(order.pk), [order.pk]), ('TRK5', [order.pk]), ('TRK', []), ('', None)]:
+            response = self.client.get('/admin/orders/order/', {'q': term})
+            found = [result.pk for result in response.context['cl'].result_list]
+            if expected is None:
+                self.assertEqual(len(found), 2)
+            else:
+                self.assertEqual(found, expected)
+
+        response = self.client.get('/admin/orders/orderitem/', {'q': str(order.pk)})
+        self.assertEqual({item.order_id for item in response.context['cl'].result_list}, {order.pk})
+
+    def test_inline_post_on_later_page(self):
+        order = make_order(n_items=25, total_amount=Decimal('250.00'))
+        url = f'/admin/orders/order/{order.pk}/change/?items_page=2'
+        response = self.client.get(url)
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(len(formset.forms), 5)
+
+        data = {
+            field.html_name: field.value()
+            for field in response.context['adminform'].form
+            if field.value() is not None
+        }
+        data.update({field.html_name: field.value() for field in formset.management_form})
+        for form in formset.forms:
+            data.update({field.html_name: field.value() for field in form if field.value() is not None})
+        changed = formset.forms[0].instance
+        data[formset.forms[0]['quantity'].html_name] = 7
+
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(order.items.count(), 25)
+        quantities = dict(order.items.values_list('pk', 'quantity'))
+        self.assertEqual(quantities.pop(changed.pk), 7)
+        self.assertEqual(set(quantities.values()), {1})
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount, Decimal('310.00'))
+        self.assertEqual(OutboxEvent.objects.filter(event_type='order.updated').count(), 1)
+
+    def test_item_admin_adjusts_order_totals(self):
+        first = make_order(n_items=2, total_amount=Decimal('20.00'))
+        second = make_order(n_items=1, total_amount=Decimal('10.00'))
+        item = first.items.order_by('pk').first()
+        response = self.client.post(f'/admin/orders/orderitem/{item.pk}/change/', {
+            'order': second.pk, 'product_id': item.product_id, 'product_name': item.product_name,
+            'quantity': 3, 'unit_price': '10.00',
+        })
+        self.assertEqual(response.status_code, 302)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.total_amount, second.total_amount), (Decimal('10.00'), Decimal('40.00')))
+
+        response = self.client.post(f'/admin/orders/orderitem/{item.pk}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        second.refresh_from_db()
+        self.assertEqual(second.total_amount, Decimal('10.00'))
+
+        response = self.client.post('/admin/orders/orderitem/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': list(OrderItem.objects.values_list('pk', flat=True)),
+        })
+        self.assertEqual(response.status_code, 302)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.total_amount, second.total_amount), (Decimal('0.00'), Decimal('0.00')))
+
+
+class OrderArchiveTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model()(username='tester'))
+
+    def test_archive_and_include_archived(self):
+        old = timezone.now() - timedelta(days=400)
+        delivered = [make_order(status='DELIVERED', n_items=2) for _ in range(3)]
+        open_order = make_order(status='PROCESSING')
+        recent = make_order(status='CANCELLED')
+        Order.objects.filter(pk__in=[order.pk for order in delivered] + [open_order.pk]).update(created_at=old)
+        rollups = list(DailyOrderRollup.objects.values_list('status', 'order_count'))
+
+        call_command('archive_orders', days=365, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+        self.assertEqual(ArchivedOrderItem.objects.count(), 6)
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {open_order.pk, recent.pk})
+        self.assertEqual(list(DailyOrderRollup.objects.values_list('status', 'order_count')), rollups)
+
+        response = self.client.get('/api/orders/')
+        self.assertEqual(response.data['count'], 2)
+
+        response = self.client.get('/api/orders/', {'include_archived': 'true', 'page_size': 3})
+        ids = [order['id'] for order in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [order['id'] for order in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(sorted(ids), sorted(order.pk for order in delivered + [open_order, recent]))
+        self.assertEqual(ids[0], recent.pk)
+
+        response = self.client.get(f'/api/orders/{delivered[0].pk}/')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/api/orders/{delivered[0].pk}/', {'include_archived': 'true'})
+        self.assertEqual(len(response.data['items']), 2)
+        self.assertIsNotNone(response.data['archived_at'])
+
+    def test_rebuild_and_export_keep_archived_orders(self):
+        old = timezone.now() - timedelta(days=400)
+        delivered = [make_order(status='DELIVERED', n_items=2, total_amount=Decimal('20.00')) for _ in range(3)]
+        recent = make_order(status='PROCESSING', n_items=1, total_amount=Decimal('10.00'))
+        Order.objects.filter(pk__in=[order.pk for order in delivered]).update(created_at=old)
+        revenue = self.client.get('/api/orders/revenue/', {'group_by': 'status'}).data
+        self.assertEqual((revenue['order_count'], revenue['revenue']), (4, '70.00'))
+
+        call_command('archive_orders', days=365, batch_size=2, stdout=StringIO())
+        call_command('rebuild_order_rollups', chunk_size=2, stdout=StringIO())
+        self.assertEqual(self.client.get('/api/orders/revenue/', {'group_by': 'status'}).data, revenue)
+
+        response = self.client.get('/api/orders/export/', {'export_format': 'ndjson'})
+        exported = [json.loads(line)['id'] for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(exported, [recent.pk])
+
+        response = self.client.get('/api/orders/export/', {'export_format': 'ndjson', 'include_archived': 'true'})
+        exported = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([order['id'] for order in exported], [order.pk for order in delivered + [recent]])
+        self.assertEqual(len(exported[0]['items']), 2)
+
+
+class OrderTotalMaintenanceTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model()(username='tester'))
+
+    def assertTotals(self, order, expected):
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount, Decimal(expected))
+        self.assertEqual(
+            DailyOrderRollup.objects.get(status=order.status).total_amount,
+            Decimal(expected)
+        )
+
+    def test_item_writes_adjust_order_total(self):
+        self.client.post('/api/orders/', order_payload(2), format='json')
+        order = Order.objects.get()
+        self.assertTotals(order, '20.00')
+        items_url = f'/api/orders/{order.id}/items/'
+
+        response = self.client.post(
+            items_url,
+            {'product_id': 9, 'product_name': 'Extra', 'quantity': 3, 'unit_price': '2.50'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTotals(order, '27.50')
+
+        item_id = response.data['id']
+        self.client.patch(f'{items_url}{item_id}/', {'quantity': 1}, format='json')
+        self.assertTotals(order, '22.50')
+
+        self.client.delete(f'{items_url}{item_id}/')
+        self.assertTotals(order, '20.00')
+
+    def test_reconcile_command(self):
+        # make_order writes items without touching the total
+        drifted = make_order(n_items=3)
+        consistent = make_order(n_items=0)
+
+        out = StringIO()
+        call_command('reconcile_order_totals', chunk_size=1, stdout=out)
+        self.assertIn('Checked 2 orders, 1 drifted', out.getvalue())
+        drifted.refresh_from_db()
+        self.assertEqual(drifted.total_amount, Decimal('0'))
+
+        version = drifted.version
+        call_command('reconcile_order_totals', fix=True, stdout=StringIO())
+        self.assertTotals(drifted, '30.00')
+        drifted.refresh_from_db()
+        self.assertNotEqual(drifted.version, version)
+        event = OutboxEvent.objects.get(event_type='order.updated')
+        self.assertEqual(event.order_id, drifted.pk)
+        self.assertEqual(Decimal(event.payload['changes']['total_amount']), Decimal('30.00'))
+        consistent.refresh_from_db()
+        self.assertEqual(consistent.total_amount, Decimal('0'))
@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .models import DailyOrderRollup, Order, OutboxEvent
+
+# Orders touched per UPDATE statement
+TRANSITION_BATCH_SIZE = 1000
+
+
+def bulk_transition(target_status, order_ids, tracking_numbers=None):
+    """
+    Move many orders to target_status in one transaction, checking each
+    against Order.STATUS_TRANSITIONS and writing the accepted ones with
+    set-based UPDATEs. tracking_numbers optionally maps order id to the
+    tracking number to store alongside the new status.
+
+    Returns (updated_ids, rejected), where rejected lists the orders that
+    were missing or not allowed to make the transition.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    allowed_from = Order.statuses_leading_to(target_status)
+    updated, rejected, moves = [], [], []
+
+    with transaction.atomic():
+        orders = {
+            order.pk: order
+            for order in Order.objects.select_for_update()
+            .filter(pk__in=order_ids)
+            .only(*DailyOrderRollup.SOURCE_FIELDS)
+            .order_by('pk')
+        }
+        for order_id in order_ids:
+            order = orders.get(order_id)
+            if order is None:
+                rejected.append({'id': order_id, 'error': 'Order not found'})
+            elif order.status not in allowed_from:
+                rejected.append({
+                    'id': order_id,
+                    'status': order.status,
+                    'error': f'Cannot move from {order.status} to {target_status}'
+                })
+            else:
+                updated.append(order_id)
+                day, _, payment_status, amount = order.rollup_state()
+                moves.append((order.rollup_state(), (day, target_status, payment_status, amount)))
+
+        now = timezone.now()
+        for start in range(0, len(updated), TRANSITION_BATCH_SIZE):
+            batch = updated[start:start + TRANSITION_BATCH_SIZE]
+            changes = {'status': target_status, 'updated_at': now}
+            if tracking_numbers is not None:
+                changes['tracking_number'] = Case(
+                    *[When(pk=pk, then=Value(tracking_numbers[pk])) for pk in batch]
+                )
+            Order.objects.filter(pk__in=batch, status__in=allowed_from).update(**changes)
+
+        DailyOrderRollup.objects.move_many(moves)
+        OutboxEvent.objects.order_updated([
+            (
+                pk,
+                {'status': target_status, 'tracking_number': tracking_numbers[pk]}
+                if tracking_numbers is not None else {'status': target_status},
+                now
+            )
+            for pk in updated
+        ])
+
+    return updated, rejected
@@ -1,13 +1,30 @@
-from django.shortcuts import render
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.filters import SearchFilter
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from django.db.models import Sum
 from django_filters import rest_framework as filters
-from .models import Order, OrderItem
-from .serializers import OrderSerializer, OrderCreateSerializer, OrderItemSerializer
+from .exports import EXPORT_FORMATS
+from .models import ArchivedOrder, DailyOrderRollup, Order, OrderItem, OutboxEvent
+from .pagination import OrderCursorPagination
+from .serializers import (
+    ArchivedOrderSerializer, BulkStatusSerializer, OrderSerializer, OrderCreateSerializer, OrderItemSerializer
+)
+from .transitions import bulk_transition
 
 # Create your views here.
 
+def format_amount(amount):
+    return str(Decimal(amount or 0).quantize(Decimal('0.01')))
+
 class OrderFilter(filters.FilterSet):
     status = filters.CharFilter(field_name='status')
     min_total = filters.NumberFilter(field_name='total_amount', lookup_expr='gte')
@@ -19,15 +36,42 @@ class OrderFilter(filters.FilterSet):
         model = Order
         fields = ['status', 'payment_status', 'user_id']
 
+class DailyOrderRollupFilter(filters.FilterSet):
+    created_after = filters.DateFilter(field_name='day', lookup_expr='gte')
+    created_before = filters.DateFilter(field_name='day', lookup_expr='lte')
+
+    class Meta:
+        model = DailyOrderRollup
+        fields = ['status', 'payment_status']
+
 class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+    # Items are rendered by OrderSerializer, so fetch them for the whole
+    # page in one query instead of one query per order.
+    queryset = Order.objects.prefetch_related('items')
     filterset_class = OrderFilter
     search_fields = ['id', 'tracking_number']
     ordering_fields = ['created_at', 'total_amount', 'status']
     ordering = ['-created_at']
+    bulk_max_orders = 1000
+    # ?pagination=cursor switches listing to keyset pagination; page-number
+    # pagination stays the default for admin-style clients.
+    pagination_classes = {
+        'page': api_settings.DEFAULT_PAGINATION_CLASS,
+        'cursor': OrderCursorPagination,
+    }
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            mode = 'page'
+            if self.request is not None:
+                mode = self.request.query_params.get('pagination', 'page')
+            pagination_class = self.pagination_classes.get(mode, self.pagination_classes['page'])
+            self._paginator = pagination_class() if pagination_class is not None else None
+        return self._paginator
 
     def get_serializer_class(self):
-        if self.action == 'create':
+        if self.action in ('create', 'bulk'):
             return OrderCreateSerializer
         return OrderSerializer
 
@@ -38,6 +82,297 @@ class OrderViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(user_id=user_id)
         return queryset
 
+    def create(self, request, *args, **kwargs):
+        """
+        With an Idempotency-Key header, a repeated create returns the order
+        the first request made, with 200 instead of 201.
+        """
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key is None:
+            return super().create(request, *args, **kwargs)
+        if len(idempotency_key) > Order._meta.get_field('idempotency_key').max_length:
+            return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        existing = self.get_queryset().filter(idempotency_key=idempotency_key).first()
+        if existing is not None:
+            return Response(self.get_serializer(existing).data)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            serializer.save(idempotency_key=idempotency_key)
+        except IntegrityError:
+            # A concurrent request with the same key won the insert
+            existing = self.get_queryset().filter(idempotency_key=idempotency_key).first()
+            if existing is None:
+                raise
+            return Response(self.get_serializer(existing).data)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def include_archived(self):
+        return self.request.query_params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+    def get_archived_queryset(self):
+        """
+        Archived orders filtered with the same user_id, OrderFilter and search
+        parameters as the hot queryset.
+        """
+        queryset = ArchivedOrder.objects.prefetch_related('items')
+        user_id = self.request.query_params.get('user_id', None)
+        if user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+        queryset = OrderFilter(self.request.query_params, queryset=queryset, request=self.request).qs
+        return SearchFilter().filter_queryset(self.request, queryset, self)
+
+    def list(self, request, *args, **kwargs):
+        # Keyset pages are always newest first, so an explicit ordering is
+        # refused rather than silently ignored
+        cursor_mode = self.include_archived() or isinstance(self.paginator, OrderCursorPagination)
+        if cursor_mode and request.query_params.get(api_settings.ORDERING_PARAM):
+            return Response(
+                {'error': f'{api_settings.ORDERING_PARAM} is not supported with cursor pagination, '
+                          'which always lists newest first; use pagination=page'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Default listings only touch the hot table. With include_archived,
+        # the hot and archived orders are merged with keyset pagination.
+        if not self.include_archived():
+            return super().list(request, *args, **kwargs)
+
+        hot = self.filter_queryset(self.get_queryset())
+        paginator = OrderCursorPagination()
+        page = paginator.paginate_querysets([hot, self.get_archived_queryset()], request, view=self)
+        data = [
+            ArchivedOrderSerializer(order).data if isinstance(order, ArchivedOrder) else OrderSerializer(order).data
+            for order in page
+        ]
+        return paginator.get_paginated_response(data)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        serializer = self.get_serializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=self.bulk_max_orders
+        )
+
+        if not serializer.is_valid():
+            errors = serializer.errors
+            if isinstance(errors, dict):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                {
+                    'error': 'One or more orders are invalid; nothing was created',
+                    'results': [
+                        {'index': index, 'created': False, 'errors': order_errors}
+                        for index, order_errors in enumerate(errors)
+                    ]
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        orders = serializer.save()
+        return Response(
+            {
+                'created': len(orders),
+                'results': [
+                    {
+                        'index': index,
+                        'created': True,
+                        'id': order.id,
+                        'total_amount': str(order.total_amount)
+                    }
+                    for index, order in enumerate(orders)
+                ]
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=['post'])
+    def bulk_status(self, request):
+        """
+        Move many orders to one status. Takes {"status": ..., "ids": [...]},
+        or {"status": ..., "orders": [{"id": ..., "tracking_number": ...}]}
+        to set tracking numbers as well, and reports which orders changed.
+        """
+        serializer = BulkStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        tracking_numbers = None
+        if 'orders' in data:
+            tracking_numbers = {order['id']: order['tracking_number'] for order in data['orders']}
+            order_ids = list(tracking_numbers)
+        else:
+            order_ids = data['ids']
+
+        if len(order_ids) > self.bulk_max_orders:
+            return Response(
+                {'error': f'At most {self.bulk_max_orders} orders per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        updated, rejected = bulk_transition(data['status'], order_ids, tracking_numbers)
+        return Response({'status': data['status'], 'updated': updated, 'rejected': rejected})
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream every order matching the usual OrderFilter parameters, with
+        its items, as CSV (export_format=csv, default) or NDJSON
+        (export_format=ndjson). include_archived adds the archived orders.
+        """
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"export_format must be one of: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        querysets = [self.filter_queryset(self.get_queryset())]
+        if self.include_archived():
+            querysets.insert(0, self.get_archived_queryset())
+        rows, content_type = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(rows(querysets), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def revenue(self, request):
+        """
+        Order count and revenue over a date range, answered from the daily
+        rollups rather than by scanning orders. Accepts created_after,
+        created_before, status and payment_status, and a comma separated
+        group_by of day, status and payment_status.
+        """
+        rollup_filter = DailyOrderRollupFilter(
+            request.query_params,
+            queryset=DailyOrderRollup.objects.all()
+        )
+        if not rollup_filter.is_valid():
+            return Response(rollup_filter.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        group_by = [
+            field for field in request.query_params.get('group_by', 'day').split(',')
+            if field
+        ]
+        if any(field not in ('day', 'status', 'payment_status') for field in group_by):
+            return Response(
+                {'error': 'group_by accepts day, status and payment_status'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rollups = rollup_filter.qs
+        totals = rollups.aggregate(order_count=Sum('order_count'), revenue=Sum('total_amount'))
+        results = (
+            rollups.order_by()
+            .values(*group_by)
+            .annotate(order_count=Sum('order_count'), revenue=Sum('total_amount'))
+            .order_by(*group_by)
+        ) if group_by else []
+
+        return Response({
+            'group_by': group_by,
+            'order_count': totals['order_count'] or 0,
+            'revenue': format_amount(totals['revenue']),
+            'results': [{**row, 'revenue': format_amount(row['revenue'])} for row in results],
+        })
+
+    def update(self, request, *args, **kwargs):
+        """
+        PUT and PATCH write through conditional_update, so they honour
+        If-Match and the allowed status transitions like the actions do.
+        Only fields whose value actually changes are written.
+        """
+        order = self.get_object()
+        serializer = self.get_serializer(order, data=request.data, partial=kwargs.get('partial', False))
+        serializer.is_valid(raise_exception=True)
+        changes = {
+            field: value
+            for field, value in serializer.validated_data.items()
+            if getattr(order, field) != value
+        }
+        if not changes:
+            response = self.precondition_failed(order)
+            if response is None:
+                response = Response(self.get_serializer(order).data)
+                response['ETag'] = quote_etag(order.version)
+            return response
+        return self.conditional_update(order, **changes)
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.include_archived():
+            lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            if not self.get_queryset().filter(pk=lookup).exists():
+                archived = get_object_or_404(self.get_archived_queryset(), pk=lookup)
+                return Response(ArchivedOrderSerializer(archived).data)
+        order = self.get_object()
+        response = Response(self.get_serializer(order).data)
+        response['ETag'] = quote_etag(order.version)
+        return response
+
+    def precondition_failed(self, order):
+        """A 409 response if the request's If-Match header does not name the order's version."""
+        if_match = self.request.headers.get('If-Match')
+        if if_match is not None:
+            etags = parse_etags(if_match)
+            if '*' not in etags and quote_etag(order.version) not in etags:
+                return Response(
+                    {'error': 'Order has changed since it was read', 'version': order.version},
+                    status=status.HTTP_409_CONFLICT
+                )
+        return None
+
+    def conditional_update(self, order, **changes):
+        """
+        Write only the changed columns with a single UPDATE that is guarded
+        on the status and version the order was read with. A stale If-Match
+        header or a concurrent write in between returns 409 instead of
+        silently overwriting the other writer, and so does a status change
+        that Order.STATUS_TRANSITIONS does not allow.
+        """
+        response = self.precondition_failed(order)
+        if response is not None:
+            return response
+
+        guard = {}
+        if 'status' in changes:
+            guard['status__in'] = Order.statuses_leading_to(changes['status'])
+            if order.status not in guard['status__in']:
+                return Response(
+                    {'error': f'Cannot move from {order.status} to {changes["status"]}', 'status': order.status},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+        now = timezone.now()
+        with transaction.atomic():
+            previous = order.rollup_state()
+            updated = Order.objects.filter(
+                pk=order.pk,
+                status=order.status,
+                updated_at=order.updated_at,
+                **guard
+            ).update(updated_at=now, **changes)
+            if not updated:
+                return Response(
+                    {'error': 'Order was modified concurrently, reload and retry'},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            for field, value in changes.items():
+                setattr(order, field, value)
+            order.updated_at = now
+            order._rollup_state = order.rollup_state()
+            DailyOrderRollup.objects.move(previous, order._rollup_state)
+            OutboxEvent.objects.order_updated([(order.pk, changes, now)])
+
+        response = Response(OrderSerializer(order).data)
+        response['ETag'] = quote_etag(order.version)
+        return response
+
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
         order = self.get_object()
@@ -49,9 +384,7 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        order.status = new_status
-        order.save()
-        return Response(OrderSerializer(order).data)
+        return self.conditional_update(order, status=new_status)
 
     @action(detail=True, methods=['post'])
     def update_payment_status(self, request, pk=None):
@@ -64,9 +397,7 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        order.payment_status = payment_status
-        order.save()
-        return Response(OrderSerializer(order).data)
+        return self.conditional_update(order, payment_status=payment_status)
 
     @action(detail=True, methods=['post'])
     def add_tracking(self, request, pk=None):
@@ -79,13 +410,40 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        order.tracking_number = tracking_number
-        order.status = 'SHIPPED'
-        order.save()
-        return Response(OrderSerializer(order).data)
+        changes = {'tracking_number': tracking_number}
+        # Correcting the tracking number of a shipped order is not a transition
+        if order.status != 'SHIPPED':
+            changes['status'] = 'SHIPPED'
+        return self.conditional_update(order, **changes)
 
 class OrderItemViewSet(viewsets.ModelViewSet):
+    """
+    Item writes adjust the parent order's total_amount by the item's price
+    delta in the same transaction, so the total never needs re-summing.
+    """
     serializer_class = OrderItemSerializer
     
     def get_queryset(self):
         return OrderItem.objects.filter(order_id=self.kwargs['order_pk'])
+
+    def perform_create(self, serializer):
+        order_id = get_object_or_404(Order.objects.only('id'), pk=self.kwargs['order_pk']).pk
+        with transaction.atomic():
+            item = serializer.save(order_id=order_id)
+            Order.apply_total_delta(order_id, item.total_price)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            previous_total = OrderItem.objects.select_for_update().values_list(
+                'total_price', flat=True
+            ).get(pk=serializer.instance.pk)
+            item = serializer.save()
+            Order.apply_total_delta(item.order_id, item.total_price - previous_total)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            previous_total = OrderItem.objects.select_for_update().values_list(
+                'total_price', flat=True
+            ).get(pk=instance.pk)
+            instance.delete()
+            Order.apply_total_delta(instance.order_id, -previous_total)
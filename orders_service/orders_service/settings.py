@@ -157,3 +157,17 @@ REST_FRAMEWORK = {
 # CORS settings
 CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', '').split(',')
 CORS_ALLOW_CREDENTIALS = True
+
+# Order event outbox sinks, drained by `manage.py dispatch_order_events`.
+# Each entry names a sink class from orders.outbox and its options, e.g.
+# {'BACKEND': 'orders.outbox.FileSink', 'OPTIONS': {'path': 'events.ndjson'}}
+ORDER_EVENT_SINKS = {}
+if os.getenv('ORDER_EVENTS_WEBHOOK_URL'):
+    ORDER_EVENT_SINKS['webhook'] = {
+        'BACKEND': 'orders.outbox.HttpSink',
+        'OPTIONS': {'url': os.getenv('ORDER_EVENTS_WEBHOOK_URL')},
+    }
+
+# DELIVERED and CANCELLED orders older than this many days are moved to the
+# archive tables by `manage.py archive_orders`
+ORDERS_ARCHIVE_AFTER_DAYS = int(os.getenv('ORDERS_ARCHIVE_AFTER_DAYS', '365'))
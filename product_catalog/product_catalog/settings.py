@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'drf_yasg',
+    'django_filters',
     'products',
 ]
 
@@ -139,4 +140,44 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
+    'DEFAULT_FILTER_BACKENDS': [
+        'django_filters.rest_framework.DjangoFilterBackend',
+    ],
+}
+
+# Per-process cache; point it at a shared backend (memcached, Redis) when
+# running several workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
 }
+
+# Product retrieve and list responses are read through CACHES[PRODUCT_CACHE_ALIAS].
+# Stock changes far more often than the descriptive fields, so it expires sooner.
+# Writes invalidate by bumping versions in that cache, which reaches every
+# process only if they share it (Redis, Memcached). A local-memory cache is
+# therefore left unused unless PRODUCT_CACHE_ALLOW_LOCAL=True, for
+# single-process deployments.
+PRODUCT_CACHE_ALIAS = 'default'
+PRODUCT_CACHE_ALLOW_LOCAL = os.getenv('PRODUCT_CACHE_ALLOW_LOCAL', 'False') == 'True'
+PRODUCT_CACHE_TIMEOUT = int(os.getenv('PRODUCT_CACHE_TIMEOUT', '300'))
+PRODUCT_STOCK_CACHE_TIMEOUT = int(os.getenv('PRODUCT_STOCK_CACHE_TIMEOUT', '5'))
+
+# Upper bound on ?page_size= for product listings
+PRODUCTS_MAX_PAGE_SIZE = int(os.getenv('PRODUCTS_MAX_PAGE_SIZE', '100'))
+
+# Product search: MySQL FULLTEXT and PostgreSQL GIN indexes are used on those
+# databases, and the products.search.InvertedIndexSearch fallback elsewhere.
+# Set a backend path to override the choice.
+PRODUCT_SEARCH_BACKEND = os.getenv('PRODUCT_SEARCH_BACKEND') or None
+PRODUCTS_SEARCH_MAX_RESULTS = 1000
+
+# Bulk product imports (POST /api/products/import/, manage.py import_products)
+PRODUCTS_IMPORT_CHUNK_SIZE = 500
+PRODUCTS_IMPORT_MAX_REPORTED_ERRORS = 1000
+
+# How long a stock reservation holds its stock before the sweeper
+# (manage.py release_expired_reservations) gives it back
+STOCK_RESERVATION_TTL_SECONDS = int(os.getenv('STOCK_RESERVATION_TTL_SECONDS', '900'))
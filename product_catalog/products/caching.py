@@ -0,0 +1,193 @@
+import hashlib
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+
+from .models import Product
+from .serializers import ProductSerializer
+
+LIST_VERSION_KEY = 'products:list:version'
+
+
+def get_cache():
+    return caches[settings.PRODUCT_CACHE_ALIAS]
+
+
+def cache_enabled():
+    """
+    Whether product reads go through the cache. A local-memory cache only
+    sees the version bumps of its own process, so it is used only when
+    PRODUCT_CACHE_ALLOW_LOCAL says the service runs as a single process.
+    """
+    return settings.PRODUCT_CACHE_ALLOW_LOCAL or not isinstance(get_cache(), LocMemCache)
+
+
+class CacheStats:
+    """
+    Hit and miss counts of this process, per kind of entry: 'product'
+    (descriptive fields), 'stock' and 'list' (pages of product ids).
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def record(self, kind, hits, misses):
+        self.hits[kind] += hits
+        self.misses[kind] += misses
+
+    def as_dict(self):
+        return {
+            kind: {
+                'hits': self.hits[kind],
+                'misses': self.misses[kind],
+                'hit_ratio': round(self.hits[kind] / (self.hits[kind] + self.misses[kind]), 4),
+            }
+            for kind in sorted(set(self.hits) | set(self.misses))
+            if self.hits[kind] + self.misses[kind]
+        }
+
+
+stats = CacheStats()
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def _version_key(product_id):
+    return f'product:{product_id}:version'
+
+
+def _versions(product_ids):
+    """
+    The current cache version of each product. A product whose version was
+    evicted gets a fresh one, which orphans anything cached under the old.
+    """
+    cache = get_cache()
+    cached = cache.get_many([_version_key(product_id) for product_id in product_ids])
+    versions, fresh = {}, {}
+    for product_id in product_ids:
+        versions[product_id] = cached.get(_version_key(product_id))
+        if versions[product_id] is None:
+            versions[product_id] = fresh[_version_key(product_id)] = _new_version()
+    if fresh:
+        cache.set_many(fresh, settings.PRODUCT_CACHE_TIMEOUT)
+    return versions
+
+
+def _product_key(product_id, version):
+    return f'product:{product_id}:{version}'
+
+
+def _stock_key(product_id, version):
+    return f'product:{product_id}:{version}:stock'
+
+
+def cache_products(products, versions=None):
+    """Store the serialized products, descriptive fields and stock apart."""
+    products = list(products)
+    if not products:
+        return {}
+    versions = versions or _versions([product.pk for product in products])
+    data = {product.pk: dict(item) for product, item in zip(products, ProductSerializer(products, many=True).data)}
+    cache = get_cache()
+    cache.set_many(
+        {
+            # stock is kept as a placeholder so the field order survives
+            _product_key(product_id, versions[product_id]): {**item, 'stock': None}
+            for product_id, item in data.items()
+        },
+        settings.PRODUCT_CACHE_TIMEOUT
+    )
+    cache.set_many(
+        {_stock_key(product_id, versions[product_id]): item['stock'] for product_id, item in data.items()},
+        settings.PRODUCT_STOCK_CACHE_TIMEOUT
+    )
+    return data
+
+
+def get_products(product_ids):
+    """
+    {product_id: serialized product} for the given ids, read through the
+    cache. A full hit costs two cache round trips and no queries; missing
+    stock alone is refetched with a narrow query. Ids with no product are
+    left out.
+    """
+    cache = get_cache()
+    product_ids = list(dict.fromkeys(product_ids))
+    versions = _versions(product_ids)
+    cached = cache.get_many([
+        key
+        for product_id in product_ids
+        for key in (_product_key(product_id, versions[product_id]), _stock_key(product_id, versions[product_id]))
+    ])
+
+    data, missing, stale_stock = {}, [], []
+    for product_id in product_ids:
+        item = cached.get(_product_key(product_id, versions[product_id]))
+        if item is None:
+            missing.append(product_id)
+            continue
+        data[product_id] = item
+        stock = cached.get(_stock_key(product_id, versions[product_id]))
+        if stock is None:
+            stale_stock.append(product_id)
+        else:
+            data[product_id] = {**item, 'stock': stock}
+    stats.record('product', len(product_ids) - len(missing), len(missing))
+    stats.record('stock', len(data) - len(stale_stock), len(stale_stock) + len(missing))
+
+    if stale_stock:
+        stock = dict(Product.objects.filter(pk__in=stale_stock).order_by().values_list('pk', 'stock'))
+        cache.set_many(
+            {_stock_key(product_id, versions[product_id]): value for product_id, value in stock.items()},
+            settings.PRODUCT_STOCK_CACHE_TIMEOUT
+        )
+        for product_id in stale_stock:
+            if product_id in stock:
+                data[product_id] = {**data[product_id], 'stock': stock[product_id]}
+            else:
+                del data[product_id]
+    if missing:
+        data.update(cache_products(Product.objects.filter(pk__in=missing).order_by(), versions))
+    return {product_id: data[product_id] for product_id in product_ids if product_id in data}
+
+
+def list_page_key(url):
+    """Cache key of one page of the product list, under the current list version."""
+    cache = get_cache()
+    version = cache.get(LIST_VERSION_KEY)
+    if version is None:
+        version = _new_version()
+        cache.set(LIST_VERSION_KEY, version, settings.PRODUCT_CACHE_TIMEOUT)
+    return f'products:list:{version}:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def invalidate_products(product_ids, lists=False):
+    """
+    Give the products new versions, and the product list too if lists is
+    set. Inside a transaction this happens again on commit, so a read that
+    repopulated the cache with pre-commit data in between is orphaned too.
+    """
+    if not cache_enabled():
+        return
+    product_ids = list(product_ids)
+
+    def bump():
+        entries = {_version_key(product_id): _new_version() for product_id in product_ids}
+        if lists:
+            entries[LIST_VERSION_KEY] = _new_version()
+        if entries:
+            get_cache().set_many(entries, settings.PRODUCT_CACHE_TIMEOUT)
+
+    bump()
+    if connection.in_atomic_block:
+        transaction.on_commit(bump)
@@ -0,0 +1,147 @@
+import csv
+import json
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import invalidate_products
+from .models import Product
+from .search import get_search_backend, index_products
+from .serializers import ProductImportSerializer
+from .signals import SEARCHABLE_FIELDS
+
+
+def csv_rows(lines):
+    """
+    (line_number, data, errors) for each row of a CSV with a header line.
+    Empty cells are left out, so they keep the product's current value.
+    """
+    reader = csv.DictReader(lines)
+    try:
+        for row in reader:
+            yield reader.line_num, {
+                column: value for column, value in row.items()
+                if column is not None and value not in ('', None)
+            }, None
+    except csv.Error as exc:
+        # The reader cannot resynchronise after a malformed line
+        yield reader.line_num, None, {'non_field_errors': [f'Invalid CSV: {exc}']}
+
+
+def ndjson_rows(lines):
+    """(line_number, data, errors) for each non-blank line of newline-delimited JSON."""
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as exc:
+            yield line_number, None, {'non_field_errors': [f'Invalid JSON: {exc}']}
+            continue
+        if not isinstance(data, dict):
+            yield line_number, None, {'non_field_errors': ['Expected a JSON object']}
+            continue
+        yield line_number, data, None
+
+
+READERS = {
+    'csv': csv_rows,
+    'ndjson': ndjson_rows,
+}
+
+
+def import_products(rows, chunk_size=500, on_error=None, stats=None):
+    """
+    Upsert products by external_id from (line_number, data, errors) rows,
+    chunk_size rows at a time: each chunk costs one lookup, one bulk_create
+    and one bulk_update, in a transaction of its own. Invalid rows are
+    passed to on_error(line_number, external_id, errors) and skipped. Rows
+    are consumed lazily, so memory use does not grow with the input.
+    Returns counts of products created and updated and rows failed; pass
+    stats to have them kept up to date as chunks are written, so they are
+    still there if reading the rows fails part way.
+    """
+    stats = stats if stats is not None else {}
+    stats.update({'created': 0, 'updated': 0, 'failed': 0})
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            _import_chunk(chunk, stats, on_error)
+            chunk = []
+    if chunk:
+        _import_chunk(chunk, stats, on_error)
+    return stats
+
+
+def _external_id(data):
+    external_id = data.get('external_id')
+    return None if external_id is None else str(external_id).strip()
+
+
+def _import_chunk(rows, stats, on_error):
+    def fail(line_number, external_id, errors):
+        stats['failed'] += 1
+        if on_error is not None:
+            on_error(line_number, external_id, errors)
+
+    keys = {_external_id(data) for _, data, errors in rows if data is not None}
+    existing = Product.objects.order_by().in_bulk([key for key in keys if key], field_name='external_id')
+
+    # Keyed by external_id, so later rows for a product build on earlier ones
+    # just as if the file were applied line by line
+    to_create, to_update, create_fields, update_fields = {}, {}, set(), set()
+    for line_number, data, errors in rows:
+        if errors:
+            fail(line_number, None, errors)
+            continue
+        key = _external_id(data)
+        instance = to_create.get(key) or existing.get(key)
+        serializer = ProductImportSerializer(instance, data=data, partial=instance is not None)
+        if not serializer.is_valid():
+            fail(line_number, data.get('external_id'), serializer.errors)
+            continue
+        fields = [field for field in serializer.validated_data if field != 'external_id']
+        if instance is None:
+            to_create[key] = Product(**serializer.validated_data)
+            create_fields.update(fields)
+            continue
+        for field, value in serializer.validated_data.items():
+            setattr(instance, field, value)
+        if instance.pk is not None:
+            to_update[instance.pk] = instance
+            update_fields.update(fields)
+        else:
+            create_fields.update(fields)
+
+    now = timezone.now()
+    for product in to_update.values():
+        product.updated_at = now
+
+    with transaction.atomic():
+        # A product created by a concurrent import since the lookup is
+        # updated instead of failing the chunk; it is counted as created.
+        created = Product.objects.bulk_create(
+            to_create.values(),
+            update_conflicts=True,
+            unique_fields=['external_id'] if connection.features.supports_update_conflicts_with_target else None,
+            update_fields=[*create_fields, 'updated_at'],
+        ) if to_create else []
+        if to_update:
+            Product.objects.bulk_update(to_update.values(), [*update_fields, 'updated_at'])
+
+        # Bulk writes skip post_save, so the search fallback is kept in step here
+        if get_search_backend().uses_inverted_index:
+            reindex = list(to_update.values()) if SEARCHABLE_FIELDS & update_fields else []
+            if created and created[0].pk is None:
+                # Backends that cannot return inserted ids (MySQL)
+                created = Product.objects.filter(external_id__in=to_create)
+            if created or reindex:
+                index_products([*created, *reindex])
+
+        if to_create or to_update:
+            # Created ids are bumped too, for products that turned out to exist
+            invalidate_products([*to_update, *(product.pk for product in created if product.pk)], lists=True)
+
+    stats['created'] += len(to_create)
+    stats['updated'] += len(to_update)
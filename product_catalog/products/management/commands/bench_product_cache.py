@@ -0,0 +1,90 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework import viewsets
+from rest_framework.test import APIRequestFactory
+
+from products.caching import get_cache, stats
+from products.models import Product
+from products.views import ProductViewSet
+
+
+class UncachedProductViewSet(ProductViewSet):
+    retrieve = viewsets.ModelViewSet.retrieve
+    list = viewsets.ModelViewSet.list
+
+
+class Command(BaseCommand):
+    help = (
+        'Time product retrieve and list requests with and without the product '
+        'cache. Run it against a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Catalog size to reach')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests timed per mode')
+        parser.add_argument('--hot', type=int, default=500, help='Distinct products requested')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        existing = Product.objects.count()
+        while existing < options['products']:
+            size = min(5000, options['products'] - existing)
+            with transaction.atomic():
+                Product.objects.bulk_create([
+                    Product(
+                        name=f'Product {existing + n}',
+                        description='Benchmark product',
+                        price=Decimal(rng.randint(100, 100000)) / 100,
+                        stock=rng.randint(0, 100)
+                    )
+                    for n in range(size)
+                ])
+            existing += size
+
+        product_ids = list(Product.objects.order_by('?').values_list('pk', flat=True)[:options['hot']])
+        retrieves = [rng.choice(product_ids) for _ in range(options['requests'])]
+        factory = APIRequestFactory(SERVER_NAME='localhost')
+
+        modes = [
+            ('database', UncachedProductViewSet),
+            ('cache', ProductViewSet),
+        ]
+        # The benchmark runs in a single process, so a local cache is fine
+        with override_settings(PRODUCT_CACHE_ALLOW_LOCAL=True):
+            for name, viewset in modes:
+                get_cache().clear()
+                stats.reset()
+                retrieve = viewset.as_view({'get': 'retrieve'})
+                timings = []
+                for product_id in retrieves:
+                    start = time.perf_counter()
+                    retrieve(factory.get(f'/api/products/{product_id}/'), pk=str(product_id))
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.report(f'retrieve, {name}', timings)
+
+                product_list = viewset.as_view({'get': 'list'})
+                timings = []
+                for _ in range(options['requests']):
+                    page_size = rng.choice([10, 20, 50])
+                    start = time.perf_counter()
+                    product_list(factory.get('/api/products/', {'page_size': page_size}))
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.report(f'list, {name}', timings)
+
+                for kind, counts in stats.as_dict().items():
+                    self.stdout.write(f'  {kind} hit ratio {counts["hit_ratio"]:.1%} ({counts["hits"]} hits)')
+
+    def report(self, label, timings):
+        timings.sort()
+        percentile = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))]
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}, {len(timings)} requests: p50 {percentile(0.50):.2f}ms, '
+            f'p95 {percentile(0.95):.2f}ms, mean {statistics.mean(timings):.2f}ms'
+        ))
@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.models import Product
+from products.search import get_search_backend, index_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the catalog with synthetic products and time ranked searches '
+        'against it. Run it against a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000, help='Catalog size to reach')
+        parser.add_argument('--queries', type=int, default=500, help='Searches to time')
+        parser.add_argument('--vocabulary', type=int, default=20000, help='Distinct words in the catalog')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Products inserted per batch')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        vocabulary = sorted({
+            ''.join(rng.choice(letters) for _ in range(rng.randint(4, 10)))
+            for _ in range(options['vocabulary'])
+        })
+        rng.shuffle(vocabulary)
+        # Zipf-like word frequencies, as in real product text
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+        backend = get_search_backend()
+
+        existing = Product.objects.count()
+        while existing < options['products']:
+            size = min(options['batch_size'], options['products'] - existing)
+            products = [
+                Product(
+                    name=' '.join(rng.choices(vocabulary, weights, k=3)).title(),
+                    description=' '.join(rng.choices(vocabulary, weights, k=20)),
+                    price=Decimal(rng.randint(100, 100000)) / 100,
+                    stock=rng.randint(0, 100)
+                )
+                for _ in range(size)
+            ]
+            with transaction.atomic():
+                # bulk_create skips post_save, so the fallback index is built here
+                products = Product.objects.bulk_create(products)
+                if backend.uses_inverted_index:
+                    if products[0].pk is None:
+                        products = list(Product.objects.order_by('-pk')[:size])
+                    index_products(products, batch_size=options['batch_size'])
+            existing += size
+            self.stdout.write(f'Catalog at {existing} products')
+
+        queries = []
+        for _ in range(options['queries']):
+            words = rng.choices(vocabulary, weights, k=rng.randint(1, 2))
+            # Half the queries end in a partial word, as typed in a search box
+            if rng.random() < 0.5:
+                words[-1] = words[-1][:max(3, len(words[-1]) // 2)]
+            queries.append(' '.join(words))
+
+        backend.search(queries[0])
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            backend.search(query, limit=20)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        percentile = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))]
+        self.stdout.write(self.style.SUCCESS(
+            f'{type(backend).__name__} over {existing} products, {len(timings)} queries: '
+            f'p50 {percentile(0.50):.1f}ms, p95 {percentile(0.95):.1f}ms, '
+            f'p99 {percentile(0.99):.1f}ms, mean {statistics.mean(timings):.1f}ms'
+        ))
@@ -0,0 +1,49 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import READERS, import_products
+
+
+class Command(BaseCommand):
+    help = 'Upsert products by external_id from a CSV or NDJSON file, streamed in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Input format; by default taken from the file extension'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.PRODUCTS_IMPORT_CHUNK_SIZE,
+            help='Rows validated and written per transaction'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if input_format in ('jsonl', 'json'):
+            input_format = 'ndjson'
+        if input_format not in READERS:
+            raise CommandError('Cannot tell the input format; pass --format')
+
+        def report(line, external_id, errors):
+            self.stderr.write(f'Line {line} ({external_id or "no external_id"}): {errors}')
+
+        stats = {}
+        try:
+            if path == '-':
+                import_products(READERS[input_format](sys.stdin), options['chunk_size'], report, stats)
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as lines:
+                    import_products(READERS[input_format](lines), options['chunk_size'], report, stats)
+        except UnicodeDecodeError:
+            raise CommandError(
+                f"Input is not valid UTF-8; created {stats['created']}, updated {stats['updated']}, "
+                f"failed {stats['failed']} rows before it"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {stats['created']}, updated {stats['updated']}, failed {stats['failed']} rows"
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.search import get_search_backend, index_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the inverted search index used by the search fallback, in primary key chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Products indexed per chunk')
+
+    def handle(self, *args, **options):
+        if not get_search_backend().uses_inverted_index:
+            self.stdout.write('The configured search backend uses the database full-text index; nothing to do')
+            return
+
+        last_pk = indexed = 0
+        while True:
+            chunk = list(
+                Product.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'name', 'description')[:options['chunk_size']]
+            )
+            if not chunk:
+                break
+            index_products(chunk)
+            indexed += len(chunk)
+            last_pk = chunk[-1].pk
+            self.stdout.write(f'Indexed {indexed} products (up to id {last_pk})')
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} products'))
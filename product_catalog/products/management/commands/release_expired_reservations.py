@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = 'Give back the stock of expired reservations, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reservations expired per transaction')
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping instead of exiting when done')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between sweeps with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            released = 0
+            while True:
+                batch = StockReservation.objects.release_expired(options['batch_size'])
+                if not batch:
+                    break
+                released += batch
+                self.stdout.write(f'Released {released} expired reservations')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations'))
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.2 on 2026-10-17 19:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_fulltext_index(apps, schema_editor):
+    # Django cannot declare these indexes, so they are created per vendor
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE FULLTEXT INDEX products_product_fulltext ON products_product (name, description)'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX products_product_fulltext ON products_product "
+            "USING GIN (to_tsvector('english', name || ' ' || description))"
+        )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute('DROP INDEX products_product_fulltext ON products_product')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX products_product_fulltext')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'product', 'weight'], name='products_pr_term_2b9134_idx')],
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
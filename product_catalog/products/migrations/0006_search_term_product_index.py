@@ -0,0 +1,25 @@
+# Generated by Django 5.0.2 on 2026-10-17 19:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_external_id'),
+    ]
+
+    operations = [
+        # Added before the foreign key's own index is dropped, since MySQL
+        # needs an index leading with product at all times
+        migrations.AddIndex(
+            model_name='productsearchterm',
+            index=models.Index(fields=['product', 'term', 'weight'], name='products_pr_product_7e588e_idx'),
+        ),
+        migrations.AlterField(
+            model_name='productsearchterm',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='products.product'),
+        ),
+    ]
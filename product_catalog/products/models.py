@@ -1,4 +1,42 @@
-from django.db import models
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f'Insufficient stock for products {product_ids}')
+        self.product_ids = product_ids
+
+class ProductManager(models.Manager):
+    def adjust_stock(self, deltas, active_only=False):
+        """
+        Apply {product_id: delta} to stock with one conditional UPDATE that
+        skips any product whose stock would go negative. Returns how many
+        products were updated; callers compare that with len(deltas) and roll
+        back on a shortfall.
+        """
+        if not deltas:
+            return 0
+        delta = Case(
+            *[When(pk=product_id, then=Value(change)) for product_id, change in deltas.items()],
+            output_field=models.IntegerField()
+        )
+        floor = Case(
+            *[When(pk=product_id, then=Value(-change)) for product_id, change in deltas.items()],
+            output_field=models.IntegerField()
+        )
+        products = self.filter(pk__in=list(deltas), stock__gte=floor)
+        if active_only:
+            products = products.filter(is_active=True)
+        updated = products.update(stock=F('stock') + delta, updated_at=timezone.now())
+        if updated:
+            # A queryset update sends no signals, so cached copies are dropped here
+            from .caching import invalidate_products
+            invalidate_products(deltas)
+        return updated
 
 class Product(models.Model):
     name = models.CharField(max_length=255)
@@ -8,9 +46,169 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Key of the product in the upstream ERP, which bulk imports upsert by
+    external_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+
+    objects = ProductManager()
+
+    class Meta:
+        ordering = ['-created_at', 'id']
+        indexes = [
+            # Keyset pagination order, alone and behind the hot filters
+            models.Index(fields=['-created_at', 'id']),
+            models.Index(fields=['is_active', '-created_at', 'id']),
+            models.Index(fields=['is_active', 'price']),
+            models.Index(fields=['is_active', 'stock']),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class ProductSearchTerm(models.Model):
+    """
+    Inverted-index row for the portable search fallback: one term of one
+    product, weighted by where and how often it occurs. Deleting a product
+    cascades to its terms.
+    """
+    term = models.CharField(max_length=64)
+    # Indexed by the second index below, which leads with product
+    product = models.ForeignKey(Product, related_name='search_terms', on_delete=models.CASCADE, db_index=False)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            # Covers the prefix range scans, so searches never touch the table
+            models.Index(fields=['term', 'product', 'weight']),
+            # Covers checking a term against a set of candidate products
+            models.Index(fields=['product', 'term', 'weight']),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.product_id}"
+
+class StockReservationManager(models.Manager):
+    def hold(self, quantities, ttl, reference=''):
+        """
+        Reserve {product_id: quantity} for ttl seconds, all or nothing: the
+        stock of every product is decremented by one conditional UPDATE, and
+        InsufficientStock lists the products that could not cover it.
+        """
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                updated = Product.objects.adjust_stock(
+                    {product_id: -quantity for product_id, quantity in quantities.items()},
+                    active_only=True
+                )
+                if updated != len(quantities):
+                    # Rolls back the products that could cover their quantity
+                    raise InsufficientStock([])
+                reservation = self.create(reference=reference, expires_at=now + timedelta(seconds=ttl))
+                StockReservationItem.objects.bulk_create([
+                    StockReservationItem(reservation=reservation, product_id=product_id, quantity=quantity)
+                    for product_id, quantity in quantities.items()
+                ])
+        except InsufficientStock:
+            available = dict(
+                Product.objects.filter(pk__in=list(quantities), is_active=True).values_list('pk', 'stock')
+            )
+            short = sorted(
+                product_id for product_id, quantity in quantities.items()
+                if available.get(product_id, 0) < quantity
+            )
+            # Empty if stock was given back concurrently since the UPDATE
+            raise InsufficientStock(short or sorted(quantities))
+        return reservation
+
+    def release_expired(self, batch_size=1000):
+        """
+        Expire up to batch_size overdue holds and put their stock back.
+        Holds locked by a concurrent commit or release are skipped.
+        """
+        with transaction.atomic():
+            reservation_ids = list(
+                self.select_for_update(skip_locked=True)
+                .filter(status='HELD', expires_at__lte=timezone.now())
+                .order_by('expires_at')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            # select_for_update is a no-op on some backends (SQLite), so every
+            # hold is moved on by its own conditional UPDATE, and only those
+            # still held at that point give their stock back
+            now = timezone.now()
+            expired = [
+                reservation_id for reservation_id in reservation_ids
+                if self.filter(pk=reservation_id, status='HELD').update(status='EXPIRED', updated_at=now)
+            ]
+            if expired:
+                Product.objects.adjust_stock(StockReservationItem.objects.quantities(expired))
+        return len(expired)
+
+class StockReservation(models.Model):
+    """
+    Stock held for a checkout. The stock is taken when the hold is made;
+    committing keeps it taken, while releasing or expiring gives it back.
+    """
+    STATUS_CHOICES = [
+        ('HELD', 'Held'),
+        ('COMMITTED', 'Committed'),
+        ('RELEASED', 'Released'),
+        ('EXPIRED', 'Expired'),
+    ]
+
+    reference = models.CharField(max_length=100, blank=True)  # e.g. the cart or order it belongs to
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='HELD')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = StockReservationManager()
 
     class Meta:
-        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"Reservation #{self.id} - {self.status}"
+
+    def commit(self):
+        """Make an unexpired hold permanent. Returns False if it is no longer held."""
+        committed = StockReservation.objects.filter(
+            pk=self.pk, status='HELD', expires_at__gt=timezone.now()
+        ).update(status='COMMITTED', updated_at=timezone.now())
+        if committed:
+            self.status = 'COMMITTED'
+        return bool(committed)
+
+    def release(self):
+        """Give a hold's stock back. Returns False if it is no longer held."""
+        with transaction.atomic():
+            released = StockReservation.objects.filter(pk=self.pk, status='HELD').update(
+                status='RELEASED', updated_at=timezone.now()
+            )
+            if released:
+                Product.objects.adjust_stock(StockReservationItem.objects.quantities([self.pk]))
+                self.status = 'RELEASED'
+        return bool(released)
+
+class StockReservationItemManager(models.Manager):
+    def quantities(self, reservation_ids):
+        """{product_id: total quantity} held by the given reservations."""
+        return dict(
+            self.filter(reservation_id__in=reservation_ids)
+            .order_by()
+            .values('product_id')
+            .annotate(total=Sum('quantity'))
+            .values_list('product_id', 'total')
+        )
+
+class StockReservationItem(models.Model):
+    reservation = models.ForeignKey(StockReservation, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='reservation_items', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+
+    objects = StockReservationItemManager()
 
     def __str__(self):
-        return self.name 
\ No newline at end of file
+        return f"{self.quantity}x product {self.product_id} in reservation #{self.reservation_id}"
@@ -0,0 +1,197 @@
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Product, ProductSearchTerm
+
+# Weight of one occurrence of a term in each indexed field
+FIELD_WEIGHTS = {'name': 3, 'description': 1}
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = ProductSearchTerm._meta.get_field('term').max_length
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in re.findall(r'\w+', (text or '').lower())
+        if len(token) >= MIN_TERM_LENGTH
+    ]
+
+
+def prefix_q(token):
+    # A range rather than LIKE 'token%', which SQLite cannot serve from an index
+    return Q(term__gte=token, term__lt=token + '\uffff')
+
+
+def term_weights(product):
+    weights = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(getattr(product, field)):
+            weights[term] = weights.get(term, 0) + weight
+    return weights
+
+
+def index_products(products, batch_size=1000):
+    """Rewrite the inverted-index rows of the given products."""
+    products = list(products)
+    ProductSearchTerm.objects.filter(product_id__in=[product.pk for product in products]).delete()
+    ProductSearchTerm.objects.bulk_create(
+        [
+            ProductSearchTerm(term=term, product_id=product.pk, weight=weight)
+            for product in products
+            for term, weight in term_weights(product).items()
+        ],
+        batch_size=batch_size
+    )
+
+
+class BaseSearchBackend:
+    """
+    Ranked product search. search() returns up to ``limit`` products from
+    ``queryset`` (all products by default) matching every query term as a
+    prefix, best first, each with a ``rank`` attribute.
+    """
+    uses_inverted_index = False
+
+    def search(self, query, queryset=None, offset=0, limit=20):
+        raise NotImplementedError
+
+
+class InvertedIndexSearch(BaseSearchBackend):
+    """
+    Portable fallback over the ProductSearchTerm table, which the post_save
+    signal keeps in step with each product. Products are ranked by the
+    summed weights of the terms they matched.
+
+    The query is driven from its most selective term: each term's index
+    range is counted, up to max_candidates rows, and the rarest one supplies
+    the candidate products, which the other terms then only have to confirm
+    through the candidates' own index rows. A term matching more than
+    max_candidates rows (a stopword, or a very short prefix on its own) is
+    ranked among its first max_candidates matches only, which keeps every
+    search to a bounded amount of index. A filtered queryset is joined into
+    every term scan, so the cap counts only products the filters allow.
+    Terms shorter than min_prefix_length match whole words rather than
+    prefixes.
+    """
+    uses_inverted_index = True
+    min_prefix_length = 3
+    max_candidates = 1000
+
+    def term_q(self, token):
+        if len(token) < self.min_prefix_length:
+            return Q(term=token)
+        return prefix_q(token)
+
+    def search(self, query, queryset=None, offset=0, limit=20):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        terms = ProductSearchTerm.objects.order_by()
+        if queryset is not None and queryset.query.has_filters():
+            terms = terms.filter(product__in=queryset.order_by().values('pk'))
+        if len(tokens) > 1:
+            sizes = {
+                token: terms.filter(self.term_q(token))[:self.max_candidates + 1].count()
+                for token in tokens
+            }
+            tokens.sort(key=sizes.get)
+
+        ranks = Counter()
+        for product_id, weight in terms.filter(self.term_q(tokens[0])).values_list(
+            'product_id', 'weight'
+        )[:self.max_candidates]:
+            ranks[product_id] += weight
+        for token in tokens[1:]:
+            if not ranks:
+                break
+            confirmed = Counter()
+            for product_id, weight in terms.filter(self.term_q(token), product_id__in=list(ranks)).values_list(
+                'product_id', 'weight'
+            ):
+                confirmed[product_id] += weight
+            ranks = Counter({product_id: ranks[product_id] + weight for product_id, weight in confirmed.items()})
+
+        ranked = sorted(ranks.items(), key=lambda item: (-item[1], item[0]))[offset:offset + limit]
+        products = Product.objects.in_bulk([product_id for product_id, _ in ranked])
+        results = []
+        for product_id, rank in ranked:
+            product = products.get(product_id)
+            if product is not None:
+                product.rank = rank
+                results.append(product)
+        return results
+
+
+class MySQLFullTextSearch(BaseSearchBackend):
+    """
+    MATCH ... AGAINST in boolean mode over the FULLTEXT(name, description)
+    index, with every term required and prefix-matched. InnoDB skips terms
+    shorter than innodb_ft_min_token_size (3 by default).
+    """
+    match_sql = 'MATCH (name, description) AGAINST (%s IN BOOLEAN MODE)'
+
+    def search(self, query, queryset=None, offset=0, limit=20):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        boolean_query = ' '.join(f'+{token}*' for token in tokens)
+        return list(
+            (Product.objects.all() if queryset is None else queryset)
+            .filter(RawSQL(self.match_sql, [boolean_query], output_field=models.BooleanField()))
+            .annotate(rank=RawSQL(self.match_sql, [boolean_query], output_field=models.FloatField()))
+            .order_by('-rank', 'id')[offset:offset + limit]
+        )
+
+
+class PostgresFullTextSearch(BaseSearchBackend):
+    """
+    to_tsquery prefix search over the GIN index on the products' tsvector,
+    ranked with ts_rank.
+    """
+    vector_sql = "to_tsvector('english', name || ' ' || description)"
+
+    def search(self, query, queryset=None, offset=0, limit=20):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        ts_query = ' & '.join(f'{token}:*' for token in tokens)
+        return list(
+            (Product.objects.all() if queryset is None else queryset)
+            .filter(RawSQL(
+                f"{self.vector_sql} @@ to_tsquery('english', %s)", [ts_query],
+                output_field=models.BooleanField()
+            ))
+            .annotate(rank=RawSQL(
+                f"ts_rank({self.vector_sql}, to_tsquery('english', %s))", [ts_query],
+                output_field=models.FloatField()
+            ))
+            .order_by('-rank', 'id')[offset:offset + limit]
+        )
+
+
+VENDOR_BACKENDS = {
+    'mysql': MySQLFullTextSearch,
+    'postgresql': PostgresFullTextSearch,
+}
+
+_backends = {}
+
+
+def get_search_backend():
+    """
+    settings.PRODUCT_SEARCH_BACKEND if set, otherwise the database's own
+    full-text search where the migrations create an index for it, and the
+    inverted index everywhere else.
+    """
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    key = path or connection.vendor
+    if key not in _backends:
+        backend_class = import_string(path) if path else VENDOR_BACKENDS.get(connection.vendor, InvertedIndexSearch)
+        _backends[key] = backend_class()
+    return _backends[key]
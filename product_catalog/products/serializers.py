@@ -1,8 +1,48 @@
 from rest_framework import serializers
-from .models import Product
+from .models import Product, StockReservation, StockReservationItem
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'stock', 'created_at', 'updated_at', 'is_active']
-        read_only_fields = ['created_at', 'updated_at'] 
\ No newline at end of file
+        fields = [
+            'id', 'external_id', 'name', 'description', 'price', 'stock', 'created_at', 'updated_at', 'is_active'
+        ]
+        read_only_fields = ['created_at', 'updated_at']
+
+class ProductImportSerializer(ProductSerializer):
+    """
+    One row of a bulk import. external_id is required; its uniqueness is
+    enforced by the importer, which looks up a whole chunk at once.
+    """
+    class Meta(ProductSerializer.Meta):
+        extra_kwargs = {
+            'external_id': {'required': True, 'allow_null': False, 'allow_blank': False, 'validators': []},
+        }
+
+class StockReservationItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockReservationItem
+        fields = ['product', 'quantity']
+
+class StockReservationSerializer(serializers.ModelSerializer):
+    items = StockReservationItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = StockReservation
+        fields = ['id', 'reference', 'status', 'expires_at', 'created_at', 'updated_at', 'items']
+        read_only_fields = fields
+
+class ReservationLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+class ReservationCreateSerializer(serializers.Serializer):
+    reference = serializers.CharField(max_length=100, required=False, default='', allow_blank=True)
+    items = ReservationLineSerializer(many=True, allow_empty=False, max_length=100)
+
+    def validate_items(self, items):
+        # Repeated products are merged, so each product is one row of the UPDATE
+        quantities = {}
+        for item in items:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+        return quantities
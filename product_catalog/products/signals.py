@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import invalidate_products
+from .models import Product
+from .search import get_search_backend, index_products
+
+SEARCHABLE_FIELDS = {'name', 'description'}
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, update_fields=None, **kwargs):
+    # Deletes need no handler: the product's terms go with it by cascade
+    if not get_search_backend().uses_inverted_index:
+        return
+    if update_fields is not None and not SEARCHABLE_FIELDS & set(update_fields):
+        return
+    index_products([instance])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cached_product(sender, instance, **kwargs):
+    invalidate_products([instance.pk], lists=True)
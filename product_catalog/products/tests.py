@@ -0,0 +1,514 @@
+import json
+import os
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.permissions import BasePermission
+from rest_framework.test import APIClient
+
+from .models import Product, StockReservation, StockReservationItem
+from .serializers import ProductSerializer
+from .views import ProductViewSet
+from .caching import get_cache, stats as cache_stats
+from .search import get_search_backend
+
+
+def make_product(**fields):
+    fields = {'name': 'Widget', 'description': 'A widget', 'price': Decimal('10.00'), 'stock': 5, **fields}
+    return Product.objects.create(**fields)
+
+
+class ProductListTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def collect(self, url, params=None):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            ids += [product['id'] for product in response.data['results']]
+            if not response.data['next']:
+                return ids, response
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_pages_walk_ties_in_order(self):
+        created_at = timezone.now()
+        products = [make_product(name=f'P{n}') for n in range(7)]
+        # Three products share a timestamp, so the id tiebreak matters
+        for n, product in enumerate(products):
+            Product.objects.filter(pk=product.pk).update(created_at=created_at - timedelta(minutes=n // 3))
+        expected = [product.pk for product in products]
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/', {'page_size': 3})
+        self.assertNotIn('count', response.data)
+
+        ids, last = self.collect('/api/products/', {'page_size': 3})
+        self.assertEqual(ids, expected)
+
+        ids = []
+        response = self.client.get(last.data['previous'])
+        while True:
+            ids = [product['id'] for product in response.data['results']] + ids
+            if not response.data['previous']:
+                break
+            response = self.client.get(response.data['previous'])
+        self.assertEqual(ids, expected[:6])
+
+    @override_settings(PRODUCTS_MAX_PAGE_SIZE=2)
+    def test_max_page_size(self):
+        for n in range(3):
+            make_product()
+        response = self.client.get('/api/products/', {'page_size': 50})
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_filters(self):
+        cheap = make_product(price=Decimal('5.00'))
+        make_product(price=Decimal('50.00'))
+        out_of_stock = make_product(price=Decimal('7.00'), stock=0)
+        make_product(price=Decimal('6.00'), is_active=False)
+
+        ids, _ = self.collect('/api/products/', {'is_active': 'true', 'min_price': '4', 'max_price': '10'})
+        self.assertEqual(sorted(ids), [cheap.pk, out_of_stock.pk])
+        ids, _ = self.collect('/api/products/', {'is_active': 'true', 'max_price': '10', 'in_stock': 'true'})
+        self.assertEqual(ids, [cheap.pk])
+        ids, _ = self.collect('/api/products/', {'in_stock': 'false'})
+        self.assertEqual(ids, [out_of_stock.pk])
+
+
+class ProductSearchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.kettle = make_product(name='Steel Kettle', description='Boils water fast')
+        self.teapot = make_product(name='Teapot', description='Pairs with a steel kettle')
+        self.mug = make_product(name='Mug', description='Holds tea', is_active=False)
+
+    def search(self, **params):
+        return self.client.get('/api/products/search/', params)
+
+    def test_prefix_matching_and_ranking(self):
+        response = self.search(q='kett')
+        # A name match outranks a description match
+        self.assertEqual([product['id'] for product in response.data['results']], [self.kettle.pk, self.teapot.pk])
+        self.assertGreater(response.data['results'][0]['rank'], response.data['results'][1]['rank'])
+
+        response = self.search(q='steel tea')
+        self.assertEqual([product['id'] for product in response.data['results']], [self.teapot.pk])
+        response = self.search(q='tea', is_active='true')
+        self.assertEqual([product['id'] for product in response.data['results']], [self.teapot.pk])
+        self.assertEqual(self.search(q='  ').status_code, 400)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.kettle.name = 'Copper Jug'
+        self.kettle.save()
+        self.assertEqual([product['id'] for product in self.search(q='copper').data['results']], [self.kettle.pk])
+        self.assertEqual([product['id'] for product in self.search(q='kettle').data['results']], [self.teapot.pk])
+        self.teapot.delete()
+        self.assertEqual(self.search(q='kettle').data['results'], [])
+
+    def test_driven_from_the_rarest_term(self):
+        if not get_search_backend().uses_inverted_index:
+            self.skipTest('Only the inverted index caps candidates')
+        for n in range(5):
+            make_product(name=f'Kettle {n}')
+        zebra = make_product(name='Zebra Kettle')
+        xy = make_product(name='XY Stand', description='Fits a xylophone')
+        with mock.patch.object(get_search_backend(), 'max_candidates', 3):
+            self.assertEqual([product['id'] for product in self.search(q='kettle zeb').data['results']], [zebra.pk])
+            self.assertEqual(len(self.search(q='kettle').data['results']), 3)
+        # Prefixes this short match whole words only
+        self.assertEqual([product['id'] for product in self.search(q='xy').data['results']], [xy.pk])
+        self.assertEqual([product['id'] for product in self.search(q='xyl').data['results']], [xy.pk])
+        self.assertEqual(self.search(q='ke').data['results'], [])
+
+    def test_filters_apply_before_the_candidate_cap(self):
+        if not get_search_backend().uses_inverted_index:
+            self.skipTest('Only the inverted index caps candidates')
+        for n in range(8):
+            make_product(name=f'Kettle {n}', stock=0)
+        in_stock = make_product(name='Kettle 8', stock=3)
+        with mock.patch.object(get_search_backend(), 'max_candidates', 3):
+            response = self.search(q='kettle', in_stock='true')
+        self.assertEqual(
+            {product['id'] for product in response.data['results']}, {self.kettle.pk, self.teapot.pk, in_stock.pk}
+        )
+
+    def test_pagination(self):
+        for n in range(5):
+            make_product(name=f'Kettle {n}')
+        first = self.search(q='kettle', page_size=4)
+        second = self.client.get(first.data['next'])
+        self.assertIsNone(second.data['next'])
+        self.assertIsNotNone(second.data['previous'])
+        ids = [product['id'] for product in first.data['results'] + second.data['results']]
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(len(set(ids)), 7)
+
+
+class ProductPricesTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def prices(self, ids):
+        return self.client.post('/api/products/prices/', {'ids': ids}, format='json')
+
+    def test_lookup(self):
+        first = make_product(price=Decimal('2.50'))
+        second = make_product(price=Decimal('7.00'), is_active=False)
+        with self.assertNumQueries(1):
+            response = self.prices([first.pk, str(second.pk), first.pk, second.pk + 100])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.data['products'], key=lambda product: product['id']), [
+            {'id': first.pk, 'price': '2.50', 'is_active': True},
+            {'id': second.pk, 'price': '7.00', 'is_active': False},
+        ])
+        self.assertEqual(self.prices([]).data, {'products': []})
+
+    def test_invalid_bodies(self):
+        product = make_product()
+        for body in [{'ids': product.pk}, {'ids': {'a': 1}}, {}, [product.pk]]:
+            response = self.client.post('/api/products/prices/', body, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.prices(list(range(1, 1002))).status_code, 400)
+        self.assertEqual(self.prices([product.pk, 'sku-1']).status_code, 400)
+        self.assertEqual(self.prices([product.pk, None]).status_code, 400)
+
+
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.a = make_product(name='A', stock=5)
+        self.b = make_product(name='B', stock=2)
+
+    def reserve(self, *items):
+        return self.client.post('/api/reservations/', {
+            'reference': 'cart-1',
+            'items': [{'product_id': product.pk, 'quantity': quantity} for product, quantity in items],
+        }, format='json')
+
+    def stock(self):
+        return dict(Product.objects.order_by().values_list('name', 'stock'))
+
+    def test_reserve_is_all_or_nothing(self):
+        with self.assertNumQueries(7):
+            response = self.reserve((self.a, 2), (self.b, 1), (self.a, 1))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'HELD')
+        self.assertEqual(
+            sorted((item['product'], item['quantity']) for item in response.data['items']),
+            [(self.a.pk, 3), (self.b.pk, 1)]
+        )
+        self.assertEqual(self.stock(), {'A': 2, 'B': 1})
+
+        response = self.reserve((self.a, 1), (self.b, 2))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['product_ids'], [self.b.pk])
+        self.assertEqual(self.stock(), {'A': 2, 'B': 1})
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+        # A could cover its share, so only B is reported short
+        response = self.reserve((self.a, 2), (self.b, 5))
+        self.assertEqual(response.data['product_ids'], [self.b.pk])
+        self.assertEqual(self.stock(), {'A': 2, 'B': 1})
+
+        self.b.is_active = False
+        self.b.save()
+        self.assertEqual(self.reserve((self.b, 1)).status_code, 409)
+
+    def test_commit_and_release(self):
+        committed = self.reserve((self.a, 2)).data['id']
+        released = self.reserve((self.a, 1), (self.b, 2)).data['id']
+
+        response = self.client.post(f'/api/reservations/{committed}/commit/')
+        self.assertEqual(response.data['status'], 'COMMITTED')
+        response = self.client.post(f'/api/reservations/{released}/release/')
+        self.assertEqual(response.data['status'], 'RELEASED')
+        self.assertEqual(self.stock(), {'A': 3, 'B': 2})
+
+        # Neither can change state twice, and stock is only given back once
+        self.assertEqual(self.client.post(f'/api/reservations/{committed}/release/').status_code, 409)
+        self.assertEqual(self.client.post(f'/api/reservations/{released}/release/').status_code, 409)
+        self.assertEqual(self.client.post(f'/api/reservations/{released}/commit/').status_code, 409)
+        self.assertEqual(self.stock(), {'A': 3, 'B': 2})
+
+    def test_sweeper_releases_expired_holds(self):
+        expired = self.reserve((self.a, 2), (self.b, 1)).data['id']
+        held = self.reserve((self.a, 1)).data['id']
+        StockReservation.objects.filter(pk=expired).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.client.post(f'/api/reservations/{expired}/commit/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['error'], 'Reservation is expired, not held')
+        out = StringIO()
+        call_command('release_expired_reservations', '--batch-size', '1', stdout=out)
+        self.assertIn('Released 1 expired reservations', out.getvalue())
+
+        self.assertEqual(StockReservation.objects.get(pk=expired).status, 'EXPIRED')
+        self.assertEqual(StockReservation.objects.get(pk=held).status, 'HELD')
+        self.assertEqual(self.stock(), {'A': 4, 'B': 2})
+
+    def test_update_stock_is_conditional(self):
+        url = f'/api/products/{self.a.pk}/update_stock/'
+        response = self.client.post(url, {'stock_change': -6}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'stock_change': -5}, format='json')
+        self.assertEqual(response.data['stock'], 0)
+        self.assertEqual(self.stock()['A'], 0)
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+    """
+    Runs requests on several connections at once, so it needs a database
+    that is not in memory: MySQL, PostgreSQL or a file-backed SQLite test
+    database (DATABASES['default']['TEST']['NAME']).
+    """
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a database shared between connections')
+
+    def test_parallel_reservations_never_oversell(self):
+        products = [make_product(name=f'P{n}', stock=40) for n in range(4)]
+        attempts, workers = 300, 16
+        rng = random.Random(0)
+        requests = [
+            {
+                'items': [
+                    {'product_id': product.pk, 'quantity': rng.randint(1, 3)}
+                    for product in rng.sample(products, rng.randint(1, 3))
+                ],
+                'release': rng.random() < 0.3,
+            }
+            for _ in range(attempts)
+        ]
+
+        def reserve(request):
+            client = APIClient()
+            try:
+                response = client.post('/api/reservations/', {'items': request['items']}, format='json')
+                if response.status_code == 201 and request['release']:
+                    client.post(f"/api/reservations/{response.data['id']}/release/")
+                return response.status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            statuses = list(pool.map(reserve, requests))
+
+        self.assertEqual(set(statuses) - {201, 409}, set())
+        self.assertIn(409, statuses)
+        held = dict(
+            StockReservationItem.objects.filter(reservation__status='HELD')
+            .order_by().values('product_id').annotate(total=Sum('quantity'))
+            .values_list('product_id', 'total')
+        )
+        for product in Product.objects.all():
+            self.assertGreaterEqual(product.stock, 0)
+            self.assertEqual(product.stock + held.get(product.pk, 0), 40)
+
+
+class ProductImportTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.existing = make_product(name='Old name', external_id='SKU-1', stock=3)
+
+    def post(self, body, content_type):
+        return self.client.generic('POST', '/api/products/import/', body, content_type=content_type)
+
+    def products(self):
+        return {
+            product.external_id: (product.name, product.price, product.stock)
+            for product in Product.objects.exclude(external_id=None)
+        }
+
+    def test_csv_upserts_and_reports_bad_rows(self):
+        body = (
+            'external_id,name,description,price,stock\n'
+            'SKU-1,New name,,12.50,\n'
+            'SKU-2,Lamp,Desk lamp,30.00,7\n'
+            'SKU-3,Broken,,not a price,1\n'
+            ',Nameless,,1.00,1\n'
+            'SKU-2,Lamp,Desk lamp,31.00,\n'
+        )
+        with override_settings(PRODUCTS_IMPORT_CHUNK_SIZE=3):
+            response = self.post(body, 'text/csv')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.data[key] for key in ('created', 'updated', 'failed')},
+            {'created': 1, 'updated': 2, 'failed': 2}
+        )
+        self.assertEqual([(error['line'], error['external_id']) for error in response.data['errors']], [
+            (4, 'SKU-3'), (5, None),
+        ])
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertEqual(self.products(), {
+            'SKU-1': ('New name', Decimal('12.50'), 3),
+            'SKU-2': ('Lamp', Decimal('31.00'), 7),
+        })
+        self.assertEqual(Product.objects.get(external_id='SKU-1').description, 'A widget')
+
+        if get_search_backend().uses_inverted_index:
+            results = self.client.get('/api/products/search/', {'q': 'lamp'}).data['results']
+            self.assertEqual([product['external_id'] for product in results], ['SKU-2'])
+
+    def test_ndjson_chunk_costs_constant_queries(self):
+        lines = [json.dumps({'external_id': 'SKU-1', 'stock': 9})]
+        lines += [
+            json.dumps({'external_id': f'NEW-{n}', 'name': f'Item {n}', 'description': 'Stock item', 'price': '1.00'})
+            for n in range(50)
+        ]
+        lines += ['', 'not json', '[1, 2]']
+
+        # Lookup, savepoint, insert, update, index delete, index insert, release
+        with self.assertNumQueries(7):
+            response = self.post('\n'.join(lines), 'application/x-ndjson')
+
+        self.assertEqual(
+            {key: response.data[key] for key in ('created', 'updated', 'failed')},
+            {'created': 50, 'updated': 1, 'failed': 2}
+        )
+        self.assertEqual([error['line'] for error in response.data['errors']], [53, 54])
+        self.assertEqual(Product.objects.get(external_id='SKU-1').stock, 9)
+
+    def test_product_created_concurrently_is_updated(self):
+        body = 'external_id,name,description,price\nSKU-1,Racing name,Racing description,2.00\n'
+        # As if another import created SKU-1 after this chunk looked it up
+        with mock.patch('django.db.models.query.QuerySet.in_bulk', return_value={}):
+            response = self.post(body, 'text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(Product.objects.filter(external_id='SKU-1').count(), 1)
+        self.assertEqual(self.products()['SKU-1'], ('Racing name', Decimal('2.00'), 3))
+
+    def test_invalid_utf8_reports_what_was_written(self):
+        body = (
+            'external_id,name,description,price\n'
+            'SKU-4,Desk,Pine desk,40.00\n'
+            'SKU-5,Bad,,1.00\n'
+        ).encode() + b'SKU-6,\xff\xfe,,1.00\n'
+        with override_settings(PRODUCTS_IMPORT_CHUNK_SIZE=1):
+            response = self.post(body, 'text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Body is not valid UTF-8')
+        self.assertEqual(
+            {key: response.data[key] for key in ('created', 'updated', 'failed')},
+            {'created': 1, 'updated': 0, 'failed': 1}
+        )
+        self.assertEqual([error['external_id'] for error in response.data['errors']], ['SKU-5'])
+        self.assertIn('SKU-4', self.products())
+
+    def test_unsupported_content_type(self):
+        response = self.client.post('/api/products/import/', {'external_id': 'X'}, format='json')
+        self.assertEqual(response.status_code, 415)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write('\ufeffexternal_id,name,description,price\nSKU-9,Chair,Oak chair,80\nSKU-10,,,\n')
+        self.addCleanup(os.remove, handle.name)
+
+        out, err = StringIO(), StringIO()
+        call_command('import_products', handle.name, '--chunk-size', '1', stdout=out, stderr=err)
+
+        self.assertIn('Created 1, updated 0, failed 1 rows', out.getvalue())
+        self.assertIn('Line 3 (SKU-10)', err.getvalue())
+        self.assertEqual(self.products()['SKU-9'], ('Chair', Decimal('80.00'), 0))
+
+
+class DenyObjectPermission(BasePermission):
+
+    def has_object_permission(self, request, view, obj):
+        return obj.name != 'Secret'
+
+
+@override_settings(PRODUCT_CACHE_ALLOW_LOCAL=True)
+class ProductCacheTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        get_cache().clear()
+        cache_stats.reset()
+        self.product = make_product(name='Lamp', stock=4)
+        self.url = f'/api/products/{self.product.pk}/'
+
+    def test_retrieve_reads_through_and_follows_writes(self):
+        with self.assertNumQueries(1):
+            first = self.client.get(self.url).data
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data, first)
+        self.assertEqual(list(first), list(ProductSerializer(self.product).data))
+
+        self.client.patch(self.url, {'name': 'Desk lamp'}, format='json')
+        self.client.post(f'{self.url}update_stock/', {'stock_change': -1}, format='json')
+        response = self.client.get(self.url)
+        self.assertEqual((response.data['name'], response.data['stock']), ('Desk lamp', 3))
+
+        StockReservation.objects.hold({self.product.pk: 2}, ttl=60)
+        self.assertEqual(self.client.get(self.url).data['stock'], 1)
+
+        self.product.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get('/api/products/abc/').status_code, 404)
+
+        ratios = self.client.get('/api/products/cache_stats/').data
+        self.assertEqual((ratios['product']['hits'], ratios['product']['misses']), (1, 4))
+
+    @override_settings(PRODUCT_STOCK_CACHE_TIMEOUT=0)
+    def test_stock_expires_on_its_own(self):
+        self.client.get(self.url)
+        Product.objects.filter(pk=self.product.pk).update(stock=9, name='Not refetched')
+        with self.assertNumQueries(1) as queries:
+            response = self.client.get(self.url)
+        self.assertNotIn('description', queries.captured_queries[0]['sql'])
+        self.assertEqual((response.data['name'], response.data['stock']), ('Lamp', 9))
+        self.assertEqual(cache_stats.as_dict()['stock']['misses'], 2)
+
+    def test_list_pages_are_cached_until_products_change(self):
+        make_product(name='Chair')
+        first = self.client.get('/api/products/', {'page_size': 1}).data
+        # The first hit fills the product cache by primary key, later ones need no queries
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/products/', {'page_size': 1}).data, first)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/products/', {'page_size': 1}).data, first)
+
+        newest = make_product(name='Table')
+        response = self.client.get('/api/products/', {'page_size': 1})
+        self.assertEqual([product['id'] for product in response.data['results']], [newest.pk])
+        self.assertEqual(cache_stats.as_dict()['list'], {'hits': 2, 'misses': 2, 'hit_ratio': 0.5})
+
+    @override_settings(PRODUCT_CACHE_ALLOW_LOCAL=False)
+    def test_local_cache_is_not_used_by_default(self):
+        get_cache().clear()
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.client.get(self.url)
+            with self.assertNumQueries(1):
+                self.client.get('/api/products/')
+        self.assertEqual(cache_stats.as_dict(), {})
+        self.client.patch(self.url, {'name': 'Desk lamp'}, format='json')
+        self.assertIsNone(get_cache().get(f'product:{self.product.pk}:version'))
+
+    def test_object_permissions_are_checked(self):
+        secret = make_product(name='Secret')
+        self.client.get(f'/api/products/{secret.pk}/')
+        self.client.force_authenticate(get_user_model()(username='tester'))
+        with mock.patch.object(ProductViewSet, 'permission_classes', [DenyObjectPermission]):
+            self.assertEqual(self.client.get(f'/api/products/{secret.pk}/').status_code, 403)
+            self.assertEqual(self.client.get(self.url).status_code, 200)
@@ -1,9 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProductViewSet
+from .views import ProductViewSet, StockReservationViewSet
 
 router = DefaultRouter()
 router.register(r'products', ProductViewSet)
+router.register(r'reservations', StockReservationViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
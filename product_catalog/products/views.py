@@ -1,30 +1,275 @@
-from rest_framework import viewsets, status
+import codecs
+
+from django.conf import settings
+from django.http import Http404
+from django_filters import rest_framework as filters
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import UnsupportedMediaType
+from rest_framework.permissions import BasePermission
 from rest_framework.response import Response
-from .models import Product
-from .serializers import ProductSerializer
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .caching import cache_enabled, get_cache, get_products, list_page_key, stats as cache_stats
+from .importer import READERS, import_products
+from .models import InsufficientStock, Product, StockReservation
+from .pagination import ProductCursorPagination
+from .search import get_search_backend, tokenize
+from .serializers import ProductSerializer, ReservationCreateSerializer, StockReservationSerializer
+
+class ProductFilter(filters.FilterSet):
+    min_price = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = filters.NumberFilter(field_name='price', lookup_expr='lte')
+    in_stock = filters.BooleanFilter(method='filter_in_stock')
+
+    class Meta:
+        model = Product
+        fields = ['is_active']
+
+    def filter_in_stock(self, queryset, name, value):
+        return queryset.filter(stock__gt=0) if value else queryset.filter(stock__lte=0)
 
 class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    filterset_class = ProductFilter
+    pagination_class = ProductCursorPagination
+    prices_max_ids = 1000
+    import_content_types = {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'ndjson',
+        'application/jsonl': 'ndjson',
+    }
+
+    def uses_object_permissions(self):
+        return any(
+            type(permission).has_object_permission is not BasePermission.has_object_permission
+            for permission in self.get_permissions()
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Read through the product cache; see products.caching. Object
+        permissions are checked against the model instance, so with any in
+        force the product is read through get_object() instead.
+        """
+        if not cache_enabled() or self.uses_object_permissions():
+            return super().retrieve(request, *args, **kwargs)
+        try:
+            product_id = int(kwargs['pk'])
+        except ValueError:
+            raise Http404
+        product = get_products([product_id]).get(product_id)
+        if product is None:
+            raise Http404
+        return Response(product)
+
+    def list(self, request, *args, **kwargs):
+        """
+        Each page is cached as its product ids and links, under a list version
+        that every product save or delete replaces; the products themselves
+        come from the product cache. Pages filtered on stock are only kept
+        for PRODUCT_STOCK_CACHE_TIMEOUT.
+        """
+        if not cache_enabled():
+            return super().list(request, *args, **kwargs)
+        cache = get_cache()
+        key = list_page_key(request.build_absolute_uri())
+        page = cache.get(key)
+        if page is not None:
+            cache_stats.record('list', 1, 0)
+            products = get_products(page['ids'])
+            return Response({
+                'next': page['next'],
+                'previous': page['previous'],
+                'results': [products[product_id] for product_id in page['ids'] if product_id in products],
+            })
+
+        cache_stats.record('list', 0, 1)
+        response = super().list(request, *args, **kwargs)
+        cache.set(
+            key,
+            {
+                'ids': [product['id'] for product in response.data['results']],
+                'next': response.data['next'],
+                'previous': response.data['previous'],
+            },
+            settings.PRODUCT_STOCK_CACHE_TIMEOUT if 'in_stock' in request.query_params
+            else settings.PRODUCT_CACHE_TIMEOUT
+        )
+        return response
+
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Product cache hit ratios of the process serving the request."""
+        return Response(cache_stats.as_dict())
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Ranked full-text search over name and description. Every word of ?q=
+        must match, as a prefix; the product list filters apply as well.
+        Pages with ?page= and ?page_size=, up to PRODUCTS_SEARCH_MAX_RESULTS.
+        """
+        query = request.query_params.get('q', '')
+        if not tokenize(query):
+            return Response({'error': 'q must contain at least one word'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = int(request.query_params.get('page', 1))
+        except ValueError:
+            page = 0
+        if page < 1:
+            return Response({'error': 'Invalid page'}, status=status.HTTP_400_BAD_REQUEST)
+
+        page_size = self.paginator.get_page_size(request)
+        offset = (page - 1) * page_size
+        limit = max(0, min(page_size + 1, settings.PRODUCTS_SEARCH_MAX_RESULTS - offset))
+        products = get_search_backend().search(query, self.filter_queryset(self.get_queryset()), offset, limit)
+        has_next = len(products) > page_size and offset + page_size < settings.PRODUCTS_SEARCH_MAX_RESULTS
+        products = products[:page_size]
+
+        url = request.build_absolute_uri()
+        return Response({
+            'next': replace_query_param(url, 'page', page + 1) if has_next else None,
+            'previous': (
+                None if page == 1
+                else remove_query_param(url, 'page') if page == 2
+                else replace_query_param(url, 'page', page - 1)
+            ),
+            'results': [
+                {**data, 'rank': product.rank}
+                for product, data in zip(products, ProductSerializer(products, many=True).data)
+            ],
+        })
+
+    @action(detail=False, methods=['post'])
+    def prices(self, request):
+        """
+        Current price and is_active of many products in one query. Takes
+        {"ids": [...]}; ids with no product are simply left out.
+        """
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        if not isinstance(ids, list) or len(ids) > self.prices_max_ids:
+            return Response(
+                {'error': f'ids must be a list of at most {self.prices_max_ids} product ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = {int(product_id) for product_id in ids}
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid product id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = Product.objects.filter(pk__in=ids).order_by().values_list('id', 'price', 'is_active')
+        return Response({
+            'products': [
+                {'id': product_id, 'price': str(price), 'is_active': is_active}
+                for product_id, price, is_active in products
+            ]
+        })
+
+    @action(detail=False, methods=['post'], url_path='import', url_name='import')
+    def bulk_import(self, request):
+        """
+        Upsert products by external_id from a text/csv (with a header line)
+        or application/x-ndjson body. The body is read as a stream and
+        written in chunks of PRODUCTS_IMPORT_CHUNK_SIZE rows; invalid rows
+        are reported, up to PRODUCTS_IMPORT_MAX_REPORTED_ERRORS of them,
+        without stopping the import.
+        """
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type not in self.import_content_types:
+            raise UnsupportedMediaType(content_type)
+
+        errors = []
+
+        def report(line, external_id, row_errors):
+            if len(errors) < settings.PRODUCTS_IMPORT_MAX_REPORTED_ERRORS:
+                errors.append({'line': line, 'external_id': external_id, 'errors': row_errors})
+
+        # Read the raw stream line by line rather than request.data, which
+        # would hold the whole body in memory
+        lines = codecs.iterdecode(request.stream or [], 'utf-8-sig')
+        rows = READERS[self.import_content_types[content_type]](lines)
+        stats = {}
+        try:
+            import_products(rows, settings.PRODUCTS_IMPORT_CHUNK_SIZE, report, stats)
+        except UnicodeDecodeError:
+            # Chunks written before the bad bytes stay written
+            return Response(
+                {'error': 'Body is not valid UTF-8', **stats, 'errors': errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({**stats, 'errors': errors})
 
     @action(detail=True, methods=['post'])
     def update_stock(self, request, pk=None):
         product = self.get_object()
         stock_change = request.data.get('stock_change', 0)
-        
+
         try:
             stock_change = int(stock_change)
-            product.stock += stock_change
-            if product.stock < 0:
-                return Response(
-                    {'error': 'Stock cannot be negative'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            product.save()
-            return Response(ProductSerializer(product).data)
-        except ValueError:
+        except (TypeError, ValueError):
             return Response(
                 {'error': 'Invalid stock change value'},
                 status=status.HTTP_400_BAD_REQUEST
-            ) 
\ No newline at end of file
+            )
+        # Applied in the database, so concurrent changes cannot overwrite each other
+        if not Product.objects.adjust_stock({product.pk: stock_change}):
+            return Response(
+                {'error': 'Stock cannot be negative'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        product.refresh_from_db(fields=['stock', 'updated_at'])
+        return Response(ProductSerializer(product).data)
+
+class StockReservationViewSet(mixins.CreateModelMixin,
+                              mixins.RetrieveModelMixin,
+                              viewsets.GenericViewSet):
+    """
+    All-or-nothing stock holds for checkouts. POST {"items": [{"product_id",
+    "quantity"}, ...]} takes the stock of every product or none of it; the
+    hold then has STOCK_RESERVATION_TTL_SECONDS to be committed, after which
+    release_expired_reservations gives the stock back.
+    """
+    queryset = StockReservation.objects.prefetch_related('items')
+    serializer_class = StockReservationSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = ReservationCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            reservation = StockReservation.objects.hold(
+                serializer.validated_data['items'],
+                settings.STOCK_RESERVATION_TTL_SECONDS,
+                reference=serializer.validated_data['reference']
+            )
+        except InsufficientStock as exc:
+            return Response(
+                {'error': 'Insufficient stock', 'product_ids': exc.product_ids},
+                status=status.HTTP_409_CONFLICT
+            )
+        reservation = self.get_queryset().get(pk=reservation.pk)
+        return Response(StockReservationSerializer(reservation).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    def commit(self, request, pk=None):
+        reservation = self.get_object()
+        if not reservation.commit():
+            reservation.refresh_from_db(fields=['status'])
+            # A hold past its expiry stays HELD until the sweeper releases it
+            state = 'expired' if reservation.status == 'HELD' else reservation.status.lower()
+            return Response(
+                {'error': f'Reservation is {state}, not held'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(StockReservationSerializer(reservation).data)
+
+    @action(detail=True, methods=['post'])
+    def release(self, request, pk=None):
+        reservation = self.get_object()
+        if not reservation.release():
+            reservation.refresh_from_db(fields=['status'])
+            return Response(
+                {'error': f'Reservation is {reservation.status.lower()}, not held'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(StockReservationSerializer(reservation).data)
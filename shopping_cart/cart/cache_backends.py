@@ -0,0 +1,27 @@
+import time
+
+from django.core.cache.backends.locmem import LocMemCache
+
+
+class PinnedLocMemCache(LocMemCache):
+    """
+    LocMemCache whose culling never drops entries stored without a timeout.
+
+    CacheCartEngine stores carts with unflushed changes (and their dirty
+    markers) that way, so a full cache evicts expired and timed entries,
+    least recently used first, but never a change that is not yet in the
+    database.
+    """
+
+    def _cull(self):
+        now = time.time()
+        for key, expiry in list(self._expire_info.items()):
+            if expiry is not None and expiry <= now:
+                self._delete(key)
+        if len(self._cache) < self._max_entries:
+            return
+
+        evictable = [key for key in reversed(self._cache) if self._expire_info.get(key) is not None]
+        count = len(evictable) if self._cull_frequency == 0 else len(self._cache) // self._cull_frequency
+        for key in evictable[:count]:
+            self._delete(key)
@@ -0,0 +1,139 @@
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from rest_framework import serializers
+from urllib3.util.retry import Retry
+
+
+class OrdersServiceError(Exception):
+    """
+    The orders service could not create the order. status_code is None when
+    the service was unreachable.
+    """
+
+    def __init__(self, message, status_code=None, detail=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class OrderItemPayloadSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    product_name = serializers.CharField(max_length=255)
+    quantity = serializers.IntegerField(min_value=0)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class OrderPayloadSerializer(serializers.Serializer):
+    """
+    The orders service's OrderCreateSerializer contract, field for field, so
+    that LocalOrdersClient rejects what the real service would.
+    """
+    user_id = serializers.IntegerField()
+    shipping_address = serializers.CharField()
+    billing_address = serializers.CharField()
+    items = OrderItemPayloadSerializer(many=True)
+
+
+class BaseOrdersClient:
+    """
+    Creates orders in the orders service. create_order() receives an
+    OrderCreateSerializer payload and an idempotency key, and returns the
+    created order; a repeated key must return the same order.
+    """
+
+    def __init__(self, **options):
+        pass
+
+    def create_order(self, payload, idempotency_key):
+        raise NotImplementedError
+
+
+class HttpOrdersClient(BaseOrdersClient):
+    """
+    POSTs to the orders service over one requests.Session, so checkouts
+    reuse pooled keep-alive connections. Connection failures and 502/503/504
+    responses are retried, which the idempotency key makes safe for POSTs.
+    """
+
+    def __init__(self, url, timeout=10, headers=None, retries=2, pool_size=10, **options):
+        super().__init__(**options)
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        adapter = HTTPAdapter(
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.2,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=['POST'],
+                raise_on_status=False
+            )
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def create_order(self, payload, idempotency_key):
+        try:
+            response = self.session.post(
+                self.url,
+                json=payload,
+                headers={'Idempotency-Key': idempotency_key},
+                timeout=self.timeout
+            )
+        except requests.RequestException as exc:
+            raise OrdersServiceError(f'Orders service unreachable: {exc}')
+
+        if response.status_code >= 400:
+            try:
+                detail = response.json()
+            except ValueError:
+                detail = response.text
+            raise OrdersServiceError(
+                f'Orders service returned {response.status_code}',
+                status_code=response.status_code,
+                detail=detail
+            )
+        return response.json()
+
+
+class LocalOrdersClient(BaseOrdersClient):
+    """
+    In-process stand-in for the orders service, for tests and local
+    development. Keeps created orders in memory, keyed by idempotency key.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.orders = {}
+
+    def create_order(self, payload, idempotency_key):
+        serializer = OrderPayloadSerializer(data=payload)
+        if not serializer.is_valid():
+            raise OrdersServiceError('Orders service returned 400', status_code=400, detail=serializer.errors)
+        if idempotency_key not in self.orders:
+            self.orders[idempotency_key] = {
+                **payload,
+                'id': len(self.orders) + 1,
+                'status': 'PENDING',
+                'total_amount': str(sum(
+                    item['quantity'] * Decimal(item['unit_price']) for item in payload['items']
+                )),
+            }
+        return self.orders[idempotency_key]
+
+
+_clients = {}
+
+
+def get_orders_client():
+    """The client named by settings.ORDERS_SERVICE, shared across requests."""
+    config = settings.ORDERS_SERVICE
+    if config['BACKEND'] not in _clients:
+        _clients[config['BACKEND']] = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _clients[config['BACKEND']]
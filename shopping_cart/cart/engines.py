@@ -0,0 +1,490 @@
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from .cache_backends import PinnedLocMemCache
+from .models import Cart, CartItem
+from .serializers import CartSerializer
+
+logger = logging.getLogger(__name__)
+
+
+class CartItemNotFound(Exception):
+    pass
+
+
+class CartBusy(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The cart is being changed by another request; try again.'
+    default_code = 'cart_busy'
+
+
+def apply_operations(lines, operations, now):
+    """
+    Apply an ordered list of cart operations to ``lines``, a dict of
+    product_id -> {'quantity', 'unit_price', ...}, in place. Raises
+    CartItemNotFound for an update or remove of a product not in the cart.
+    """
+    for operation in operations:
+        op = operation['op']
+        product_id = operation.get('product_id')
+        if op == 'clear':
+            lines.clear()
+        elif op == 'add':
+            line = lines.get(product_id)
+            if line is None:
+                lines[product_id] = {
+                    'id': None,
+                    'product_id': product_id,
+                    'quantity': operation['quantity'],
+                    'unit_price': operation['unit_price'],
+                    'created_at': now,
+                    'updated_at': now,
+                }
+            else:
+                line['quantity'] += operation['quantity']
+                line['unit_price'] = operation['unit_price']
+                line['updated_at'] = now
+        elif op == 'update':
+            if product_id not in lines:
+                raise CartItemNotFound(product_id)
+            if operation['quantity'] > 0:
+                lines[product_id]['quantity'] = operation['quantity']
+                lines[product_id]['updated_at'] = now
+            else:
+                del lines[product_id]
+        elif op == 'remove':
+            if lines.pop(product_id, None) is None:
+                raise CartItemNotFound(product_id)
+        else:
+            raise ValueError(f'Unknown cart operation {op!r}')
+    return lines
+
+
+class DatabaseCartEngine:
+    """
+    Reads and writes carts directly in the database on every call.
+    """
+
+    def get_cart(self, user_id):
+        return get_object_or_404(Cart, user_id=user_id, is_active=True)
+
+    def version(self, user_id):
+        """(version, updated_at) of the user's active cart, without loading its items."""
+        cart_id, updated_at = get_object_or_404(
+            Cart.objects.values_list('id', 'updated_at'), user_id=user_id, is_active=True
+        )
+        return Cart.version_of(cart_id, updated_at), updated_at
+
+    def render(self, cart_id):
+        # The totals are stored on the cart, so the items are the only other read
+        return CartSerializer(Cart.objects.prefetch_related('items').get(pk=cart_id)).data
+
+    def represent(self, user_id):
+        cart = get_object_or_404(Cart.objects.prefetch_related('items'), user_id=user_id, is_active=True)
+        return CartSerializer(cart).data
+
+    def add_item(self, user_id, product_id, quantity, unit_price):
+        cart = self.get_cart(user_id)
+        with transaction.atomic():
+            CartItem.objects.add_quantity(cart.id, product_id, quantity, unit_price)
+            Cart.objects.refresh_totals([cart.id])
+        return self.render(cart.id)
+
+    def update_item(self, user_id, product_id, quantity):
+        cart = self.get_cart(user_id)
+        with transaction.atomic():
+            try:
+                cart_item = CartItem.objects.get(cart=cart, product_id=product_id)
+            except CartItem.DoesNotExist:
+                raise CartItemNotFound(product_id)
+            if quantity > 0:
+                cart_item.quantity = quantity
+                cart_item.save()
+            else:
+                cart_item.delete()
+            Cart.objects.refresh_totals([cart.id])
+        return self.render(cart.id)
+
+    def remove_item(self, user_id, product_id):
+        cart = self.get_cart(user_id)
+        with transaction.atomic():
+            deleted, _ = CartItem.objects.filter(cart=cart, product_id=product_id).delete()
+            if not deleted:
+                raise CartItemNotFound(product_id)
+            Cart.objects.refresh_totals([cart.id])
+        return self.render(cart.id)
+
+    def clear(self, user_id):
+        cart = self.get_cart(user_id)
+        with transaction.atomic():
+            cart.items.all().delete()
+            Cart.objects.refresh_totals([cart.id])
+        return self.render(cart.id)
+
+    def apply(self, user_id, operations):
+        """
+        Apply a batch of operations against the cart's items, read once
+        under lock, and write the net result with at most one INSERT, one
+        UPDATE and one DELETE.
+        """
+        cart = self.get_cart(user_id)
+        now = timezone.now()
+        with transaction.atomic():
+            stored = {
+                item.product_id: item
+                for item in CartItem.objects.select_for_update().filter(cart=cart)
+            }
+            lines = apply_operations(
+                {
+                    product_id: {'quantity': item.quantity, 'unit_price': item.unit_price}
+                    for product_id, item in stored.items()
+                },
+                operations,
+                now
+            )
+
+            to_create, to_update = [], []
+            for product_id, line in lines.items():
+                item = stored.pop(product_id, None)
+                if item is None:
+                    to_create.append(CartItem(
+                        cart=cart,
+                        product_id=product_id,
+                        quantity=line['quantity'],
+                        unit_price=line['unit_price']
+                    ))
+                elif (item.quantity, item.unit_price) != (line['quantity'], line['unit_price']):
+                    item.quantity = line['quantity']
+                    item.unit_price = line['unit_price']
+                    item.updated_at = now
+                    to_update.append(item)
+
+            if to_create:
+                CartItem.objects.bulk_create(to_create, batch_size=500)
+            if to_update:
+                CartItem.objects.bulk_update(to_update, ['quantity', 'unit_price', 'updated_at'], batch_size=500)
+            if stored:
+                CartItem.objects.filter(pk__in=[item.pk for item in stored.values()]).delete()
+            Cart.objects.refresh_totals([cart.id])
+        return self.render(cart.id)
+
+    def invalidate(self, user_id):
+        pass
+
+    def flush(self, user_ids=None):
+        return 0
+
+
+class CacheCartEngine:
+    """
+    Keeps active carts in a Django cache and writes changes back to
+    Cart/CartItem in batches (write-behind).
+
+    Each mutation runs under a per-cart lock held in the cache, updates the
+    cached cart and marks it dirty. Dirty carts are flushed together once
+    CART_FLUSH_BATCH_SIZE of them have accumulated or CART_FLUSH_INTERVAL
+    seconds have passed, and on demand through flush() or the flush_carts
+    command. A cart changed while it is being flushed stays dirty.
+
+    Dirty carts are stored without a timeout and must never be evicted, so
+    the cache has to be a PinnedLocMemCache or a shared cache that does not
+    evict (such as Redis with maxmemory-policy noeviction). The
+    local-memory cache is per process; use a shared cache when requests for
+    one cart can land on different processes.
+    """
+    dirty_key = 'cart:dirty'
+    dirty_lock_key = 'cart:dirty:lock'
+    flush_lock_key = 'cart:flush:lock'
+    lock_timeout = 5
+    flush_lock_timeout = 60
+
+    def __init__(self, cache_alias=None, timeout=None, flush_batch_size=None, flush_interval=None):
+        self.cache = caches[cache_alias or settings.CART_CACHE_ALIAS]
+        if isinstance(self.cache, LocMemCache) and not isinstance(self.cache, PinnedLocMemCache):
+            raise ImproperlyConfigured(
+                'CacheCartEngine needs a cache that never evicts unflushed carts; '
+                'use cart.cache_backends.PinnedLocMemCache instead of LocMemCache'
+            )
+        self.timeout = timeout if timeout is not None else settings.CART_CACHE_TIMEOUT
+        self.flush_batch_size = flush_batch_size or settings.CART_FLUSH_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else settings.CART_FLUSH_INTERVAL
+        self.last_flush = time.monotonic()
+
+    def cache_key(self, user_id):
+        return f'cart:{user_id}'
+
+    def lock_key(self, user_id):
+        return f'cart:{user_id}:lock'
+
+    def dirty_marker_key(self, user_id):
+        return f'cart:{user_id}:dirty'
+
+    @contextmanager
+    def lock(self, key, timeout=None):
+        """
+        Hold a lock taken with cache.add, which is atomic, so it is shared by
+        every process using the cache. Raises CartBusy after timeout seconds.
+        """
+        timeout = timeout or self.lock_timeout
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while not self.cache.add(key, token, timeout):
+            if time.monotonic() >= deadline:
+                raise CartBusy()
+            time.sleep(0.002)
+        try:
+            yield
+        finally:
+            if self.cache.get(key) == token:
+                self.cache.delete(key)
+
+    def load(self, user_id):
+        state = self.cache.get(self.cache_key(user_id))
+        if state is not None:
+            return state
+
+        cart = Cart.objects.filter(user_id=user_id, is_active=True).prefetch_related('items').first()
+        if cart is None:
+            raise Http404('No Cart matches the given query.')
+        state = {
+            'id': cart.id,
+            'user_id': cart.user_id,
+            'created_at': cart.created_at,
+            'updated_at': cart.updated_at,
+            'is_active': cart.is_active,
+            'items': {
+                item.product_id: {
+                    'id': item.id,
+                    'product_id': item.product_id,
+                    'quantity': item.quantity,
+                    'unit_price': item.unit_price,
+                    'created_at': item.created_at,
+                    'updated_at': item.updated_at,
+                }
+                for item in cart.items.all()
+            },
+        }
+        # add, not set: a dirty cart stored meanwhile must not be overwritten
+        if not self.cache.add(self.cache_key(user_id), state, self.timeout):
+            return self.cache.get(self.cache_key(user_id)) or state
+        return state
+
+    def store(self, user_id, state):
+        """Cache a changed cart and mark it dirty. Call it under the cart's lock."""
+        state['updated_at'] = timezone.now()
+        # No timeout until flushed, so the change cannot expire or be culled
+        self.cache.set(self.cache_key(user_id), state, None)
+        dirty_count = 0
+        if self.cache.add(self.dirty_marker_key(user_id), True, None):
+            with self.lock(self.dirty_lock_key):
+                dirty = self.cache.get(self.dirty_key) or set()
+                dirty.add(user_id)
+                self.cache.set(self.dirty_key, dirty, None)
+            dirty_count = len(dirty)
+        return state, dirty_count
+
+    def to_representation(self, state):
+        money = serializers.DecimalField(max_digits=10, decimal_places=2)
+        timestamp = serializers.DateTimeField()
+        items = sorted(state['items'].values(), key=lambda item: item['created_at'])
+        return {
+            'id': state['id'],
+            'user_id': state['user_id'],
+            'items': [
+                {
+                    'id': item['id'],
+                    'product_id': item['product_id'],
+                    'quantity': item['quantity'],
+                    'unit_price': money.to_representation(item['unit_price']),
+                    'total_price': money.to_representation(item['quantity'] * item['unit_price']),
+                    'created_at': timestamp.to_representation(item['created_at']),
+                    'updated_at': timestamp.to_representation(item['updated_at']),
+                }
+                for item in items
+            ],
+            'total_items': sum(item['quantity'] for item in items),
+            'total_amount': sum((item['quantity'] * item['unit_price'] for item in items), Decimal('0')),
+            'created_at': timestamp.to_representation(state['created_at']),
+            'updated_at': timestamp.to_representation(state['updated_at']),
+            'is_active': state['is_active'],
+        }
+
+    def represent(self, user_id):
+        return self.to_representation(self.load(user_id))
+
+    def version(self, user_id):
+        state = self.cache.get(self.cache_key(user_id))
+        if state is None:
+            return DatabaseCartEngine().version(user_id)
+        return Cart.version_of(state['id'], state['updated_at']), state['updated_at']
+
+    def apply(self, user_id, operations):
+        with self.lock(self.lock_key(user_id)):
+            # Work on a copy so a failed operation leaves the cached cart as it was
+            state = self.load(user_id)
+            state = dict(state, items={
+                product_id: dict(item) for product_id, item in state['items'].items()
+            })
+            apply_operations(state['items'], operations, timezone.now())
+            state, dirty_count = self.store(user_id, state)
+
+        if dirty_count >= self.flush_batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+        return self.to_representation(state)
+
+    def add_item(self, user_id, product_id, quantity, unit_price):
+        return self.apply(user_id, [
+            {'op': 'add', 'product_id': product_id, 'quantity': quantity, 'unit_price': unit_price}
+        ])
+
+    def update_item(self, user_id, product_id, quantity):
+        return self.apply(user_id, [{'op': 'update', 'product_id': product_id, 'quantity': quantity}])
+
+    def remove_item(self, user_id, product_id):
+        return self.apply(user_id, [{'op': 'remove', 'product_id': product_id}])
+
+    def clear(self, user_id):
+        return self.apply(user_id, [{'op': 'clear'}])
+
+    def invalidate(self, user_id):
+        # Write pending changes first so dropping the entry loses nothing
+        self.flush([user_id])
+        with self.lock(self.lock_key(user_id)):
+            if self.cache.get(self.dirty_marker_key(user_id)) is None:
+                self.cache.delete(self.cache_key(user_id))
+
+    def flush(self, user_ids=None):
+        """
+        Write the dirty carts, or those of user_ids, back to the database in
+        one transaction, with one bulk INSERT, one bulk UPDATE and one DELETE
+        for all their items. Flushes are serialized, and a cart that changed
+        while it was written stays dirty for the next one. So does a cart the
+        database refused; it is logged and the others are still written.
+        Returns the number of carts written.
+        """
+        with self.lock(self.flush_lock_key, self.flush_lock_timeout):
+            if user_ids is None:
+                self.last_flush = time.monotonic()
+            dirty = self.cache.get(self.dirty_key) or set()
+            if user_ids is not None:
+                dirty &= set(user_ids)
+            if not dirty:
+                return 0
+            cached = self.cache.get_many([self.cache_key(user_id) for user_id in dirty])
+            states = {
+                user_id: cached[self.cache_key(user_id)]
+                for user_id in dirty
+                if self.cache_key(user_id) in cached
+            }
+            failed = self.write(states)
+            for user_id, state in states.items():
+                if user_id not in failed:
+                    self.mark_clean(user_id, state)
+        return len(states) - len(failed)
+
+    def write(self, states):
+        """
+        Write states in one batch. If the database refuses it, write each
+        cart in its own savepoint instead, so one bad cart cannot hold back
+        the rest. Returns the user ids of the carts that failed.
+        """
+        try:
+            self.write_batch(states)
+            return set()
+        except DatabaseError:
+            if len(states) == 1:
+                logger.exception('Could not flush the cart of user %s', *states)
+                return set(states)
+
+        failed = set()
+        for user_id, state in states.items():
+            try:
+                self.write_batch({user_id: state})
+            except DatabaseError:
+                logger.exception('Could not flush the cart of user %s', user_id)
+                failed.add(user_id)
+        return failed
+
+    def write_batch(self, states):
+        now = timezone.now()
+        to_create, to_update, to_delete = [], [], []
+        with transaction.atomic():
+            carts = {
+                cart.id: cart
+                for cart in Cart.objects.filter(pk__in=[state['id'] for state in states.values()], is_active=True)
+            }
+            existing = {}
+            for item in CartItem.objects.filter(cart_id__in=carts):
+                existing.setdefault(item.cart_id, {})[item.product_id] = item
+
+            for state in states.values():
+                if state['id'] not in carts:
+                    continue
+                stored = existing.get(state['id'], {})
+                for product_id, cached in state['items'].items():
+                    item = stored.pop(product_id, None)
+                    if item is None:
+                        to_create.append((cached, CartItem(
+                            cart_id=state['id'],
+                            product_id=product_id,
+                            quantity=cached['quantity'],
+                            unit_price=cached['unit_price']
+                        )))
+                    elif (item.quantity, item.unit_price) != (cached['quantity'], cached['unit_price']):
+                        item.quantity = cached['quantity']
+                        item.unit_price = cached['unit_price']
+                        item.updated_at = now
+                        to_update.append(item)
+                to_delete.extend(item.pk for item in stored.values())
+
+            CartItem.objects.bulk_create([item for _, item in to_create], batch_size=500)
+            CartItem.objects.bulk_update(to_update, ['quantity', 'unit_price', 'updated_at'], batch_size=500)
+            CartItem.objects.filter(pk__in=to_delete).delete()
+            Cart.objects.refresh_totals(carts)
+
+        # Backends that return primary keys from bulk inserts let the cached
+        # items pick up their ids straight away.
+        for cached, item in to_create:
+            cached['id'] = item.pk
+
+    def mark_clean(self, user_id, state):
+        """
+        Give a flushed cart its timeout back and drop its dirty marks, unless
+        it was changed after the state that was written.
+        """
+        with self.lock(self.lock_key(user_id)):
+            current = self.cache.get(self.cache_key(user_id))
+            if current is not None and current['updated_at'] != state['updated_at']:
+                return
+            if current is not None:
+                self.cache.set(self.cache_key(user_id), state, self.timeout)
+            with self.lock(self.dirty_lock_key):
+                dirty = self.cache.get(self.dirty_key) or set()
+                dirty.discard(user_id)
+                self.cache.set(self.dirty_key, dirty, None)
+            self.cache.delete(self.dirty_marker_key(user_id))
+
+
+_engines = {}
+
+
+def get_cart_engine():
+    """The engine named by settings.CART_ENGINE, shared across requests."""
+    if settings.CART_ENGINE not in _engines:
+        _engines[settings.CART_ENGINE] = import_string(settings.CART_ENGINE)()
+    return _engines[settings.CART_ENGINE]
@@ -0,0 +1,61 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from cart.engines import CacheCartEngine, CartItemNotFound, DatabaseCartEngine
+from cart.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Compare cart mutation throughput of the database and cache engines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ops', type=int, default=2000, help='Mutations per engine')
+        parser.add_argument('--carts', type=int, default=50, help='Carts the mutations are spread over')
+        parser.add_argument('--products', type=int, default=20, help='Distinct products per cart')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        engines = [
+            ('database', DatabaseCartEngine()),
+            ('cache', CacheCartEngine(flush_interval=float('inf'))),
+        ]
+        for name, engine in engines:
+            user_ids = [f'bench-{name}-{i}' for i in range(options['carts'])]
+            Cart.objects.filter(user_id__in=user_ids).delete()
+            Cart.objects.bulk_create([Cart(user_id=user_id) for user_id in user_ids])
+            try:
+                elapsed = self.run(engine, user_ids, options)
+            finally:
+                for user_id in user_ids:
+                    engine.invalidate(user_id)
+                Cart.objects.filter(user_id__in=user_ids).delete()
+            self.stdout.write(
+                f"{name:>8}: {options['ops']} ops in {elapsed:.3f}s, {options['ops'] / elapsed:,.0f} ops/s"
+            )
+
+    def run(self, engine, user_ids, options):
+        rng = random.Random(options['seed'])
+        products = [str(i) for i in range(options['products'])]
+        started = time.perf_counter()
+        for _ in range(options['ops']):
+            user_id = rng.choice(user_ids)
+            product_id = rng.choice(products)
+            roll = rng.random()
+            if roll < 0.6:
+                engine.add_item(user_id, product_id, 1, Decimal('9.99'))
+            elif roll < 0.85:
+                try:
+                    engine.update_item(user_id, product_id, rng.randint(1, 5))
+                except CartItemNotFound:
+                    engine.add_item(user_id, product_id, 1, Decimal('9.99'))
+            else:
+                try:
+                    engine.remove_item(user_id, product_id)
+                except CartItemNotFound:
+                    pass
+        # Persisting the buffered writes is part of the cache engine's cost
+        engine.flush()
+        return time.perf_counter() - started
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from cart.engines import get_cart_engine
+
+
+class Command(BaseCommand):
+    help = 'Write pending cart changes from the cache engine back to the database'
+
+    def handle(self, *args, **options):
+        flushed = get_cart_engine().flush()
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} carts'))
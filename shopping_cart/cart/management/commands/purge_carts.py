@@ -0,0 +1,75 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Deactivate carts not modified within the inactivity TTL, then delete '
+        'inactive expired carts and their items in committed batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CART_INACTIVITY_TTL_DAYS,
+            help='Expire carts not modified for this many days'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Carts handled per statement')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Pause between batches, in seconds')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after deleting this many carts')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+        limit = options['limit']
+
+        # Deactivating first takes expired carts out of every lookup straight
+        # away; updated_at is left alone, so a run interrupted at any point
+        # resumes with whatever is still expired.
+        deactivated = 0
+        while True:
+            cart_ids = list(
+                Cart.objects.filter(is_active=True, updated_at__lt=cutoff)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not cart_ids:
+                break
+            # Re-check the cutoff so a cart touched since the read stays active
+            deactivated += Cart.objects.filter(pk__in=cart_ids, updated_at__lt=cutoff).update(is_active=False)
+            self.stdout.write(f'Deactivated {deactivated} carts (up to id {cart_ids[-1]})')
+            self.pause(options['sleep'])
+
+        deleted_carts = deleted_items = 0
+        while limit is None or deleted_carts < limit:
+            size = batch_size if limit is None else min(batch_size, limit - deleted_carts)
+            with transaction.atomic():
+                cart_ids = list(
+                    Cart.objects.filter(is_active=False, updated_at__lt=cutoff)
+                    .order_by('pk')
+                    .values_list('pk', flat=True)[:size]
+                )
+                if not cart_ids:
+                    break
+                items, _ = CartItem.objects.filter(cart_id__in=cart_ids).delete()
+                carts, _ = Cart.objects.filter(pk__in=cart_ids).delete()
+
+            deleted_carts += carts
+            deleted_items += items
+            self.stdout.write(f'Deleted {deleted_carts} carts and {deleted_items} items (up to id {cart_ids[-1]})')
+            self.pause(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deactivated {deactivated} carts; deleted {deleted_carts} carts and {deleted_items} items '
+            f'not modified since {cutoff:%Y-%m-%d}'
+        ))
+
+    def pause(self, seconds):
+        if seconds:
+            time.sleep(seconds)
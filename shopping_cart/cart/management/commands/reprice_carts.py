@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from cart.pricing import reprice_carts
+
+
+class Command(BaseCommand):
+    help = (
+        'Reprice active cart items from the product catalog, looking up prices '
+        'in batches and removing products that are inactive or gone'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Cart items repriced per chunk')
+
+    def handle(self, *args, **options):
+        stats = reprice_carts(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {stats['items']} items: {stats['repriced']} repriced, "
+            f"{stats['removed']} removed across {stats['carts']} carts"
+        ))
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-17 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_cart_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['is_active', 'updated_at'], name='cart_cart_is_acti_de3868_idx'),
+        ),
+    ]
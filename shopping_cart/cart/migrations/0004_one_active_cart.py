@@ -0,0 +1,47 @@
+# Generated by Django 5.0.2 on 2026-10-17 18:48
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deactivate_duplicate_carts(apps, schema_editor):
+    # Keep each user's most recently modified active cart
+    Cart = apps.get_model('cart', 'Cart')
+    duplicated = (
+        Cart.objects.filter(is_active=True)
+        .values('user_id')
+        .annotate(carts=Count('id'))
+        .filter(carts__gt=1)
+        .values_list('user_id', flat=True)
+    )
+    for user_id in duplicated:
+        carts = Cart.objects.filter(user_id=user_id, is_active=True).order_by('-updated_at', '-id')
+        Cart.objects.filter(pk__in=list(carts.values_list('pk', flat=True)[1:])).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_cart_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['user_id', 'is_active'], name='cart_cart_user_id_5d777a_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='cart',
+            name='cart_cart_user_id_b645f9_idx',
+        ),
+        migrations.RunPython(deactivate_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='cart',
+            name='active_user_id',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(is_active=True, then=models.F('user_id')), default=None), output_field=models.CharField(max_length=100, null=True)),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('active_user_id',), name='cart_one_active_cart_per_user'),
+        ),
+    ]
@@ -1,20 +1,126 @@
-from django.db import models
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import connections, models
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
+from django.utils import timezone
+
+class CartManager(models.Manager):
+    def refresh_totals(self, cart_ids):
+        """
+        Recompute the denormalized totals of the given carts from their items
+        in one UPDATE, and mark them as modified. Call it in the same
+        transaction as the item writes so the totals never drift.
+        """
+        items = CartItem.objects.filter(cart_id=OuterRef('pk')).order_by().values('cart_id')
+        amount_field = self.model._meta.get_field('total_amount')
+        return self.filter(pk__in=cart_ids).update(
+            total_items=Coalesce(
+                Subquery(items.annotate(total=Sum('quantity')).values('total')),
+                Value(0)
+            ),
+            total_amount=Coalesce(
+                Subquery(items.annotate(
+                    total=Sum(F('quantity') * F('unit_price'), output_field=amount_field)
+                ).values('total')),
+                Value(Decimal('0')),
+                output_field=amount_field
+            ),
+            updated_at=timezone.now()
+        )
 
 class Cart(models.Model):
     user_id = models.CharField(max_length=100)  # External user ID from the user service
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Kept in step with the items by CartManager.refresh_totals
+    total_items = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    # user_id while the cart is active, NULL otherwise. MySQL has no partial
+    # unique indexes, so the one-active-cart-per-user rule is a plain unique
+    # constraint on this column, which every backend supports.
+    active_user_id = models.GeneratedField(
+        expression=Case(When(is_active=True, then=F('user_id')), default=None),
+        output_field=models.CharField(max_length=100, null=True),
+        db_persist=True
+    )
+
+    objects = CartManager()
 
     class Meta:
         indexes = [
-            models.Index(fields=['user_id']),
+            models.Index(fields=['user_id', 'is_active']),
+            models.Index(fields=['is_active', 'updated_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['active_user_id'], name='cart_one_active_cart_per_user'),
         ]
 
     def __str__(self):
         return f"Cart {self.id} - User {self.user_id}"
 
+    @staticmethod
+    def version_of(cart_id, updated_at):
+        """
+        Opaque token that changes whenever the cart or its items do, served
+        as the ETag. Item writes bump updated_at through refresh_totals.
+        """
+        return f"{cart_id}-{updated_at.astimezone(dt_timezone.utc).strftime('%Y%m%d%H%M%S%f')}"
+
+    @property
+    def version(self):
+        return self.version_of(self.id, self.updated_at)
+
+class CartItemManager(models.Manager):
+    def add_quantity(self, cart_id, product_id, quantity, unit_price):
+        """
+        Add quantity to a cart line in a single atomic INSERT ... ON
+        DUPLICATE KEY / ON CONFLICT statement, creating the line if needed.
+        Concurrent adds for the same product all land on one row.
+        """
+        connection = connections[self.db]
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        table = qn(opts.db_table)
+        columns = [qn(opts.get_field(name).column) for name in (
+            'cart', 'product_id', 'quantity', 'unit_price', 'created_at', 'updated_at'
+        )]
+        cart_col, product_col, quantity_col, price_col, _, updated_col = columns
+        insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES (%s, %s, %s, %s, %s, %s)"
+
+        if connection.vendor == 'mysql':
+            sql = (
+                f"{insert} ON DUPLICATE KEY UPDATE "
+                f"{quantity_col} = {quantity_col} + VALUES({quantity_col}), "
+                f"{price_col} = VALUES({price_col}), "
+                f"{updated_col} = VALUES({updated_col})"
+            )
+        else:
+            # PostgreSQL and SQLite share the ON CONFLICT syntax
+            sql = (
+                f"{insert} ON CONFLICT ({cart_col}, {product_col}) DO UPDATE SET "
+                f"{quantity_col} = {table}.{quantity_col} + excluded.{quantity_col}, "
+                f"{price_col} = excluded.{price_col}, "
+                f"{updated_col} = excluded.{updated_col}"
+            )
+
+        now = timezone.now()
+        price_field = opts.get_field('unit_price')
+        created_field = opts.get_field('created_at')
+        params = [
+            cart_id,
+            product_id,
+            quantity,
+            price_field.get_db_prep_save(unit_price, connection),
+            created_field.get_db_prep_save(now, connection),
+            created_field.get_db_prep_save(now, connection),
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE)
     product_id = models.CharField(max_length=100)  # External product ID from the product service
@@ -23,6 +129,8 @@ class CartItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartItemManager()
+
     class Meta:
         unique_together = ('cart', 'product_id')
         indexes = [
@@ -0,0 +1,179 @@
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+from .engines import get_cart_engine
+from .models import Cart, CartItem
+
+
+class CatalogError(Exception):
+    pass
+
+
+class BaseCatalogClient:
+    """
+    Looks up current prices in the product catalog. fetch_prices() receives
+    at most batch_size product ids and returns {product_id: (price, is_active)}
+    for those the catalog knows; it must raise CatalogError if the lookup
+    failed, so that missing ids can be trusted to mean deleted products.
+    """
+
+    def __init__(self, batch_size=1000, **options):
+        self.batch_size = batch_size
+
+    def fetch_prices(self, product_ids):
+        raise NotImplementedError
+
+
+class HttpCatalogClient(BaseCatalogClient):
+    """Calls the catalog's products/prices/ endpoint over one pooled requests.Session."""
+
+    def __init__(self, url, timeout=10, headers=None, pool_size=10, **options):
+        super().__init__(**options)
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch_prices(self, product_ids):
+        try:
+            response = self.session.post(self.url, json={'ids': product_ids}, timeout=self.timeout)
+            response.raise_for_status()
+            products = response.json()['products']
+        except (requests.RequestException, ValueError, KeyError) as exc:
+            raise CatalogError(f'Price lookup failed: {exc}')
+        return {
+            str(product['id']): (Decimal(product['price']), product['is_active'])
+            for product in products
+        }
+
+
+_clients = {}
+
+
+def get_catalog_client():
+    """The client named by settings.PRODUCT_CATALOG, shared across requests."""
+    config = settings.PRODUCT_CATALOG
+    if config['BACKEND'] not in _clients:
+        _clients[config['BACKEND']] = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _clients[config['BACKEND']]
+
+
+def get_prices(product_ids, client=None):
+    """
+    {product_id: (price, is_active)} for the given ids, served from the local
+    price cache where possible and fetched from the catalog in batches of
+    client.batch_size otherwise. Products the catalog no longer has map to
+    (None, False). Ids the catalog cannot know (not numeric) are left out.
+    """
+    client = client or get_catalog_client()
+    cache = caches[settings.CART_CACHE_ALIAS]
+    product_ids = sorted({product_id for product_id in product_ids if str(product_id).isdigit()})
+
+    cached = cache.get_many([f'price:{product_id}' for product_id in product_ids])
+    prices = {
+        product_id: cached[f'price:{product_id}']
+        for product_id in product_ids
+        if f'price:{product_id}' in cached
+    }
+    missing = [product_id for product_id in product_ids if product_id not in prices]
+    for start in range(0, len(missing), client.batch_size):
+        batch = missing[start:start + client.batch_size]
+        fetched = client.fetch_prices(batch)
+        fetched = {product_id: fetched.get(product_id, (None, False)) for product_id in batch}
+        cache.set_many(
+            {f'price:{product_id}': price for product_id, price in fetched.items()},
+            settings.CATALOG_PRICE_CACHE_TIMEOUT
+        )
+        prices.update(fetched)
+    return prices
+
+
+def reprice_carts(cart_ids=None, chunk_size=1000, client=None):
+    """
+    Bring the items of the given active carts (all of them by default) in
+    line with the catalog: changed prices are rewritten with one bulk UPDATE
+    per chunk of items, and products that are inactive or gone are removed.
+    Returns counts of items checked, repriced and removed, and carts touched.
+    """
+    engine = get_cart_engine()
+    # Write-behind carts must reach the database before they are repriced
+    if cart_ids is None:
+        engine.flush()
+    else:
+        engine.flush(Cart.objects.filter(pk__in=cart_ids).values_list('user_id', flat=True))
+
+    client = client or get_catalog_client()
+    items = CartItem.objects.filter(cart__is_active=True)
+    if cart_ids is not None:
+        items = items.filter(cart_id__in=cart_ids)
+
+    # Warm the price cache over the distinct products first, so the catalog
+    # sees one full batch per batch_size products however they are spread
+    # across carts and item chunks.
+    last_product_id = ''
+    while True:
+        product_ids = list(
+            items.filter(product_id__gt=last_product_id)
+            .order_by('product_id')
+            .values_list('product_id', flat=True)
+            .distinct()[:client.batch_size]
+        )
+        if not product_ids:
+            break
+        get_prices(product_ids, client)
+        last_product_id = product_ids[-1]
+
+    items = items.annotate(user_id=F('cart__user_id'))
+
+    stats = {'items': 0, 'repriced': 0, 'removed': 0}
+    touched_carts = set()
+    last_pk = 0
+    while True:
+        chunk = list(items.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        stats['items'] += len(chunk)
+
+        prices = get_prices([item.product_id for item in chunk], client)
+        now = timezone.now()
+        to_update, to_delete, touched = [], [], {}
+        for item in chunk:
+            if item.product_id not in prices:
+                continue
+            price, is_active = prices[item.product_id]
+            if price is None or not is_active:
+                to_delete.append(item.pk)
+            elif price != item.unit_price:
+                item.unit_price = price
+                item.updated_at = now
+                to_update.append(item)
+            else:
+                continue
+            touched[item.cart_id] = item.user_id
+
+        if touched:
+            # Only unit_price is written, so quantities added concurrently survive
+            with transaction.atomic():
+                CartItem.objects.bulk_update(to_update, ['unit_price', 'updated_at'], batch_size=500)
+                CartItem.objects.filter(pk__in=to_delete).delete()
+                Cart.objects.refresh_totals(touched)
+            for user_id in touched.values():
+                engine.invalidate(user_id)
+
+        stats['repriced'] += len(to_update)
+        stats['removed'] += len(to_delete)
+        touched_carts.update(touched)
+    stats['carts'] = len(touched_carts)
+    return stats
@@ -11,16 +11,41 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
-    total_items = serializers.SerializerMethodField()
-    total_amount = serializers.SerializerMethodField()
+    total_items = serializers.IntegerField(read_only=True)
+    total_amount = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True, coerce_to_string=False)
 
     class Meta:
         model = Cart
         fields = ['id', 'user_id', 'items', 'total_items', 'total_amount', 'created_at', 'updated_at', 'is_active']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
-    def get_total_items(self, obj):
-        return sum(item.quantity for item in obj.items.all())
+class CartOperationSerializer(serializers.Serializer):
+    OPERATIONS = ['add', 'update', 'remove', 'clear']
 
-    def get_total_amount(self, obj):
-        return sum(item.total_price for item in obj.items.all()) 
\ No newline at end of file
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    product_id = serializers.CharField(max_length=100, required=False)
+    quantity = serializers.IntegerField(required=False)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+
+    def validate(self, attrs):
+        op = attrs['op']
+        if op != 'clear' and not attrs.get('product_id'):
+            raise serializers.ValidationError({'product_id': f'Required for {op}.'})
+        if op == 'add':
+            attrs.setdefault('quantity', 1)
+            if attrs['quantity'] < 1:
+                raise serializers.ValidationError({'quantity': 'Must be at least 1 for add.'})
+            if attrs.get('unit_price') is None:
+                raise serializers.ValidationError({'unit_price': 'Required for add.'})
+        elif op == 'update' and attrs.get('quantity') is None:
+            raise serializers.ValidationError({'quantity': 'Required for update.'})
+        return attrs
+
+class CartApplySerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+
+class CheckoutSerializer(serializers.Serializer):
+    shipping_address = serializers.CharField()
+    billing_address = serializers.CharField(required=False)
+    # The cart only knows product ids; names can be passed along for the order
+    product_names = serializers.DictField(child=serializers.CharField(max_length=255), required=False, default=dict)
@@ -1,3 +1,531 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .cache_backends import PinnedLocMemCache
+from .checkout import BaseOrdersClient, LocalOrdersClient, OrdersServiceError, get_orders_client
+from .engines import CacheCartEngine, get_cart_engine
+from .pricing import BaseCatalogClient, get_catalog_client
+from .models import Cart, CartItem
+
+
+class CartApiMixin:
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.cart = Cart.objects.create(user_id='u1')
+        self.url = '/api/carts/u1/'
+
+    def add(self, product_id, quantity=1, unit_price='10.00'):
+        return self.client.post(
+            f'{self.url}add_item/',
+            {'product_id': product_id, 'quantity': quantity, 'unit_price': unit_price},
+            format='json'
+        )
+
+    def stored_items(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+
+
+@override_settings(CART_ENGINE='cart.engines.CacheCartEngine', CART_FLUSH_INTERVAL=3600, CART_FLUSH_BATCH_SIZE=100)
+class CacheCartEngineTests(CartApiMixin, TestCase):
+
+    def test_mutations_are_written_behind(self):
+        self.add('p1', 2)
+        self.add('p2', 1)
+        self.add('p1', 1)
+        self.client.post(f'{self.url}update_item/', {'product_id': 'p2', 'quantity': 4}, format='json')
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['total_items'], 7)
+        self.assertEqual(response.data['total_amount'], Decimal('70.00'))
+        self.assertEqual(self.stored_items(), {})
+
+        self.assertEqual(get_cart_engine().flush(), 1)
+        self.assertEqual(self.stored_items(), {'p1': 3, 'p2': 4})
+
+        self.client.post(f'{self.url}remove_item/', {'product_id': 'p1'}, format='json')
+        get_cart_engine().flush()
+        self.assertEqual(self.stored_items(), {'p2': 4})
+
+    def test_missing_item(self):
+        response = self.client.post(f'{self.url}remove_item/', {'product_id': 'nope'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get_from_cache(self):
+        self.add('p1')
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.add('p1')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_apply_batch(self):
+        self.add('p1', 2)
+        response = self.client.post(f'{self.url}apply/', {'operations': [
+            {'op': 'add', 'product_id': 'p2', 'quantity': 3, 'unit_price': '4.00'},
+            {'op': 'update', 'product_id': 'p1', 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.data['total_items'], 4)
+        self.assertEqual(response.data['total_amount'], Decimal('22.00'))
+
+        response = self.client.post(f'{self.url}apply/', {'operations': [
+            {'op': 'remove', 'product_id': 'p2'},
+            {'op': 'remove', 'product_id': 'nope'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(self.url).data['total_items'], 4)
+
+        get_cart_engine().flush()
+        self.assertEqual(self.stored_items(), {'p1': 1, 'p2': 3})
+
+    def test_concurrent_adds_are_serialized(self):
+        self.client.get(self.url)
+        engine = get_cart_engine()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda n: engine.add_item('u1', 'p1', 1, Decimal('2.00')), range(40)))
+        self.assertEqual(self.client.get(self.url).data['total_items'], 40)
+        engine.flush()
+        self.assertEqual(self.stored_items(), {'p1': 40})
+
+    def test_change_during_flush_stays_dirty(self):
+        self.add('p1', 1)
+        engine = get_cart_engine()
+        write = engine.write
+
+        def write_then_change(states):
+            failed = write(states)
+            engine.add_item('u1', 'p2', 1, Decimal('1.00'))
+            return failed
+
+        with mock.patch.object(engine, 'write', write_then_change):
+            self.assertEqual(engine.flush(), 1)
+        self.assertEqual(self.stored_items(), {'p1': 1})
+        self.assertEqual(engine.flush(), 1)
+        self.assertEqual(self.stored_items(), {'p1': 1, 'p2': 1})
+        self.assertEqual(engine.flush(), 0)
+
+    def test_bad_cart_does_not_block_the_flush(self):
+        Cart.objects.create(user_id='u2')
+        self.add('p1', 2)
+        engine = get_cart_engine()
+        engine.add_item('u2', 'p1', 1, Decimal('5.00'))
+        # A state the database refuses (quantity must be positive)
+        state = cache.get('cart:u1')
+        state['items']['p1']['quantity'] = -3
+        cache.set('cart:u1', state, None)
+
+        with self.assertLogs('cart.engines', 'ERROR'):
+            self.assertEqual(engine.flush(), 1)
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart__user_id='u2').values_list('product_id', 'quantity')), {'p1': 1}
+        )
+        self.assertEqual(self.stored_items(), {})
+        self.assertEqual(cache.get('cart:dirty'), {'u1'})
+
+        # The refused cart is retried, and written once it is fixed
+        engine.update_item('u1', 'p1', 4)
+        self.assertEqual(engine.flush(), 1)
+        self.assertEqual(self.stored_items(), {'p1': 4})
+
+    def test_culling_keeps_entries_without_timeout(self):
+        pinned = PinnedLocMemCache('pinned-test', {'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 0}})
+        pinned.set('cart:u1', 'dirty', None)
+        for n in range(50):
+            pinned.set(f'filler:{n}', n, 60)
+        self.assertEqual(pinned.get('cart:u1'), 'dirty')
+        self.assertIsNone(pinned.get('filler:0'))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_culling_cache_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            CacheCartEngine()
+
+
+class AddItemUpsertTests(CartApiMixin, TestCase):
+
+    def test_add_item_upserts(self):
+        self.add('p1', 2, '10.00')
+        # cart lookup, savepoint, upsert, totals, release, cart and items reads
+        with self.assertNumQueries(7):
+            response = self.add('p1', 3, '12.50')
+        self.assertEqual(response.data['items'][0]['quantity'], 5)
+        self.assertEqual(response.data['items'][0]['unit_price'], '12.50')
+        self.assertEqual(self.stored_items(), {'p1': 5})
+
+    def test_invalid_items_are_rejected(self):
+        self.add('p1', 2)
+        for body in (
+            {'product_id': 'p1', 'quantity': -3, 'unit_price': '10.00'},
+            {'product_id': 'p1', 'quantity': 0, 'unit_price': '10.00'},
+            {'product_id': 'p1', 'quantity': 1},
+            {'product_id': 'p1', 'quantity': 1, 'unit_price': 'abc'},
+            {'quantity': 1, 'unit_price': '10.00'},
+        ):
+            response = self.client.post(f'{self.url}add_item/', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+        response = self.client.post(f'{self.url}update_item/', {'product_id': 'p1'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored_items(), {'p1': 2})
+
+
+class CartTotalsTests(CartApiMixin, TestCase):
+
+    def test_totals_follow_item_mutations(self):
+        self.add('p1', 2, '10.00')
+        self.add('p2', 1, '5.50')
+        self.add('p1', 1, '12.00')
+        self.client.post(f'{self.url}update_item/', {'product_id': 'p2', 'quantity': 3}, format='json')
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.total_amount), (6, Decimal('52.50')))
+
+        response = self.client.post(f'{self.url}remove_item/', {'product_id': 'p1'}, format='json')
+        self.assertEqual((response.data['total_items'], response.data['total_amount']), (3, Decimal('16.50')))
+
+        response = self.client.post(f'{self.url}clear/', format='json')
+        self.assertEqual((response.data['total_items'], response.data['total_amount']), (0, Decimal('0')))
+
+    def test_list_runs_constant_queries(self):
+        for n in range(10):
+            Cart.objects.create(user_id=f'list-{n}')
+            self.client.post(
+                f'/api/carts/list-{n}/add_item/',
+                {'product_id': 'p1', 'quantity': 2, 'unit_price': '3.00'},
+                format='json'
+            )
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/carts/')
+        self.assertEqual(len(response.data), 11)
+        self.assertEqual(response.data[-1]['total_items'], 2)
+
+
+class ApplyOperationsTests(CartApiMixin, TestCase):
+
+    def apply(self, operations):
+        return self.client.post(f'{self.url}apply/', {'operations': operations}, format='json')
+
+    def test_operations_apply_in_order(self):
+        self.add('p1', 2, '10.00')
+        self.add('p2', 1, '5.00')
+        response = self.apply([
+            {'op': 'add', 'product_id': 'p3', 'unit_price': '1.00'},
+            {'op': 'add', 'product_id': 'p1', 'quantity': 1, 'unit_price': '9.00'},
+            {'op': 'update', 'product_id': 'p2', 'quantity': 4},
+            {'op': 'remove', 'product_id': 'p3'},
+            {'op': 'add', 'product_id': 'p4', 'quantity': 2, 'unit_price': '2.50'},
+            {'op': 'update', 'product_id': 'p4', 'quantity': 0},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored_items(), {'p1': 3, 'p2': 4})
+        self.assertEqual(response.data['total_items'], 7)
+        self.assertEqual(response.data['total_amount'], Decimal('47.00'))
+
+        response = self.apply([{'op': 'clear'}, {'op': 'add', 'product_id': 'p5', 'unit_price': '3.00'}])
+        self.assertEqual(self.stored_items(), {'p5': 1})
+        self.assertEqual(response.data['total_amount'], Decimal('3.00'))
+
+    def test_failed_operation_rolls_back_the_batch(self):
+        self.add('p1', 2)
+        response = self.apply([
+            {'op': 'remove', 'product_id': 'p1'},
+            {'op': 'update', 'product_id': 'missing', 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['product_id'], 'missing')
+        self.assertEqual(self.stored_items(), {'p1': 2})
+
+    def test_invalid_operations(self):
+        self.assertEqual(self.apply([]).status_code, 400)
+        self.assertEqual(self.apply([{'op': 'add', 'product_id': 'p1'}]).status_code, 400)
+        self.assertEqual(self.apply([{'op': 'explode'}]).status_code, 400)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        for n in range(5):
+            self.add(f'old-{n}')
+        operations = (
+            [{'op': 'add', 'product_id': f'new-{n}', 'unit_price': '1.00'} for n in range(20)]
+            + [{'op': 'update', 'product_id': f'old-{n}', 'quantity': 3} for n in range(3)]
+            + [{'op': 'remove', 'product_id': f'old-{n}'} for n in range(3, 5)]
+        )
+        # cart lookup, savepoint, items read, insert, update, delete, totals,
+        # release, cart and items reads
+        with self.assertNumQueries(10):
+            response = self.apply(operations)
+        self.assertEqual(response.data['total_items'], 29)
+
+
+class ConditionalGetTests(CartApiMixin, TestCase):
+
+    def test_etag_changes_with_items(self):
+        self.add('p1')
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        # one indexed cart lookup, no items read and no render
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        for mutate in (
+            lambda: self.add('p2'),
+            lambda: self.client.post(f'{self.url}update_item/', {'product_id': 'p2', 'quantity': 5}, format='json'),
+            lambda: self.client.post(f'{self.url}remove_item/', {'product_id': 'p2'}, format='json'),
+            lambda: self.client.post(f'{self.url}apply/', {'operations': [{'op': 'clear'}]}, format='json'),
+        ):
+            mutate()
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+
+class ActiveCartTests(CartApiMixin, TestCase):
+
+    def test_create_returns_the_active_cart(self):
+        response = self.client.post('/api/carts/', {'user_id': 'u2'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        # active cart lookup and its items
+        with self.assertNumQueries(2):
+            again = self.client.post('/api/carts/', {'user_id': 'u2'}, format='json')
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['id'], response.data['id'])
+        self.assertEqual(self.client.post('/api/carts/', {}, format='json').status_code, 400)
+
+    def test_one_active_cart_per_user(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cart.objects.create(user_id='u1')
+        Cart.objects.filter(pk=self.cart.pk).update(is_active=False)
+        Cart.objects.create(user_id='u1')
+        Cart.objects.create(user_id='u1', is_active=False)
+        self.assertEqual(Cart.objects.filter(user_id='u1').count(), 3)
+
+
+class UnavailableOrdersClient(BaseOrdersClient):
+
+    def create_order(self, payload, idempotency_key):
+        raise OrdersServiceError('Orders service unreachable')
+
+
+class ConcurrentChangeOrdersClient(LocalOrdersClient):
+    """Adds an item to the cart while the order is being placed."""
+
+    def create_order(self, payload, idempotency_key):
+        order = super().create_order(payload, idempotency_key)
+        get_cart_engine().add_item(str(payload['user_id']), '99', 1, Decimal('1.00'))
+        return order
+
+
+@override_settings(ORDERS_SERVICE={'BACKEND': 'cart.checkout.LocalOrdersClient'})
+class CheckoutTests(CartApiMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # The orders service only takes numeric user and product ids
+        self.cart = Cart.objects.create(user_id='7')
+        self.url = '/api/carts/7/'
+        get_orders_client().orders.clear()
+
+    def checkout(self, **headers):
+        return self.client.post(f'{self.url}checkout/', {
+            'shipping_address': '1 Ship St',
+            'product_names': {'1': 'Widget'},
+        }, format='json', **headers)
+
+    def test_checkout_places_order_and_deactivates_cart(self):
+        self.add('1', 2, '10.00')
+        self.add('2', 1, '4.50')
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        order = response.data['order']
+        self.assertEqual(order['total_amount'], '24.50')
+        self.assertEqual(order['billing_address'], '1 Ship St')
+        self.assertEqual(order['user_id'], 7)
+        self.assertEqual(
+            [(item['product_id'], item['product_name'], item['quantity']) for item in order['items']],
+            [(1, 'Widget', 2), (2, '2', 1)]
+        )
+        self.cart.refresh_from_db()
+        self.assertFalse(self.cart.is_active)
+        self.assertEqual(self.checkout().status_code, 404)
+
+    def test_retry_with_same_key_gets_same_order(self):
+        self.add('1')
+        first = self.checkout(HTTP_IDEMPOTENCY_KEY='k1')
+        # As if the response was lost before the cart was deactivated
+        Cart.objects.filter(pk=self.cart.pk).update(is_active=True)
+        again = self.checkout(HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(again.data['order']['id'], first.data['order']['id'])
+        self.assertEqual(len(get_orders_client().orders), 1)
+
+    def test_empty_cart(self):
+        self.assertEqual(self.checkout().status_code, 400)
+
+    def test_non_numeric_ids_are_not_sent(self):
+        self.add('1')
+        self.add('legacy-sku')
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['product_ids'], ['legacy-sku'])
+
+        self.url = '/api/carts/u1/'
+        self.add('1')
+        self.assertEqual(self.checkout().status_code, 400)
+        self.assertEqual(get_orders_client().orders, {})
+
+    def test_local_client_applies_the_orders_contract(self):
+        with self.assertRaises(OrdersServiceError) as raised:
+            get_orders_client().create_order({'user_id': 'u1', 'shipping_address': 'x', 'items': []}, 'k')
+        self.assertEqual(raised.exception.status_code, 400)
+        self.assertEqual(set(raised.exception.detail), {'user_id', 'billing_address'})
+
+    @override_settings(ORDERS_SERVICE={'BACKEND': 'cart.tests.ConcurrentChangeOrdersClient'})
+    def test_cart_changed_during_checkout_stays_active(self):
+        self.add('1', 2)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([item['product_id'] for item in response.data['order']['items']], [1])
+        self.cart.refresh_from_db()
+        self.assertTrue(self.cart.is_active)
+        self.assertEqual(self.stored_items(), {'1': 2, '99': 1})
+
+    @override_settings(ORDERS_SERVICE={'BACKEND': 'cart.tests.UnavailableOrdersClient'})
+    def test_cart_stays_active_when_orders_service_fails(self):
+        self.add('1')
+        self.assertEqual(self.checkout().status_code, 502)
+        self.cart.refresh_from_db()
+        self.assertTrue(self.cart.is_active)
+
+
+class FakeCatalogClient(BaseCatalogClient):
+    """Every product n costs n/100, except those listed in `inactive` or `gone`."""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.calls = []
+        self.inactive = set()
+        self.gone = set()
+
+    def fetch_prices(self, product_ids):
+        self.calls.append(list(product_ids))
+        return {
+            product_id: (Decimal(product_id) / 100, product_id not in self.inactive)
+            for product_id in product_ids
+            if product_id not in self.gone
+        }
+
+
+@override_settings(PRODUCT_CATALOG={'BACKEND': 'cart.tests.FakeCatalogClient', 'OPTIONS': {'batch_size': 100}})
+class RepriceTests(CartApiMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.catalog = get_catalog_client()
+        self.catalog.calls.clear()
+        self.catalog.inactive.clear()
+        self.catalog.gone.clear()
+
+    def test_reprice_cart(self):
+        self.add('250', 2, '1.00')
+        self.add('300', 1, '3.00')
+        self.add('400', 1, '1.00')
+        self.add('legacy-sku', 1, '7.00')
+        self.catalog.inactive.add('400')
+
+        response = self.client.post(f'{self.url}reprice/')
+        self.assertEqual(
+            {item['product_id']: item['unit_price'] for item in response.data['items']},
+            {'250': '2.50', '300': '3.00', 'legacy-sku': '7.00'}
+        )
+        self.assertEqual(response.data['total_amount'], Decimal('15.00'))
+        self.assertEqual(self.catalog.calls, [['250', '300', '400']])
+
+    @override_settings(CART_ENGINE='cart.engines.CacheCartEngine', CART_FLUSH_INTERVAL=3600)
+    def test_reprice_cart_flushes_only_that_cart(self):
+        other = Cart.objects.create(user_id='u2')
+        self.client.post('/api/carts/u2/add_item/', {'product_id': '100', 'quantity': 1, 'unit_price': '5.00'}, format='json')
+        self.add('250', 2, '1.00')
+
+        response = self.client.post(f'{self.url}reprice/')
+        self.assertEqual(response.data['total_amount'], Decimal('5.00'))
+        self.assertEqual(self.stored_items(), {'250': 2})
+        self.assertFalse(CartItem.objects.filter(cart=other).exists())
+        self.assertEqual(get_cart_engine().flush(), 1)
+
+    def test_catalog_calls_scale_with_products_not_items(self):
+        for n in range(30):
+            cart = Cart.objects.create(user_id=f'reprice-{n}')
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product_id=str(product_id), quantity=1, unit_price=Decimal('9.99'))
+                for product_id in range(n * 5, n * 5 + 50)
+            ])
+        self.catalog.gone.add('0')
+
+        call_command('reprice_carts', chunk_size=500, stdout=StringIO())
+        # 1,500 items over 195 distinct products: two calls of at most 100
+        self.assertEqual(len(self.catalog.calls), 2)
+        self.assertEqual(CartItem.objects.filter(product_id='0').count(), 0)
+        cart = Cart.objects.get(user_id='reprice-1')
+        self.assertEqual(cart.total_amount, sum(Decimal(n) / 100 for n in range(5, 55)))
+
+
+class PurgeCartsTests(CartApiMixin, TestCase):
+
+    def test_expired_carts_are_deactivated_then_deleted(self):
+        self.add('p1')
+        stale = []
+        for n in range(5):
+            cart = Cart.objects.create(user_id=f'stale-{n}')
+            CartItem.objects.create(cart=cart, product_id='p1', quantity=1, unit_price=Decimal('1.00'))
+            stale.append(cart.pk)
+        Cart.objects.filter(pk__in=stale).update(updated_at=timezone.now() - timedelta(days=40))
+
+        out = StringIO()
+        call_command('purge_carts', days=30, batch_size=2, limit=3, stdout=out)
+        self.assertIn('deleted 3 carts and 3 items', out.getvalue())
+        self.assertEqual(Cart.objects.filter(pk__in=stale, is_active=True).count(), 0)
+
+        # A second run picks up what the limit left behind
+        call_command('purge_carts', days=30, batch_size=2, stdout=StringIO())
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [self.cart.pk])
+        self.assertEqual(self.stored_items(), {'p1': 1})
+
+
+class ConcurrentAddItemTests(CartApiMixin, TransactionTestCase):
+    """
+    Runs requests on several connections at once, so it needs a database
+    that is not in memory: MySQL, PostgreSQL or a file-backed SQLite test
+    database (DATABASES['default']['TEST']['NAME']).
+    """
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a database shared between connections')
+        super().setUp()
+
+    def test_parallel_adds_keep_every_increment(self):
+        adds, workers = 300, 16
+
+        def add_one(_):
+            try:
+                return self.add('p1', 1).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            statuses = list(pool.map(add_one, range(adds)))
+
+        self.assertEqual(statuses, [200] * adds)
+        self.assertEqual(self.stored_items(), {'p1': adds})
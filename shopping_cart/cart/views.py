@@ -1,12 +1,20 @@
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_etags, quote_etag
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
+from .checkout import OrdersServiceError, get_orders_client
+from .engines import CartItemNotFound, get_cart_engine
 from .models import Cart, CartItem
-from .serializers import CartSerializer, CartItemSerializer
+from .pricing import CatalogError, reprice_carts
+from .serializers import (
+    CartApplySerializer, CartItemSerializer, CartOperationSerializer, CartSerializer, CheckoutSerializer
+)
 
 # Create your views here.
 
@@ -19,7 +27,44 @@ class CartViewSet(viewsets.ModelViewSet):
     lookup_field = 'user_id'
 
     def get_queryset(self):
-        return Cart.objects.filter(is_active=True)
+        return Cart.objects.filter(is_active=True).prefetch_related('items')
+
+    @property
+    def cart_engine(self):
+        return get_cart_engine()
+
+    def retrieve(self, request, *args, **kwargs):
+        user_id = kwargs[self.lookup_field]
+        version, updated_at = self.cart_engine.version(user_id)
+        headers = {'ETag': quote_etag(version), 'Last-Modified': http_date(updated_at.timestamp())}
+
+        # Only If-None-Match is honoured: Last-Modified has one-second
+        # resolution, too coarse to tell apart changes made within a second.
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            etags = parse_etags(if_none_match)
+            if '*' in etags or headers['ETag'] in etags:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(self.cart_engine.represent(user_id), headers=headers)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        self.cart_engine.invalidate(serializer.instance.user_id)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        self.cart_engine.invalidate(instance.user_id)
+
+    def validate_operation(self, request, op):
+        """
+        Validate a single-item request with the same rules as an ``apply``
+        operation, so a bad body is a 400 instead of a bad row.
+        """
+        data = dict(request.data.items()) if hasattr(request.data, 'items') else {}
+        serializer = CartOperationSerializer(data={**data, 'op': op})
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
 
     @swagger_auto_schema(
         operation_description="Add an item to the cart",
@@ -36,27 +81,11 @@ class CartViewSet(viewsets.ModelViewSet):
     )
     @action(detail=True, methods=['post'])
     def add_item(self, request, user_id=None):
-        cart = self.get_object()
-        
-        product_id = request.data.get('product_id')
-        quantity = int(request.data.get('quantity', 1))
-        unit_price = float(request.data.get('unit_price'))
-
-        try:
-            cart_item = CartItem.objects.get(cart=cart, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.unit_price = unit_price
-            cart_item.save()
-        except CartItem.DoesNotExist:
-            CartItem.objects.create(
-                cart=cart,
-                product_id=product_id,
-                quantity=quantity,
-                unit_price=unit_price
-            )
+        operation = self.validate_operation(request, 'add')
 
-        serializer = self.get_serializer(cart)
-        return Response(serializer.data)
+        return Response(self.cart_engine.add_item(
+            user_id, operation['product_id'], operation['quantity'], operation['unit_price']
+        ))
 
     @swagger_auto_schema(
         operation_description="Update item quantity in the cart",
@@ -75,26 +104,16 @@ class CartViewSet(viewsets.ModelViewSet):
     )
     @action(detail=True, methods=['post'])
     def update_item(self, request, user_id=None):
-        cart = self.get_object()
-        product_id = request.data.get('product_id')
-        quantity = int(request.data.get('quantity'))
+        operation = self.validate_operation(request, 'update')
 
         try:
-            cart_item = CartItem.objects.get(cart=cart, product_id=product_id)
-            if quantity > 0:
-                cart_item.quantity = quantity
-                cart_item.save()
-            else:
-                cart_item.delete()
-        except CartItem.DoesNotExist:
+            return Response(self.cart_engine.update_item(user_id, operation['product_id'], operation['quantity']))
+        except CartItemNotFound:
             return Response(
                 {'error': 'Item not found in cart'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        serializer = self.get_serializer(cart)
-        return Response(serializer.data)
-
     @swagger_auto_schema(
         operation_description="Remove an item from the cart",
         request_body=openapi.Schema(
@@ -111,31 +130,146 @@ class CartViewSet(viewsets.ModelViewSet):
     )
     @action(detail=True, methods=['post'])
     def remove_item(self, request, user_id=None):
-        cart = self.get_object()
         product_id = request.data.get('product_id')
 
         try:
-            cart_item = CartItem.objects.get(cart=cart, product_id=product_id)
-            cart_item.delete()
-        except CartItem.DoesNotExist:
+            return Response(self.cart_engine.remove_item(user_id, product_id))
+        except CartItemNotFound:
             return Response(
                 {'error': 'Item not found in cart'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        serializer = self.get_serializer(cart)
-        return Response(serializer.data)
-
     @swagger_auto_schema(
         operation_description="Clear all items from the cart",
         responses={200: CartSerializer}
     )
     @action(detail=True, methods=['post'])
     def clear(self, request, user_id=None):
-        cart = self.get_object()
-        cart.items.all().delete()
-        serializer = self.get_serializer(cart)
-        return Response(serializer.data)
+        return Response(self.cart_engine.clear(user_id))
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Apply an ordered batch of add/update/remove/clear operations to the "
+            "cart in one transaction. If any operation fails, none are applied."
+        ),
+        request_body=CartApplySerializer,
+        responses={
+            200: CartSerializer,
+            400: 'Invalid operations',
+            404: 'Item not found in cart'
+        }
+    )
+    @action(detail=True, methods=['post'])
+    def apply(self, request, user_id=None):
+        serializer = CartApplySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            return Response(self.cart_engine.apply(user_id, serializer.validated_data['operations']))
+        except CartItemNotFound as exc:
+            return Response(
+                {'error': 'Item not found in cart', 'product_id': exc.args[0]},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Refresh item prices from the product catalog and remove products "
+            "that are no longer available"
+        ),
+        responses={
+            200: CartSerializer,
+            502: 'Product catalog unavailable'
+        }
+    )
+    @action(detail=True, methods=['post'])
+    def reprice(self, request, user_id=None):
+        cart = get_object_or_404(Cart.objects.only('id'), user_id=user_id, is_active=True)
+        try:
+            reprice_carts([cart.id])
+        except CatalogError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(self.cart_engine.represent(user_id))
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Place an order for the cart's current contents with the orders "
+            "service and deactivate the cart. Retries of the same cart contents "
+            "return the same order; pass an Idempotency-Key header to choose the key."
+        ),
+        request_body=CheckoutSerializer,
+        responses={
+            201: 'Order created',
+            400: 'Empty cart, non-numeric ids or order rejected',
+            409: 'Cart changed while the order was placed',
+            502: 'Orders service unavailable'
+        }
+    )
+    @action(detail=True, methods=['post'])
+    def checkout(self, request, user_id=None):
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        # Write-behind changes reach the database first, so the snapshot's
+        # updated_at is the one the deactivation below is guarded on
+        self.cart_engine.invalidate(user_id)
+        cart = self.cart_engine.represent(user_id)
+        if not cart['items']:
+            return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The orders service keys users and products by integer id
+        product_ids = [item['product_id'] for item in cart['items']]
+        invalid = [product_id for product_id in product_ids if not str(product_id).isdigit()]
+        if not str(cart['user_id']).isdigit() or invalid:
+            return Response(
+                {
+                    'error': 'Only numeric user and product ids can be ordered',
+                    'user_id': cart['user_id'],
+                    'product_ids': invalid,
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # The default key names this cart at this version, so a retry after a
+        # lost response gets the same order while a changed cart gets a new one.
+        idempotency_key = request.headers.get('Idempotency-Key') or f"cart-{cart['id']}-{cart['updated_at']}"
+        payload = {
+            'user_id': int(cart['user_id']),
+            'shipping_address': data['shipping_address'],
+            'billing_address': data.get('billing_address', data['shipping_address']),
+            'items': [
+                {
+                    'product_id': int(item['product_id']),
+                    'product_name': data['product_names'].get(item['product_id'], item['product_id']),
+                    'quantity': item['quantity'],
+                    'unit_price': item['unit_price'],
+                }
+                for item in cart['items']
+            ],
+        }
+        try:
+            order = get_orders_client().create_order(payload, idempotency_key)
+        except OrdersServiceError as exc:
+            # Validation errors are the caller's to fix; anything else is ours
+            rejected = exc.status_code == status.HTTP_400_BAD_REQUEST
+            return Response(
+                {'error': str(exc), 'detail': exc.detail},
+                status=status.HTTP_400_BAD_REQUEST if rejected else status.HTTP_502_BAD_GATEWAY
+            )
+
+        deactivated = Cart.objects.filter(
+            pk=cart['id'], is_active=True, updated_at=parse_datetime(cart['updated_at'])
+        ).update(is_active=False, updated_at=timezone.now())
+        self.cart_engine.invalidate(user_id)
+        if not deactivated:
+            # The order covers the snapshot; the cart keeps the later changes
+            return Response(
+                {'error': 'Cart changed during checkout', 'cart_id': cart['id'], 'order': order},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response({'cart_id': cart['id'], 'order': order}, status=status.HTTP_201_CREATED)
 
     @swagger_auto_schema(
         operation_description="Create a new cart or get existing cart for a user",
@@ -152,17 +286,15 @@ class CartViewSet(viewsets.ModelViewSet):
         }
     )
     def create(self, request, *args, **kwargs):
-        user_id = request.data.get('user_id')
-        
-        # Check if an active cart already exists for the user
-        existing_cart = Cart.objects.filter(user_id=user_id, is_active=True).first()
-        if existing_cart:
-            serializer = self.get_serializer(existing_cart)
-            return Response(serializer.data)
-
-        # Create new cart if none exists
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+        # One indexed lookup when the user already has an active cart. Two
+        # concurrent creates can't both insert: the loser hits the
+        # one-active-cart constraint and get_or_create re-reads the winner's.
+        cart, created = self.get_queryset().get_or_create(user_id=serializer.validated_data['user_id'])
+        if not created:
+            return Response(self.get_serializer(cart).data)
+
+        data = self.get_serializer(cart).data
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
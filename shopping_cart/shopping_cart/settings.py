@@ -150,3 +150,50 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.JSONParser',
     ],
 }
+
+# CacheCartEngine keeps unflushed carts here, so the cache must never evict
+# entries stored without a timeout: PinnedLocMemCache, or a shared cache
+# such as Redis with maxmemory-policy noeviction.
+CACHES = {
+    'default': {
+        'BACKEND': 'cart.cache_backends.PinnedLocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+# Cart storage engine: 'cart.engines.DatabaseCartEngine' reads and writes
+# the database on every call, 'cart.engines.CacheCartEngine' keeps active
+# carts in CACHES[CART_CACHE_ALIAS] and flushes changes in batches.
+CART_ENGINE = os.getenv('CART_ENGINE', 'cart.engines.DatabaseCartEngine')
+CART_CACHE_ALIAS = 'default'
+CART_CACHE_TIMEOUT = 60 * 60 * 24
+CART_FLUSH_BATCH_SIZE = int(os.getenv('CART_FLUSH_BATCH_SIZE', '100'))
+CART_FLUSH_INTERVAL = float(os.getenv('CART_FLUSH_INTERVAL', '5'))
+
+# Carts not modified for this many days are deactivated and then deleted
+# by `manage.py purge_carts`
+CART_INACTIVITY_TTL_DAYS = int(os.getenv('CART_INACTIVITY_TTL_DAYS', '30'))
+
+# Where checkout sends orders. 'cart.checkout.LocalOrdersClient' keeps them
+# in memory instead, for tests and local development.
+ORDERS_SERVICE = {
+    'BACKEND': os.getenv('ORDERS_SERVICE_BACKEND', 'cart.checkout.HttpOrdersClient'),
+    'OPTIONS': {
+        'url': os.getenv('ORDERS_SERVICE_URL', 'http://localhost:8001/api/orders/'),
+        'headers': (
+            {'Authorization': os.getenv('ORDERS_SERVICE_AUTHORIZATION')}
+            if os.getenv('ORDERS_SERVICE_AUTHORIZATION') else {}
+        ),
+    },
+}
+
+# Catalog price lookups for cart repricing, cached in CACHES[CART_CACHE_ALIAS]
+# for CATALOG_PRICE_CACHE_TIMEOUT seconds
+PRODUCT_CATALOG = {
+    'BACKEND': 'cart.pricing.HttpCatalogClient',
+    'OPTIONS': {
+        'url': os.getenv('PRODUCT_CATALOG_PRICES_URL', 'http://localhost:8002/api/products/prices/'),
+        'batch_size': 1000,
+    },
+}
+CATALOG_PRICE_CACHE_TIMEOUT = int(os.getenv('CATALOG_PRICE_CACHE_TIMEOUT', '60'))